@@ -0,0 +1,346 @@
+#!python3
+r""" index_advisor.py - suggest the indexes a query workload needs on the init.sql schema
+
+Parses the schema into sql2puml.SqlTable objects and every query of --queries_file with sqlglot, and
+collects for each table a query reads the columns it is joined on, filtered on and ordered by.
+A candidate index is the equality columns followed by one range column, or by the order columns
+when there is no range. Candidates the primary key, a UNIQUE column, an index in the schema or a longer
+candidate already cover are dropped, and the rest are printed as CREATE INDEX DDL.
+
+The schema is then loaded into a synthetic SQLite database of --sessions weekly sessions, and every
+query is run before and after the suggested indexes are created, printing its EXPLAIN QUERY PLAN and
+median time each way. --puml_file writes the sql2puml diagram with the suggested indexes added.
+
+Each query in --queries_file is preceded by comments naming it and giving its params as a JSON list
+    -- name: /tune
+    -- params: [7]
+
+Dependencies
+    py -m pip install sqlglot
+
+"""
+import argparse
+import collections
+import datetime
+import json
+import pathlib
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import sqlglot
+from sqlglot.optimizer.scope import traverse_scope
+from sql2puml import SqlTable, schema_puml
+
+range_predicates = (
+    sqlglot.expressions.Between,
+    sqlglot.expressions.GT,
+    sqlglot.expressions.GTE,
+    sqlglot.expressions.LT,
+    sqlglot.expressions.LTE,
+)
+
+
+class WorkloadQuery:
+    def __init__(self, statement):
+        self.statement = statement
+        self.name = None
+        self.params = list()
+        for comment in statement.comments or []:
+            key, _, value = comment.strip().partition(":")
+            if key == "name":
+                self.name = value.strip()
+            elif key == "params":
+                self.params = json.loads(value)
+        self.sql = statement.sql(dialect="sqlite")
+        if self.name is None:
+            self.name = self.sql[:40]
+
+    @classmethod
+    def parse_sql_file(cls, sql_file_path):
+        with open(sql_file_path, 'r') as f:
+            sql_content = f.read()
+        for statement in sqlglot.parse(sql_content, read="sqlite"):
+            if statement is not None:
+                yield cls(statement)
+
+
+class Candidate:
+    """An index one query would use, equality columns in any order followed by the ordered tail"""
+
+    def __init__(self, table, equality, tail, query_name, reason):
+        self.table = table
+        self.equality = list(dict.fromkeys(equality))
+        self.tail = [column for column in dict.fromkeys(tail) if column not in self.equality]
+        self.queries = {query_name: reason}
+        self.replaces = None  # name of a schema index this one extends
+
+    @property
+    def columns(self):
+        return self.equality + self.tail
+
+    def covered_by(self, columns):
+        """True when an index on columns serves this candidate as well as an index on exactly its own columns"""
+        columns = list(columns)
+        width = len(self.equality)
+        return (len(columns) >= len(self.columns)
+                and set(columns[:width]) == set(self.equality)
+                and columns[width:len(self.columns)] == self.tail)
+
+    @property
+    def name(self):
+        return f"{self.table}_{'_'.join(self.columns)}"
+
+    def ddl(self):
+        return f"CREATE INDEX IF NOT EXISTS {self.name} ON {self.table}({', '.join(self.columns)});"
+
+
+def conjuncts(condition):
+    if condition is None:
+        return
+    if isinstance(condition, sqlglot.expressions.And):
+        yield from conjuncts(condition.this)
+        yield from conjuncts(condition.expression)
+    elif isinstance(condition, sqlglot.expressions.Paren):
+        yield from conjuncts(condition.this)
+    else:
+        yield condition
+
+
+def query_candidates(query, sql_tables):
+    """Candidate indexes of one WorkloadQuery, [Candidate, ...]"""
+    candidates = list()
+    for scope in traverse_scope(query.statement):
+        # alias : table name, for the real tables of this SELECT
+        aliases = {alias: source.name for alias, source in scope.sources.items()
+                   if isinstance(source, sqlglot.expressions.Table) and source.name in sql_tables}
+        if not aliases:
+            continue
+
+        def resolve(column):
+            """(alias, column name) of a column of one of the tables, None for anything else"""
+            if not isinstance(column, sqlglot.expressions.Column):
+                return None
+            if column.table:
+                return (column.table, column.name) if column.table in aliases else None
+            owners = [alias for alias, table in aliases.items() if column.name in sql_tables[table].fields]
+            return (owners[0], column.name) if len(owners) == 1 else None
+
+        equality = collections.defaultdict(list)  # alias : [column, ...] compared to a value
+        ranges = collections.defaultdict(list)  # alias : [column, ...]
+        joins = collections.defaultdict(list)  # alias : [column, ...] compared to another table's column
+        order = collections.defaultdict(list)  # alias : [column, ...]
+
+        select = scope.expression
+        conditions = list(conjuncts(select.args.get('where') and select.args['where'].this))
+        for join in select.args.get('joins') or []:
+            conditions.extend(conjuncts(join.args.get('on')))
+        for condition in conditions:
+            if isinstance(condition, sqlglot.expressions.EQ):
+                left, right = resolve(condition.this), resolve(condition.expression)
+                if left and right and left[0] != right[0]:
+                    joins[left[0]].append(left[1])
+                    joins[right[0]].append(right[1])
+                elif left and not condition.expression.find(sqlglot.expressions.Column):
+                    equality[left[0]].append(left[1])
+                elif right and not condition.this.find(sqlglot.expressions.Column):
+                    equality[right[0]].append(right[1])
+            elif isinstance(condition, sqlglot.expressions.In):
+                column = resolve(condition.this)
+                if column:
+                    equality[column[0]].append(column[1])
+            elif isinstance(condition, range_predicates):
+                column = resolve(condition.this)
+                if column:
+                    ranges[column[0]].append(column[1])
+        for ordered in (select.args.get('order') and select.args['order'].expressions) or []:
+            column = resolve(ordered.this)
+            if column:
+                order[column[0]].append(column[1])
+
+        for alias, table in aliases.items():
+            if equality[alias] or ranges[alias]:
+                tail = ranges[alias][:1] or order[alias]
+                reason = "filter" + (" and order" if order[alias] and not ranges[alias] else "")
+                candidates.append(Candidate(table, equality[alias], tail, query.name, reason))
+            else:
+                # Without filters of its own the table is looked up from the other side of each join
+                for column in joins[alias]:
+                    candidates.append(Candidate(table, [column], [], query.name, "join"))
+    return candidates
+
+
+def existing_indexes(sql_table):
+    """Column lists the table can already seek on, the primary key, UNIQUE columns and the schema's indexes"""
+    indexes = [[sql_table.primary_key]] if sql_table.primary_key else []
+    for column in sql_table.statement.find_all(sqlglot.expressions.ColumnDef):
+        if any(isinstance(c.kind, sqlglot.expressions.UniqueColumnConstraint) for c in column.constraints):
+            indexes.append([column.this.name])
+    indexes.extend(sql_table.indexes.values())
+    return indexes
+
+
+def extend_schema_index(candidate, sql_table):
+    """Put the columns of the widest schema index made of the candidate's equality columns first, so the candidate can replace it"""
+    if candidate.tail:
+        return
+    extendable = [(name, columns) for name, columns in sql_table.indexes.items()
+                  if set(columns) < set(candidate.equality)]
+    if extendable:
+        name, columns = max(extendable, key=lambda index: len(index[1]))
+        candidate.equality = columns + [column for column in candidate.equality if column not in columns]
+        candidate.replaces = name
+
+
+def advise(sql_tables, queries):
+    """The indexes the queries lack, [Candidate, ...] with the queries each one serves"""
+    candidates = [candidate for query in queries for candidate in query_candidates(query, sql_tables)]
+    suggestions = list()
+    # Widest first so a narrower candidate is folded into the one that covers it
+    for candidate in sorted(candidates, key=lambda candidate: -len(candidate.columns)):
+        sql_table = sql_tables[candidate.table]
+        if candidate.columns[0] == sql_table.primary_key:
+            continue
+        if any(candidate.covered_by(columns) for columns in existing_indexes(sql_table)):
+            continue
+        extend_schema_index(candidate, sql_table)
+        covering = next((suggestion for suggestion in suggestions
+                         if suggestion.table == candidate.table and candidate.covered_by(suggestion.columns)), None)
+        if covering:
+            for query_name, reason in candidate.queries.items():
+                covering.queries.setdefault(query_name, reason)
+        else:
+            suggestions.append(candidate)
+    return sorted(suggestions, key=lambda suggestion: suggestion.name)
+
+
+def create_synthetic(conn, sql_file, session_count, tune_pool=3000, sets_per_session=12, seed=0):
+    """The schema filled with weekly sessions from 2010 of sets drawn with Zipf popularity"""
+    with open(sql_file, 'r') as f:
+        conn.executescript(f.read())
+    rng = random.Random(seed)
+    weights = [1.0 / rank ** 1.1 for rank in range(1, tune_pool + 1)]
+    modes = ["Dmajor", "Gmajor", "Ador", "Edor", "Emin", "Amajor"]
+    conn.executemany(
+        "INSERT INTO Tune (tune_id, the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url) "
+        "VALUES (?, ?, ?, '', 'reel', '4/4', ?, ?)",
+        [(tune_id, tune_id, f"Tune {tune_id}", rng.choice(modes), f"https://thesession.org/tunes/{tune_id}")
+         for tune_id in range(1, tune_pool + 1)])
+    conn.execute("INSERT INTO Location (location_id, description) VALUES (1, 'Synthetic')")
+    first = datetime.date(2010, 1, 7)
+    sessions, sets, set_to_session, tune_to_set = list(), list(), list(), list()
+    for session_id in range(1, session_count + 1):
+        session_date = (first + datetime.timedelta(days=7 * (session_id - 1))).isoformat()
+        sessions.append((session_id, session_date))
+        for set_index in range(1, sets_per_session + 1):
+            set_id = len(sets) + 1
+            tune_ids = rng.choices(range(1, tune_pool + 1), weights=weights, k=rng.randrange(2, 5))
+            sets.append((set_id, ", ".join(f"Tune {tune_id}" for tune_id in tune_ids)))
+            set_to_session.append((session_id, set_id, set_index))
+            tune_to_set.extend((tune_id, set_id, tune_index) for tune_index, tune_id in enumerate(tune_ids, 1))
+    conn.executemany("INSERT INTO Session (session_id, location_id, session_date) VALUES (?, 1, ?)", sessions)
+    conn.executemany("INSERT INTO SetTable (set_id, description) VALUES (?, ?)", sets)
+    conn.executemany("INSERT INTO SetToSession (session_id, set_id, set_index) VALUES (?, ?, ?)", set_to_session)
+    conn.executemany("INSERT INTO TuneToSet (tune_id, set_id, tune_index) VALUES (?, ?, ?)", tune_to_set)
+    conn.commit()
+
+
+def query_plan(conn, query):
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query.sql}", query.params)]
+
+
+def time_query(conn, query, repeats):
+    timings = list()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        conn.execute(query.sql, query.params).fetchall()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    current_script_dir = current_script_path.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--sql_file",
+        type=pathlib.Path,
+        default=current_script_dir / "init.sql",
+        help="Filepath to the file containing the SQL commands that implement the database schema")
+    parser.add_argument(
+        "--queries_file",
+        type=pathlib.Path,
+        default=current_script_dir / "report_queries.sql",
+        help="Filepath to the file of named queries the indexes are chosen for")
+    parser.add_argument(
+        "--ddl_file",
+        type=pathlib.Path,
+        help="Write the suggested CREATE INDEX statements here as well")
+    parser.add_argument(
+        "--puml_file",
+        type=pathlib.Path,
+        help="Write the PlantUml diagram of the schema with the suggested indexes here")
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=2000,
+        help="Weekly sessions in the synthetic database the queries are timed on, 0 skips timing")
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=5,
+        help="Runs of each query, the median is reported")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    sql_tables = {sql_table.name: sql_table for sql_table in SqlTable.parse_sql_file(args.sql_file)}
+    queries = list(WorkloadQuery.parse_sql_file(args.queries_file))
+    suggestions = advise(sql_tables, queries)
+
+    print(f"{len(suggestions)} indexes suggested for {len(queries)} queries")
+    for suggestion in suggestions:
+        print(suggestion.ddl())
+        if suggestion.replaces:
+            print(f"    -- can replace {suggestion.replaces}")
+        for query_name, reason in suggestion.queries.items():
+            print(f"    -- {reason}: {query_name}")
+    ddl = "\n".join(suggestion.ddl() for suggestion in suggestions)
+    if args.ddl_file:
+        args.ddl_file.write_text(ddl + "\n", encoding='utf-8')
+
+    if args.puml_file:
+        for suggestion in suggestions:
+            sql_tables[suggestion.table].indexes[suggestion.name] = suggestion.columns
+        with args.puml_file.open('w', encoding='utf-8') as f:
+            f.write(schema_puml(list(sql_tables.values())))
+        print(f"Wrote the schema with the suggested indexes to {args.puml_file}")
+
+    if args.sessions:
+        with tempfile.TemporaryDirectory() as temporary_dir:
+            conn = sqlite3.connect(pathlib.Path(temporary_dir) / "workload.db")
+            create_synthetic(conn, args.sql_file, args.sessions)
+            before = {query.name: (query_plan(conn, query), time_query(conn, query, args.repeats)) for query in queries}
+            conn.executescript(ddl)
+            after = {query.name: (query_plan(conn, query), time_query(conn, query, args.repeats)) for query in queries}
+            conn.close()
+        print(f"\nMedian of {args.repeats} runs on {args.sessions} synthetic sessions")
+        for query in queries:
+            (plan_before, seconds_before), (plan_after, seconds_after) = before[query.name], after[query.name]
+            print(f"{query.name}: {seconds_before * 1000:.3f}ms -> {seconds_after * 1000:.3f}ms "
+                  f"({seconds_before / seconds_after:.1f}x)")
+            for label, plan in (("before", plan_before), ("after", plan_after)):
+                print(f"    {label:>6}: {'; '.join(plan)}")
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -25,7 +25,8 @@ CREATE TABLE SetToSession (
 
 CREATE TABLE SetTable (
   set_id INTEGER PRIMARY KEY,
-  description TEXT
+  description TEXT,
+  fingerprint VARCHAR(40) UNIQUE
 );
 
 CREATE TABLE TuneToSet (
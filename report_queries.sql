@@ -0,0 +1,91 @@
+-- The queries the reports and the ingest run against the init.sql schema, the workload index_advisor.py reads.
+-- Each query is named by the comment in front of it, params are the values its placeholders get on the
+-- index_advisor.py synthetic database.
+
+-- name: /top-tunes
+-- params: []
+SELECT t.tune_id, t.name, t.tune_url, COUNT(tts.tune_id) AS tune_count
+FROM Tune t
+JOIN TuneToSet tts ON t.tune_id = tts.tune_id
+GROUP BY t.tune_id, t.name
+ORDER BY tune_count DESC
+LIMIT 50;
+
+-- name: /session
+-- params: [500]
+SELECT s.*
+FROM SetTable s
+JOIN SetToSession st ON s.set_id = st.set_id
+WHERE st.session_id = ? AND s.set_id != 1;
+
+-- name: /sets-in-range
+-- params: ["2015-01-01", "2015-12-31"]
+SELECT s.*
+FROM SetTable s
+JOIN SetToSession st ON s.set_id = st.set_id
+JOIN Session ses ON st.session_id = ses.session_id
+WHERE ses.session_date BETWEEN ? AND ?
+ORDER BY st.set_index ASC;
+
+-- name: /sets-in-range?key
+-- params: ["2015-01-01", "2015-12-31", "Dmajor"]
+SELECT s.*
+FROM SetTable s
+JOIN SetToSession st ON s.set_id = st.set_id
+JOIN Session ses ON st.session_id = ses.session_id
+JOIN TuneToSet tts ON tts.set_id = s.set_id
+JOIN Tune t ON t.tune_id = tts.tune_id
+WHERE ses.session_date BETWEEN ? AND ? AND t.tune_mode = ?
+ORDER BY st.set_index ASC;
+
+-- name: /set
+-- params: [1000]
+SELECT t.name, t.tune_id, t.name, t.tune_url, t.abc, COUNT(ts.tune_id) as tune_count
+FROM Tune t
+JOIN TuneToSet ts ON t.tune_id = ts.tune_id
+WHERE ts.set_id = ?
+GROUP BY t.name, t.tune_id, t.tune_url
+ORDER BY ts.tune_index ASC;
+
+-- name: /tune
+-- params: [7]
+SELECT DISTINCT s.*
+FROM SetTable s
+JOIN TuneToSet ts ON s.set_id = ts.set_id
+WHERE ts.tune_id = ?
+ORDER BY ts.tune_index ASC;
+
+-- name: /tunes-in-range
+-- params: ["2015-01-01", "2015-12-31"]
+SELECT t.name, t.tune_id, t.name, t.tune_url, COUNT(tts.tune_id) as tune_count
+FROM Tune t
+JOIN TuneToSet tts ON t.tune_id = tts.tune_id
+JOIN SetTable s ON s.set_id = tts.set_id
+JOIN SetToSession st ON s.set_id = st.set_id
+JOIN Session ses ON st.session_id = ses.session_id
+WHERE ses.session_date BETWEEN ? AND ?
+GROUP BY t.name, t.tune_id, t.tune_url
+ORDER BY tune_count DESC;
+
+-- name: /tunes-in-range?key
+-- params: ["2015-01-01", "2015-12-31", "Dmajor"]
+SELECT DISTINCT t.name, t.tune_id, t.name, t.tune_url
+FROM Tune t
+JOIN TuneToSet tts ON t.tune_id = tts.tune_id
+JOIN SetTable s ON s.set_id = tts.set_id
+JOIN SetToSession st ON s.set_id = st.set_id
+JOIN Session ses ON st.session_id = ses.session_id
+WHERE ses.session_date BETWEEN ? AND ? AND t.tune_mode = ?
+ORDER BY st.set_index ASC;
+
+-- name: ingest TuneToSet probe
+-- params: [7, 1000, 1]
+SELECT 1 FROM TuneToSet WHERE tune_id = ? AND set_id = ? AND tune_index = ?;
+
+-- name: ingest SetToSession probe
+-- params: [500, 1000, 1]
+SELECT 1 FROM SetToSession WHERE session_id = ? AND set_id = ? AND set_index = ?;
+
+-- name: ingest Tune lookup
+-- params: [7]
+SELECT tune_id FROM Tune WHERE the_session_tune_id = ?;
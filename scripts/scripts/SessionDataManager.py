@@ -1,22 +1,64 @@
 #!python3
 r""" SessionDataManager.py - manage all database connections for session data
 
+Session data lives in a storage backend, the hosted neo4j graph (neo4j_backend.py) or a local
+SQLite file with the init.sql schema (sqlite_backend.py), see session_backend.py for the interface.
+Tune metadata is looked up in the TheSession-data sqlite file.
+
 """
-import neo4j
-import sqlite3
+import pathlib
+import instrumentation
+from tune_lookup import TheSessionTunes
+
+
+backends = ("neo4j", "sqlite")
+
+
+def add_backend_arguments(parser, repo_root):
+    """The --backend, --db_file and --schema_file options every script that opens a SessionDataManager takes"""
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="neo4j",
+        choices=backends,
+        help="Where session data is stored, the hosted neo4j graph or a local SQLite file")
+    parser.add_argument(
+        "--db_file",
+        type=pathlib.Path,
+        default=repo_root / "mueller.db",
+        help="The SQLite file used by --backend sqlite")
+    parser.add_argument(
+        "--schema_file",
+        type=pathlib.Path,
+        default=repo_root / "init.sql",
+        help="Filepath for a file containing the SQL commands that initialize the database")
 
 
 class SessionDataManager:
-    def __init__(self, session_db, initialize_db=True):
-        URI = "neo4j+s://a36f2166.databases.neo4j.io"
-        AUTH = ("neo4j", "1Mik7YKwO1IdAxbZMrhMGG_bpidd1gGSBusyi2a23go")
-        self.driver = neo4j.GraphDatabase.driver(URI, auth=AUTH)
-        self.driver.verify_connectivity()
-        if initialize_db:
-            self.initialize_database()
-
-        self.session_conn = sqlite3.connect(session_db)
-        self.session_cursor = self.session_conn.cursor()
+    """
+    Every method of the backend (create_session, ingest_sessions, read_tune, ...) is available on the manager,
+    timed as stage sdm.<method> while instrumentation is enabled.
+    """
+    def __init__(self, session_db, initialize_db=True, driver=None, backend="neo4j", db_file=None, schema_file=None):
+        # Backends are imported when chosen so the SQLite one runs without the neo4j driver installed
+        if backend == "neo4j":
+            from neo4j_backend import Neo4jBackend
+            self.backend = Neo4jBackend(driver, initialize_db)
+        elif backend == "sqlite":
+            from sqlite_backend import SQLiteBackend
+            self.backend = SQLiteBackend(db_file, schema_file, initialize_db)
+        else:
+            raise ValueError(f"Unknown backend {backend}, expected one of {backends}")
+
+        self.the_session_tunes = TheSessionTunes(session_db)
+
+    def __getattr__(self, name):
+        if name == "backend":
+            raise AttributeError(name)
+        attribute = getattr(self.backend, name)
+        if instrumentation.enabled and callable(attribute):
+            return instrumentation.timed(f"sdm.{name}")(attribute)
+        return attribute
 
     def __enter__(self):
         return self
@@ -25,186 +67,14 @@ class SessionDataManager:
         self.close()
 
     def close(self):
-        self.driver.close()
-        self.session_cursor.close()
-        self.session_conn.close()
-
-    def initialize_database(self):
-        initialization_commands = [
-            # Create constraints
-            "CREATE CONSTRAINT IF NOT EXISTS FOR (l:Location) REQUIRE l.location_id IS UNIQUE;",
-            "CREATE CONSTRAINT IF NOT EXISTS FOR (s:Session) REQUIRE s.session_id IS UNIQUE;",
-            "CREATE CONSTRAINT IF NOT EXISTS FOR (st:SetTable) REQUIRE st.set_id IS UNIQUE;",
-            "CREATE CONSTRAINT IF NOT EXISTS FOR (t:Tune) REQUIRE t.tune_id IS UNIQUE;",
-            # Create indexes
-            "CREATE RANGE INDEX IF NOT EXISTS FOR (s:Session) ON (s.session_date);",
-            "CREATE RANGE INDEX IF NOT EXISTS FOR (t:Tune) ON (t.the_session_tune_id);",
-            # Define node properties (similar to table columns)
-            "CREATE (:Location {location_id: 0, description: '', address: '', url: ''});",
-            "CREATE (:Session {session_id: 0, session_date: date(), start_time: time(), end_time: time(), description: ''});",
-            "CREATE (:SetTable {set_id: 0, description: ''});",
-            "CREATE (:Tune {tune_id: 0, the_session_tune_id: 0, name: '', abc: '', tune_type: '', tune_meter: '', tune_mode: '', tune_url: ''});",
-        ]
-        with self.driver.session() as session:
-            for command in initialization_commands:
-                session.run(command)
-            session.write_transaction(self._create_initial_location)
-
-    @staticmethod
-    def _create_initial_location(tx):
-        query = (
-            "MERGE (l:Location {location_id: 1}) "
-            "SET l.description = $description, "
-            "    l.address = $address, "
-            "    l.url = $url"
-        )
-        tx.run(
-            query,
-            description="B.D.Riley Thursday Session at Mueller in Austin, Texas.",
-            address="1905 Aldrich St #130, Austin, TX 78723",
-            url="https://bdrileys.com/")
-
-    def create_session(self, location_id, session_date, start_time, end_time, description):
-        query = (
-            "CREATE (s:Session {session_id: randomUUID(), "
-            "location_id: $location_id, "
-            "session_date: date($session_date), "
-            "start_time: time($start_time), "
-            "end_time: time($end_time), "
-            "description: $description}) "
-            "RETURN s.session_id as session_id"
-        )
-        with self.driver.session() as session:
-            result = session.run(
-                query,
-                location_id=location_id,
-                session_date=session_date,
-                start_time=start_time,
-                end_time=end_time,
-                description=description)
-            return result.single()["session_id"]
-
-    def create_location(self, description, address, url):
-        query = (
-            "CREATE (l:Location {location_id: randomUUID(), "
-            "description: $description, "
-            "address: $address, "
-            "url: $url}) "
-            "RETURN l.location_id as location_id"
-        )
-        with self.driver.session() as session:
-            result = session.run(
-                query,
-                description=description,
-                address=address,
-                url=url)
-            return result.single()["location_id"]
+        self.backend.close()
+        self.the_session_tunes.close()
 
-    def read_or_create_set(self, description):
-        query = (
-            "MERGE (s:SetTable {description: $description}) "
-            "ON CREATE SET s.set_id = randomUUID() "
-            "RETURN s.set_id as set_id"
-        )
-        with self.driver.session() as session:
-            result = session.run(
-                query,
-                description=description)
-            return result.single()["set_id"]
-
-    def create_tune(self, the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url):
-        query = (
-            "CREATE (t:Tune {tune_id: randomUUID(), "
-            "the_session_tune_id: $the_session_tune_id, "
-            "name: $name, "
-            "abc: $abc, "
-            "tune_type: $tune_type, "
-            "tune_meter: $tune_meter, "
-            "tune_mode: $tune_mode, "
-            "tune_url: $tune_url}) "
-            "RETURN t.tune_id as tune_id"
-        )
-        with self.driver.session() as session:
-            result = session.run(
-                query,
-                the_session_tune_id=the_session_tune_id,
-                name=name,
-                abc=abc,
-                tune_type=tune_type,
-                tune_meter=tune_meter,
-                tune_mode=tune_mode,
-                tune_url=tune_url)
-            return result.single()["tune_id"]
-
-    def get_id_or_create_tune(self, the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url):
-        query = (
-            "MERGE (t:Tune {the_session_tune_id: $the_session_tune_id}) "
-            "ON CREATE SET t.tune_id = randomUUID(), "
-            "t.name = $name, "
-            "t.abc = $abc, "
-            "t.tune_type = $tune_type, "
-            "t.tune_meter = $tune_meter, "
-            "t.tune_mode = $tune_mode, "
-            "t.tune_url = $tune_url "
-            "RETURN t.tune_id as tune_id"
-        )
-        with self.driver.session() as session:
-            result = session.run(
-                query,
-                the_session_tune_id=the_session_tune_id,
-                name=name,
-                abc=abc,
-                tune_type=tune_type,
-                tune_meter=tune_meter,
-                tune_mode=tune_mode,
-                tune_url=tune_url)
-            return result.single()["tune_id"]
-
-
-    def create_set_to_session(self, session_id, set_id, set_index):
-        query = (
-            "MATCH (s:Session {session_id: $session_id}), (st:SetTable {set_id: $set_id}) "
-            "MERGE (s)-[r:INCLUDES {set_index: $set_index}]->(st) "
-            "RETURN r.set_index as relationship_id"
-        )
-        with self.driver.session() as session:
-            result = session.run(
-                query,
-                session_id=session_id,
-                set_id=set_id,
-                set_index=set_index)
-            try:
-                return result.single()["relationship_id"]
-            except ResultConsumedError:
-                # If the relationship already existed, return the set_index
-                return set_index
-
-    def create_tune_to_set(self, tune_id, set_id, tune_index):
-        query = (
-            "MATCH (t:Tune {tune_id: $tune_id}), (st:SetTable {set_id: $set_id}) "
-            "MERGE (st)-[r:CONTAINS {tune_index: $tune_index}]->(t) "
-            "RETURN r.tune_index as relationship_id"
-        )
-        with self.driver.session() as session:
-            result = session.run(
-                query,
-                tune_id=tune_id,
-                set_id=set_id,
-                tune_index=tune_index)
-            try:
-                return result.single()["relationship_id"]
-            except ResultConsumedError:
-                # If the relationship already existed, return the tune_index
-                return tune_index
+    @instrumentation.timed("sdm.prefetch_tunes_from_TheSession")
+    def prefetch_tunes_from_TheSession(self, tune_ids):
+        self.the_session_tunes.prefetch(tune_ids)
 
+    @instrumentation.timed("sdm.get_tune_from_TheSession")
     def get_tune_from_TheSession(self, tune_id):
-        abc = ""
-        tune_type = ""
-        tune_meter = ""
-        tune_mode = ""
-
-        self.session_cursor.execute('SELECT abc, type, meter, mode FROM tunes WHERE tune_id = ?', (tune_id,))
-        abc_result = self.session_cursor.fetchone()
-        if abc_result:
-            abc, tune_type, tune_meter, tune_mode = abc_result
+        abc, tune_type, tune_meter, tune_mode = self.the_session_tunes.get(tune_id)
         return abc, tune_type, tune_meter, tune_mode
@@ -0,0 +1,197 @@
+#!python3
+r""" analytics.py - columnar export of the session history and vectorised range queries
+
+The export is one fact row per tune played, written as a Parquet dataset partitioned by year
+with the repetitive columns (tune, type, meter, mode) dictionary encoded.
+
+    py analytics.py --dataset_dir history            export everything
+    py analytics.py --dataset_dir history --append   add only the sessions not in the export yet
+    py analytics.py --dataset_dir history --start 2024-01-01 --end 2024-06-30 --by tune_mode
+
+Dependencies
+    py -m pip install pyarrow
+    py -m pip install numpy
+
+"""
+import argparse
+import datetime
+import pathlib
+import sys
+import time
+import numpy
+import pyarrow
+import pyarrow.compute
+import pyarrow.dataset
+import SessionDataManager
+
+
+play_columns = (
+    "session_date", "session_id", "set_id", "set_index", "tune_index", "tune_id", "the_session_tune_id",
+    "name", "tune_type", "tune_meter", "tune_mode")
+dictionary_columns = ("tune_id", "the_session_tune_id", "name", "tune_type", "tune_meter", "tune_mode")
+
+schema = pyarrow.schema([
+    ("session_date", pyarrow.date32()),
+    ("session_id", pyarrow.string()),
+    ("set_id", pyarrow.string()),
+    ("set_index", pyarrow.int32()),
+    ("tune_index", pyarrow.int32()),
+    ("tune_id", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+    ("the_session_tune_id", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+    ("name", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+    ("tune_type", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+    ("tune_meter", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+    ("tune_mode", pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+    ("year", pyarrow.int16()),
+])
+partitioning = pyarrow.dataset.partitioning(pyarrow.schema([("year", pyarrow.int16())]), flavor="hive")
+
+
+def plays_to_table(plays):
+    """
+    plays is an iterable of rows in play_columns order, as SessionDataManager.read_tune_plays yields them.
+    Ids are stored as strings, SQLite's integers and neo4j's UUIDs alike.
+    """
+    columns = {name: list() for name in play_columns}
+    for play in plays:
+        for name, value in zip(play_columns, play):
+            columns[name].append(value)
+    columns["session_date"] = [datetime.date.fromisoformat(str(value)) for value in columns["session_date"]]
+    arrays = list()
+    for field in schema:
+        if field.name == "year":
+            arrays.append(pyarrow.array([value.year for value in columns["session_date"]], pyarrow.int16()))
+        elif field.name in dictionary_columns:
+            arrays.append(pyarrow.array([None if value is None else str(value) for value in columns[field.name]],
+                                        pyarrow.string()).dictionary_encode().cast(field.type))
+        elif field.type == pyarrow.string():
+            arrays.append(pyarrow.array([None if value is None else str(value) for value in columns[field.name]], field.type))
+        else:
+            arrays.append(pyarrow.array(columns[field.name], field.type))
+    return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+
+def exported_session_ids(dataset_dir):
+    """
+    The session ids in the export as strings, empty if there is no export yet.
+    Appending by session rather than by date also picks up sessions ingested later for a date already exported.
+    """
+    if not pathlib.Path(dataset_dir).exists() or not any(pathlib.Path(dataset_dir).rglob("*.parquet")):
+        return set()
+    dataset = pyarrow.dataset.dataset(dataset_dir, schema=schema, partitioning=partitioning)
+    return set(pyarrow.compute.unique(dataset.to_table(columns=["session_id"])["session_id"]).to_pylist())
+
+
+def write_plays(table, dataset_dir):
+    """Add table to the dataset, new files never replace the ones an earlier export wrote"""
+    if table.num_rows == 0:
+        return
+    pyarrow.dataset.write_dataset(
+        table,
+        dataset_dir,
+        format="parquet",
+        partitioning=partitioning,
+        basename_template=f"part-{time.time_ns()}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore")
+
+
+def load_plays(dataset_dir, start_date, end_date, columns=None):
+    """The plays from start_date to end_date inclusive, only the year partitions in range are read"""
+    start_date = datetime.date.fromisoformat(str(start_date))
+    end_date = datetime.date.fromisoformat(str(end_date))
+    dataset = pyarrow.dataset.dataset(dataset_dir, schema=schema, partitioning=partitioning)
+    field = pyarrow.dataset.field
+    in_range = ((field("year") >= start_date.year) & (field("year") <= end_date.year) &
+                (field("session_date") >= pyarrow.scalar(start_date)) & (field("session_date") <= pyarrow.scalar(end_date)))
+    return dataset.to_table(columns=columns, filter=in_range)
+
+
+def count_by(table, column, where=None):
+    """
+    Plays per value of a dictionary encoded column, most played first, as [(value, count), ...].
+    Counts with numpy.bincount on the dictionary indices, so no strings are compared.
+    where is an optional (column, value) pair to filter on first, for example ("tune_mode", "Dmajor").
+    """
+    if where is not None:
+        where_column, where_value = where
+        table = table.filter(pyarrow.compute.equal(table[where_column].cast(pyarrow.string()), where_value))
+    chunks = table[column].unify_dictionaries().chunks if table.num_rows else []
+    if not chunks:
+        return []
+    dictionary = chunks[0].dictionary
+    counts = numpy.zeros(len(dictionary), dtype=numpy.int64)
+    for chunk in chunks:
+        indices = chunk.indices.to_numpy(zero_copy_only=False)
+        counts += numpy.bincount(indices, minlength=len(dictionary))
+    order = numpy.argsort(-counts, kind="stable")
+    return [(dictionary[int(index)].as_py(), int(counts[index])) for index in order if counts[index]]
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    code_root = repo_root.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--session_db",
+        type=pathlib.Path,
+        default=code_root / "TheSession-data" / "thesession.db",
+        help="Filepath of the TheSession-data sqlite file")
+    SessionDataManager.add_backend_arguments(parser, repo_root)
+    parser.add_argument(
+        "--dataset_dir",
+        type=pathlib.Path,
+        default=repo_root / "history",
+        help="Directory of the Parquet export")
+    parser.add_argument(
+        '--append',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Only export the sessions not already in the export")
+    parser.add_argument(
+        "--start",
+        type=str,
+        help="Query the export from this session date, YYYY-MM-DD, instead of exporting")
+    parser.add_argument(
+        "--end",
+        type=str,
+        help="Last session date of the query, YYYY-MM-DD")
+    parser.add_argument(
+        "--by",
+        type=str,
+        default="name",
+        choices=dictionary_columns,
+        help="Column to count plays by")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    if args.start and args.end:
+        for value, count in count_by(load_plays(args.dataset_dir, args.start, args.end), args.by):
+            print(f"{count:6d} {value}")
+        return 0
+
+    if not args.append and args.dataset_dir.exists() and any(args.dataset_dir.rglob("*.parquet")):
+        print(f"{args.dataset_dir} already has an export, use --append or remove it first")
+        return 1
+    with SessionDataManager.SessionDataManager(
+            args.session_db, initialize_db=False, backend=args.backend, db_file=args.db_file, schema_file=args.schema_file) as sdm:
+        session_ids = None
+        if args.append:
+            exported = exported_session_ids(args.dataset_dir)
+            session_ids = [session_id for session_id in sdm.read_session_ids() if str(session_id) not in exported]
+        table = plays_to_table(sdm.read_tune_plays(session_ids=session_ids))
+    write_plays(table, args.dataset_dir)
+    sessions = "every session" if session_ids is None else f"{len(session_ids)} sessions not exported before"
+    print(f"Exported {table.num_rows} plays of {sessions} to {args.dataset_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
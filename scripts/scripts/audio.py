@@ -1,8 +1,30 @@
-from music21 import converter, stream
+r""" audio.py - render tunes from ABC notation to audio
+
+Dependencies
+    py -m pip install music21
+    py -m pip install numpy
+    py -m pip install pyfluidsynth - needs the FluidSynth library, https://www.fluidsynth.org/
+
+"""
+from music21 import chord, converter, note, stream
+import concurrent.futures
+import hashlib
+import instrumentation
+import numpy
 import os
-from pydub import AudioSegment
+import pathlib
+import struct
+import wave
 
 class AudioManager():
+    default_velocity = 90
+    min_note_seconds = 0.05
+
+    def __init__(self, parse_cache=None):
+        # parse_cache.ParsedScoreCache, parsed scores are reused across runs when given
+        self.parse_cache = parse_cache
+
+    @instrumentation.timed("audio.create_audio_converter")
     def create_audio_converter(self, ref_num, title, meter, key, abc, default_length=None):
 
         abc_notation = f"""
@@ -17,14 +39,234 @@ class AudioManager():
 
         abc_notation += abc
 
-        self.audio_stream = converter.parse(abc_notation, format='abc')
+        if self.parse_cache is not None:
+            self.audio_stream = self.parse_cache.parse(abc_notation)
+        else:
+            self.audio_stream = converter.parse(abc_notation, format='abc')
+
+    @instrumentation.timed("audio.note_events")
+    def note_events(self, repeats=1):
+        """
+        The stream as a time ordered list of (seconds, is_note_on, midi_pitch, velocity),
+        built in memory from music21's seconds map instead of writing a MIDI file.
+        With repeats the tune is played that many times back to back.
+        """
+        seconds_map = self.audio_stream.flatten().secondsMap
+        pass_seconds = max((entry['endTimeSeconds'] for entry in seconds_map), default=0.0)
+        events = list()
+        tied = dict()  # midi_pitch : True while a tie is holding the note
+        for repeat, entry in ((repeat, entry) for repeat in range(repeats) for entry in seconds_map):
+            element = entry['element']
+            if not isinstance(element, (note.Note, chord.Chord)):
+                continue
+            start = entry['offsetSeconds'] + repeat * pass_seconds
+            end = start + max(entry['durationSeconds'], self.min_note_seconds)
+            velocity = element.volume.velocity or self.default_velocity
+            tie_type = element.tie.type if element.tie else None
+            for pitch in element.pitches:
+                midi_pitch = pitch.midi
+                if not tied.get(midi_pitch):
+                    events.append((start, True, midi_pitch, velocity))
+                if tie_type in ('start', 'continue'):
+                    tied[midi_pitch] = True
+                else:
+                    tied[midi_pitch] = False
+                    events.append((end, False, midi_pitch, 0))
+        # note offs sort before note ons at the same instant so repeated notes retrigger
+        events.sort(key=lambda event: (event[0], event[1]))
+        return events
+
+    @staticmethod
+    def frame_count(events, sample_rate=44100, tail_seconds=1.0):
+        """Number of frames pcm_frames yields for events, known before anything is synthesized."""
+        return int(((events[-1][0] if events else 0.0) + tail_seconds) * sample_rate)
 
-    def write_wav(self, output_filepath, font_file):
-        midi_file = output_filepath.split('.')[0] + ".mid"
-        self.audio_stream.write('midi', midi_file)
-        os.system(f'fluidsynth -ni {font_file} {midi_file} -F {output_filepath} -n')
+    @instrumentation.timed("audio.pcm_frames")
+    def pcm_frames(self, font_file, sample_rate=44100, block_frames=4096, tail_seconds=1.0, repeats=1, events=None):
+        """
+        Synthesize the stream in process and yield blocks of int16 stereo PCM shaped (frames, 2).
+        Nothing touches the disk, so the blocks can go to a file, a socket or a player as they are made.
+        """
+        # Imported here so exporting and parsing scores work without the FluidSynth library installed
+        import fluidsynth
+        if events is None:
+            events = self.note_events(repeats)
+        synth = fluidsynth.Synth(samplerate=float(sample_rate))
         try:
-            audio = AudioSegment.from_wav(output_filepath)
-        except err:
-            print("Failed to create wav file: ", err)
+            soundfont_id = synth.sfload(str(font_file))
+            synth.program_select(0, soundfont_id, 0, 0)
+            end_frame = self.frame_count(events, sample_rate, tail_seconds)
+            frame = 0
+            event_index = 0
+            while frame < end_frame:
+                while event_index < len(events) and int(events[event_index][0] * sample_rate) <= frame:
+                    _, is_note_on, midi_pitch, velocity = events[event_index]
+                    if is_note_on:
+                        synth.noteon(0, midi_pitch, velocity)
+                    else:
+                        synth.noteoff(0, midi_pitch)
+                    event_index += 1
+                next_frame = end_frame
+                if event_index < len(events):
+                    next_frame = min(next_frame, int(events[event_index][0] * sample_rate))
+                frames = max(1, min(block_frames, next_frame - frame))
+                yield numpy.asarray(synth.get_samples(frames), dtype=numpy.int16).reshape(-1, 2)
+                frame += frames
+        finally:
+            synth.delete()
+
+    def pcm_buffer(self, font_file, sample_rate=44100, repeats=1):
+        """The whole stream as one preallocated (frames, 2) int16 NumPy array."""
+        events = self.note_events(repeats)
+        buffer = numpy.empty((self.frame_count(events, sample_rate), 2), dtype=numpy.int16)
+        position = 0
+        for block in self.pcm_frames(font_file, sample_rate, events=events):
+            buffer[position:position + len(block)] = block
+            position += len(block)
+        return buffer
+
+    @instrumentation.timed("audio.write_wav")
+    def write_wav(self, output_filepath, font_file, sample_rate=44100):
+        with wave.open(str(output_filepath), 'wb') as wav_file:
+            wav_file.setnchannels(2)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(sample_rate)
+            for block in self.pcm_frames(font_file, sample_rate):
+                wav_file.writeframes(block.tobytes())
+
+
+def file_digest(filepath):
+    """sha256 of a file, read in blocks so large soundfonts are never held in memory"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def render_key(abc, meter, key, default_length, soundfont_digest):
+    """Content address of a rendered tune, anything that changes the audio changes the key"""
+    digest = hashlib.sha256()
+    for part in (abc.strip(), meter, key, default_length or "", soundfont_digest):
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def render_tune(title, meter, key, abc, default_length, font_file, output_filepath, parse_cache=None):
+    """
+    Render one tune to output_filepath in a worker process.
+    Writes to a temporary name first so a crashed render never looks like a cached one.
+    """
+    output_filepath = pathlib.Path(output_filepath)
+    temporary_filepath = output_filepath.with_name(output_filepath.stem + f".{os.getpid()}.tmp.wav")
+    try:
+        audio_manager = AudioManager(parse_cache)
+        audio_manager.create_audio_converter(1, title, meter, key, abc, default_length)
+        audio_manager.write_wav(temporary_filepath, font_file)
+        os.replace(temporary_filepath, output_filepath)
+    finally:
+        if temporary_filepath.exists():
+            temporary_filepath.unlink()
+    return str(output_filepath)
+
+
+def create_memmap_wav(output_filepath, frames, sample_rate=44100):
+    """
+    Write a 16 bit stereo PCM WAV header for frames frames and return the sample data as a writable numpy.memmap,
+    so a long render goes straight to disk without ever being held in memory.
+    """
+    data_bytes = frames * 4
+    with open(output_filepath, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', 36 + data_bytes) + b'WAVE')
+        f.write(b'fmt ' + struct.pack('<IHHIIHH', 16, 1, 2, sample_rate, sample_rate * 4, 4, 16))
+        f.write(b'data' + struct.pack('<I', data_bytes))
+        f.truncate(44 + data_bytes)
+    return numpy.memmap(output_filepath, dtype=numpy.int16, mode='r+', offset=44, shape=(frames, 2))
+
+
+def render_set(tunes, font_file, output_filepath=None, repeats=2, crossfade_seconds=0.5, sample_rate=44100, parse_cache=None):
+    """
+    Render a whole set as one stream for practice.
+    tunes is the ordered list of (title, meter, key, abc) in the set, each is played repeats times
+    and crossfaded into the next over crossfade_seconds.
+    The length is worked out from the note events before anything is synthesized, so the output is one
+    preallocated array, or with output_filepath a memory mapped WAV file, and only one block of audio
+    plus the crossfade window is ever in memory. Returns the array or the memmap.
+    """
+    audio_managers = list()
+    tune_events = list()
+    for title, meter, key, abc in tunes:
+        audio_manager = AudioManager(parse_cache)
+        audio_manager.create_audio_converter(1, title, meter, key, abc)
+        audio_managers.append(audio_manager)
+        tune_events.append(audio_manager.note_events(repeats))
+
+    lengths = [AudioManager.frame_count(events, sample_rate) for events in tune_events]
+    crossfades = [min(int(crossfade_seconds * sample_rate), previous, current) for previous, current in zip(lengths, lengths[1:])]
+    total_frames = sum(lengths) - sum(crossfades)
+    if output_filepath is None:
+        output = numpy.zeros((total_frames, 2), dtype=numpy.int16)
+    else:
+        output = create_memmap_wav(output_filepath, total_frames, sample_rate)
+
+    position = 0
+    for index, (audio_manager, events) in enumerate(zip(audio_managers, tune_events)):
+        overlap = crossfades[index - 1] if index else 0
+        position -= overlap
+        if overlap:
+            fade = numpy.linspace(1.0, 0.0, overlap, dtype=numpy.float32)[:, None]
+            output[position:position + overlap] = (output[position:position + overlap] * fade).astype(numpy.int16)
+        fade_in = numpy.linspace(0.0, 1.0, overlap, dtype=numpy.float32)[:, None]
+        frame = 0
+        for block in audio_manager.pcm_frames(font_file, sample_rate, events=events):
+            start = position + frame
+            # The first overlap frames fade in on top of the end of the previous tune
+            mixed = min(max(overlap - frame, 0), len(block))
+            if mixed:
+                mix = output[start:start + mixed] + block[:mixed] * fade_in[frame:frame + mixed]
+                output[start:start + mixed] = numpy.clip(mix, -32768, 32767).astype(numpy.int16)
+            output[start + mixed:start + len(block)] = block[mixed:]
+            frame += len(block)
+        position += frame
+
+    if isinstance(output, numpy.memmap):
+        output.flush()
+    return output
+
+
+def batch_render(tunes, font_file, cache_dir, workers=None, parse_cache=None):
+    """
+    Render many tunes across a process pool into a content addressed cache.
+    tunes is an iterable of (tune_key, title, meter, key, abc, default_length)
+    Yields (tune_key, status, wav_filepath, error) as each tune finishes,
+    status is 'cached', 'rendered' or 'failed' and one failed tune never stops the others.
+    """
+    cache_dir = pathlib.Path(cache_dir)
+    soundfont_digest = file_digest(font_file)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        submitted = dict()  # content_key : future, so identical tunes are rendered once
+        futures = dict()  # future : (wav_filepath, [tune_key, ...])
+        for tune_key, title, meter, key, abc, default_length in tunes:
+            content_key = render_key(abc, meter, key, default_length, soundfont_digest)
+            wav_filepath = cache_dir / content_key[:2] / f"{content_key}.wav"
+            if content_key in submitted:
+                futures[submitted[content_key]][1].append(tune_key)
+                continue
+            if wav_filepath.exists():
+                yield tune_key, 'cached', str(wav_filepath), None
+                continue
+            wav_filepath.parent.mkdir(parents=True, exist_ok=True)
+            future = executor.submit(render_tune, title, meter, key, abc, default_length, font_file, wav_filepath, parse_cache)
+            submitted[content_key] = future
+            futures[future] = (wav_filepath, [tune_key])
 
+        for future in concurrent.futures.as_completed(futures):
+            wav_filepath, tune_keys = futures[future]
+            try:
+                status, error = 'rendered', None
+                future.result()
+            except Exception as err:
+                status, error = 'failed', f"{type(err).__name__}: {err}"
+            for tune_key in tune_keys:
+                yield tune_key, status, str(wav_filepath), error
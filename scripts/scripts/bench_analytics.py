@@ -0,0 +1,110 @@
+#!python3
+r""" bench_analytics.py - range queries over the Parquet export against the equivalent SQL joins
+
+Loads the same synthetic history into an init.sql SQLite database and a Parquet export,
+then times the /tunes-in-range join and the vectorised count_by over a range.
+
+"""
+import argparse
+import pathlib
+import sqlite3
+import sys
+import tempfile
+import time
+import analytics
+from bench_ingest import synthetic_sessions
+
+
+tunes_in_range_query = """
+    SELECT t.name, t.tune_id, t.name, t.tune_url, COUNT(tts.tune_id) as tune_count
+    FROM Tune t
+    JOIN TuneToSet tts ON t.tune_id = tts.tune_id
+    JOIN SetTable s ON s.set_id = tts.set_id
+    JOIN SetToSession st ON s.set_id = st.set_id
+    JOIN Session ses ON st.session_id = ses.session_id
+    WHERE ses.session_date BETWEEN ? AND ?
+    GROUP BY t.name, t.tune_id, t.tune_url
+    ORDER BY tune_count DESC;
+"""
+
+
+def load_history(sessions, conn):
+    """Write synthetic sessions into the init.sql schema and return the matching fact rows for the export"""
+    plays = list()
+    tune_ids = dict()
+    set_ids = dict()
+    for session_id, (location_id, session_date, start_time, end_time, description, sets) in enumerate(sessions, start=1):
+        conn.execute("INSERT INTO Session VALUES (?, ?, ?, ?, ?, ?)",
+                     (session_id, location_id, session_date, start_time, end_time, description))
+        for set_index, set_description, tunes in sets:
+            if set_description not in set_ids:
+                set_ids[set_description] = len(set_ids) + 1
+                conn.execute("INSERT INTO SetTable (set_id, description) VALUES (?, ?)", (set_ids[set_description], set_description))
+                for tune_index, (the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url) in enumerate(tunes, start=1):
+                    if the_session_tune_id not in tune_ids:
+                        tune_ids[the_session_tune_id] = len(tune_ids) + 1
+                        conn.execute("INSERT INTO Tune VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                     (tune_ids[the_session_tune_id], the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url))
+                    conn.execute("INSERT INTO TuneToSet VALUES (?, ?, ?)",
+                                 (tune_ids[the_session_tune_id], set_ids[set_description], tune_index))
+            set_id = set_ids[set_description]
+            conn.execute("INSERT INTO SetToSession VALUES (?, ?, ?)", (session_id, set_id, set_index))
+            for tune_index, (the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url) in enumerate(tunes, start=1):
+                plays.append((session_date, session_id, set_id, set_index, tune_index,
+                              tune_ids[the_session_tune_id], the_session_tune_id, name, tune_type, tune_meter, tune_mode))
+    conn.commit()
+    return plays
+
+
+def best_of(repeat, function):
+    timings = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def parse():
+    repo_root = pathlib.Path(__file__).resolve().parent.parent.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=2000, help="Number of synthetic sessions")
+    parser.add_argument("--tune_pool", type=int, default=2000, help="Number of distinct tunes to draw from")
+    parser.add_argument("--schema_file", type=pathlib.Path, default=repo_root / "init.sql")
+    parser.add_argument("--start", type=str, default="2001-01-01")
+    parser.add_argument("--end", type=str, default="2003-12-31")
+    parser.add_argument("--repeat", type=int, default=5)
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+    sessions = synthetic_sessions(args.sessions, 12, 3, args.tune_pool)
+
+    with tempfile.TemporaryDirectory() as directory:
+        conn = sqlite3.connect(pathlib.Path(directory) / "history.db")
+        conn.executescript(args.schema_file.read_text())
+        plays = load_history(sessions, conn)
+        dataset_dir = pathlib.Path(directory) / "history"
+        analytics.write_plays(analytics.plays_to_table(plays), dataset_dir)
+        print(f"{len(plays)} plays")
+
+        sql_seconds, sql_rows = best_of(args.repeat, lambda: conn.execute(tunes_in_range_query, (args.start, args.end)).fetchall())
+        columnar_seconds, columnar_rows = best_of(args.repeat, lambda: analytics.count_by(
+            analytics.load_plays(dataset_dir, args.start, args.end, columns=["session_date", "tune_id"]), "tune_id"))
+        conn.close()
+
+    print(f"     sql join: {sql_seconds * 1000:8.2f}ms {len(sql_rows)} tunes")
+    print(f"     columnar: {columnar_seconds * 1000:8.2f}ms {len(columnar_rows)} tunes")
+    if sum(row[4] for row in sql_rows) != sum(count for _, count in columnar_rows):
+        print("Play counts differ between the SQL join and the export")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
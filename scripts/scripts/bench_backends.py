@@ -0,0 +1,73 @@
+#!python3
+r""" bench_backends.py - the same ingest workload against every storage backend
+
+Runs the per-row loop and ingest_sessions on the same synthetic sessions against the SQLite backend
+in a temporary file and the neo4j backend. neo4j is the local stand-in graph, charging --standin_latency_ms
+per round trip; only --live_neo4j reaches the hosted graph, and writes the synthetic sessions into it.
+
+"""
+import argparse
+import pathlib
+import sys
+import tempfile
+import time
+import SessionDataManager
+from bench_ingest import per_row, synthetic_sessions
+from standin import StandInDriver
+
+
+def parse():
+    repo_root = pathlib.Path(__file__).resolve().parent.parent.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100, help="Number of synthetic sessions")
+    parser.add_argument("--tune_pool", type=int, default=400, help="Number of distinct tunes to draw from")
+    parser.add_argument("--batch_size", type=int, default=500)
+    parser.add_argument(
+        "--backends",
+        type=str,
+        nargs='+',
+        default=list(SessionDataManager.backends),
+        choices=SessionDataManager.backends)
+    parser.add_argument(
+        "--standin_latency_ms",
+        type=float,
+        default=0.0,
+        help="Round trip latency the local stand-in graph charges")
+    parser.add_argument(
+        '--live_neo4j',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Benchmark the hosted neo4j graph instead of the stand-in, this initializes it and writes the synthetic sessions to it")
+    parser.add_argument("--schema_file", type=pathlib.Path, default=repo_root / "init.sql")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+    sessions = synthetic_sessions(args.sessions, 12, 3, args.tune_pool)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in args.backends:
+            for name, run in (
+                    ("per-row", lambda sdm: per_row(sdm, sessions)),
+                    ("batched", lambda sdm: sdm.ingest_sessions(sessions, args.batch_size))):
+                driver = None
+                if backend == "neo4j" and not args.live_neo4j:
+                    driver = StandInDriver(latency=args.standin_latency_ms / 1000)
+                db_file = pathlib.Path(directory) / f"{name}.db"
+                with SessionDataManager.SessionDataManager(
+                        ":memory:", initialize_db=True, driver=driver, backend=backend,
+                        db_file=db_file, schema_file=args.schema_file) as sdm:
+                    start = time.perf_counter()
+                    run(sdm)
+                    elapsed = time.perf_counter() - start
+                label = "standin" if driver else backend
+                print(f"{label:>7} {name:>8}: {elapsed:8.3f}s {args.sessions / elapsed:10.1f} sessions/s")
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,92 @@
+#!python3
+r""" bench_ceol_html.py - pages per second of BeautifulSoup against ceol_html's scanner
+
+Times set_info_tuplets_bs4, set_info_tuplets, and parse_set_pages across --workers processes over the
+same pages. The pages are every *.html under --pages_dir when given (e.g. a fixture_server.py directory),
+otherwise --synthetic generated session pages with a head, navigation, a script and --sets sets of tunes,
+about the size of a ceol.io session page.
+
+"""
+import argparse
+import pathlib
+import random
+import sys
+import time
+from ceol_html import parse_set_pages, set_info_tuplets, set_info_tuplets_bs4
+
+
+def synthetic_page(rng, sets):
+    items = list()
+    for _ in range(sets):
+        tunes = list()
+        for _ in range(rng.randrange(1, 5)):
+            tune_id = rng.randrange(1, 25000)
+            tunes.append(
+                f'<a href="https://thesession.org/tunes/{tune_id}#setting{tune_id * 3}" class="tune">'
+                f'Tune {tune_id} &amp; <em>friends</em></a>')
+        items.append(f'<li class="set">{" / ".join(tunes)} <span class="note">played twice</span></li>')
+    navigation = "".join(f'<li><a href="/sessions/{index}">Session {index}</a></li>' for index in range(20))
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Mueller session</title>'
+        '<style>li.set { margin: 0 } a.tune:hover { color: #c00 }</style>'
+        '<script>window.onload = function () { if (1 < 2) document.title += "<ul>"; };</script></head>'
+        f'<body><nav><ul>{navigation}</ul></nav><!-- sets --><div id="sets"><ol>{"".join(items)}</ol></div>'
+        '<footer><p>ceol.io<br>Austin</p></footer></body></html>').encode('utf-8')
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--pages_dir",
+        type=pathlib.Path,
+        help="Directory of saved pages to parse instead of synthetic ones")
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=400,
+        help="Number of synthetic pages when there is no --pages_dir")
+    parser.add_argument(
+        "--sets",
+        type=int,
+        default=25,
+        help="Sets per synthetic page")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Processes for parse_set_pages, defaults to the number of CPUs")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    if args.pages_dir:
+        pages = [path.read_bytes() for path in sorted(args.pages_dir.rglob("*.html"))]
+    else:
+        rng = random.Random(0)
+        pages = [synthetic_page(rng, args.sets) for _ in range(args.synthetic)]
+    print(f"{len(pages)} pages, {sum(len(page) for page in pages) / len(pages) / 1024:.1f}KiB on average")
+
+    runs = {
+        "bs4": lambda: [list(set_info_tuplets_bs4(page)) for page in pages],
+        "scan": lambda: [list(set_info_tuplets(page)) for page in pages],
+        "scan parallel": lambda: list(parse_set_pages(pages, workers=args.workers)),
+    }
+    results = dict()
+    for name, run in runs.items():
+        start = time.perf_counter()
+        results[name] = run()
+        seconds = time.perf_counter() - start
+        print(f"{name:>14}: {seconds:7.3f}s, {len(pages) / seconds:9.1f} pages/s")
+    same = all(result == results["bs4"] for result in results.values())
+    print(f"results {'match' if same else 'DIFFER'}")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
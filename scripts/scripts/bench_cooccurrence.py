@@ -0,0 +1,133 @@
+#!python3
+r""" bench_cooccurrence.py - "what to learn next" from the sparse model against a join per query
+
+Ingests --sessions weekly synthetic sessions, tunes drawn with Zipf popularity from --tune_pool,
+into a SQLite backend in a temporary file, then
+  - builds a CooccurrenceModel from all of it, and again from the first 90% followed by an update
+    with the rest, and checks the two are the same,
+  - times recommend, plain, date weighted and by session, against the self join of TuneToSet a
+    query would need without the model, and checks the plain scores match the join's counts.
+
+"""
+import argparse
+import datetime
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+import numpy
+import SessionDataManager
+from cooccurrence import CooccurrenceModel
+
+
+def synthetic_sessions(session_count, tune_pool, sets_per_session=12, seed=0):
+    rng = numpy.random.default_rng(seed)
+    popularity = 1.0 / numpy.arange(1, tune_pool + 1) ** 1.1
+    popularity /= popularity.sum()
+    first = datetime.date(2010, 1, 7)
+    sessions = list()
+    for session_number in range(session_count):
+        sets = list()
+        for set_index in range(1, sets_per_session + 1):
+            tune_ids = [str(tune_id) for tune_id in rng.choice(tune_pool, size=int(rng.integers(2, 5)), p=popularity)]
+            tunes = [(tune_id, f"Tune {tune_id}", "", "reel", "4/4", "Dmajor", f"https://thesession.org/tunes/{tune_id}")
+                     for tune_id in tune_ids]
+            sets.append((set_index, ', '.join(tune[1] for tune in tunes), tunes))
+        session_date = (first + datetime.timedelta(days=7 * session_number)).isoformat()
+        sessions.append((1, session_date, "19:00:00", "22:30:00", "", sets))
+    return sessions
+
+
+def join_scores(conn, known):
+    """Plain scores the way a query would count them without the model, {the_session_tune_id: count}"""
+    placeholders = ", ".join("?" * len(known))
+    query = (
+        "WITH k AS (SELECT tune_id FROM Tune WHERE the_session_tune_id IN ({placeholders})) "
+        "SELECT t.the_session_tune_id, COUNT(*) "
+        "FROM SetToSession st "
+        "JOIN TuneToSet a ON a.set_id = st.set_id "
+        "JOIN TuneToSet b ON b.set_id = st.set_id "
+        "JOIN Tune t ON t.tune_id = b.tune_id "
+        "WHERE a.tune_id IN (SELECT tune_id FROM k) AND b.tune_id NOT IN (SELECT tune_id FROM k) "
+        "GROUP BY b.tune_id").format(placeholders=placeholders)
+    return {str(tune_id): count for tune_id, count in conn.execute(query, known)}
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=1000, help="Number of weekly synthetic sessions")
+    parser.add_argument("--tune_pool", type=int, default=3000, help="Number of distinct tunes to draw from")
+    parser.add_argument("--queries", type=int, default=100, help="Number of recommend queries timed")
+    parser.add_argument("--known", type=int, default=30, help="Tunes known in each query")
+    parser.add_argument("--schema_file", type=pathlib.Path, default=repo_root / "init.sql")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+    sessions = synthetic_sessions(args.sessions, args.tune_pool)
+    cutoff = sessions[int(len(sessions) * 0.9)][1]
+
+    with tempfile.TemporaryDirectory() as directory:
+        with SessionDataManager.SessionDataManager(
+                ":memory:", backend="sqlite", db_file=pathlib.Path(directory) / "sessions.db",
+                schema_file=args.schema_file) as sdm:
+            start = time.perf_counter()
+            sdm.ingest_sessions(sessions)
+            print(f"ingested {len(sessions)} sessions in {time.perf_counter() - start:.2f}s")
+
+            start = time.perf_counter()
+            model = CooccurrenceModel(pathlib.Path(directory) / "model")
+            model.add_plays(sdm.read_tune_plays())
+            model.save()
+            print(f"built from every session in {time.perf_counter() - start:.2f}s: {len(model)} tunes, "
+                  f"{model.cooccurrence.nnz} tune pairs, {model.set_plays.shape[1]} set plays")
+
+            incremental = CooccurrenceModel(pathlib.Path(directory) / "incremental")
+            incremental.add_plays(play for play in sdm.read_tune_plays() if play[0] < cutoff)
+            incremental.save()
+            start = time.perf_counter()
+            incremental = CooccurrenceModel(pathlib.Path(directory) / "incremental")
+            incremental.add_plays(sdm.read_tune_plays(session_ids=incremental.new_session_ids(sdm.read_session_ids())))
+            incremental.save()
+            same = (incremental.cooccurrence != model.cooccurrence).nnz == 0 and \
+                (incremental.session_incidence != model.session_incidence).nnz == 0
+            print(f"update with the sessions from {cutoff} in {time.perf_counter() - start:.2f}s, "
+                  f"{'same as' if same else 'DIFFERENT from'} the full build")
+
+            rng = numpy.random.default_rng(1)
+            played = [tune_id for tune_id in model.the_session_tune_ids if tune_id is not None]
+            queries = [list(rng.choice(played, size=args.known, replace=False)) for _ in range(args.queries)]
+            matches = 0
+            timings = {"plain": [], "last 2 years": [], "half life 1 year": [], "by session": [], "join": []}
+            last = datetime.date.fromisoformat(model.last_date())
+            two_years_before = (last - datetime.timedelta(days=730)).isoformat()
+            for known in queries:
+                for name, run in (
+                        ("plain", lambda: model.recommend(known, 20)),
+                        ("last 2 years", lambda: model.recommend(known, 20, start=two_years_before)),
+                        ("half life 1 year", lambda: model.recommend(known, 20, half_life=365)),
+                        ("by session", lambda: model.recommend(known, 20, scope="session")),
+                        ("join", lambda: join_scores(sdm.backend.conn, known))):
+                    start = time.perf_counter()
+                    result = run()
+                    timings[name].append(time.perf_counter() - start)
+                    if name == "plain":
+                        plain = {tune_id: score for tune_id, tune_name, score in result}
+                    elif name == "join":
+                        matches += all(result.get(tune_id) == score for tune_id, score in plain.items())
+            for name, seconds in timings.items():
+                print(f"{name:>17}: median {statistics.median(seconds) * 1000:8.2f}ms")
+            print(f"{matches} of {len(queries)} plain top 20 scores match the join counts")
+    return 0 if same and matches == len(queries) else 1
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,77 @@
+#!python3
+r""" bench_ingest.py - compare per-row and batched UNWIND ingest
+
+Runs the same synthetic sessions through the per-row loop scrape.main used to run
+and through SessionDataManager.ingest_sessions against a local stand-in graph
+that charges a fixed latency per round trip.
+
+"""
+import argparse
+import random
+import sys
+import time
+import SessionDataManager
+from session_backend import set_fingerprint
+from standin import StandInDriver
+
+
+def synthetic_sessions(session_count, sets_per_session, tunes_per_set, tune_pool, seed=0):
+    rng = random.Random(seed)
+    sessions = list()
+    for session_number in range(session_count):
+        sets = list()
+        for set_index in range(1, sets_per_session + 1):
+            tunes = list()
+            for _ in range(tunes_per_set):
+                the_session_tune_id = str(rng.randrange(tune_pool))
+                tunes.append((the_session_tune_id, f"Tune {the_session_tune_id}", "", "reel", "4/4", "Dmajor",
+                              f"https://thesession.org/tunes/{the_session_tune_id}"))
+            sets.append((set_index, ', '.join(tune[1] for tune in tunes), tunes))
+        session_date = f"{2000 + session_number // 365:04d}-{session_number % 12 + 1:02d}-{session_number % 28 + 1:02d}"
+        sessions.append((1, session_date, "19:00:00", "22:30:00", "", sets))
+    return sessions
+
+
+def per_row(sdm, sessions):
+    for location_id, session_date, start_time, end_time, description, sets in sessions:
+        session_id = sdm.create_session(location_id, session_date, start_time, end_time, description)
+        for set_index, set_description, tunes in sets:
+            set_id = sdm.read_or_create_set(set_description, set_fingerprint(tune[0] for tune in tunes))
+            sdm.create_set_to_session(session_id, set_id, set_index)
+            for tune_index, tune in enumerate(tunes, start=1):
+                tune_id = sdm.get_id_or_create_tune(*tune)
+                sdm.create_tune_to_set(tune_id, set_id, tune_index)
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100, help="Number of synthetic sessions")
+    parser.add_argument("--sets_per_session", type=int, default=12)
+    parser.add_argument("--tunes_per_set", type=int, default=3)
+    parser.add_argument("--tune_pool", type=int, default=400, help="Number of distinct tunes to draw from")
+    parser.add_argument("--latency_ms", type=float, default=2.0, help="Simulated round trip latency")
+    parser.add_argument("--batch_size", type=int, default=500)
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+    sessions = synthetic_sessions(args.sessions, args.sets_per_session, args.tunes_per_set, args.tune_pool)
+
+    for name, run in (
+            ("per-row", lambda sdm: per_row(sdm, sessions)),
+            ("unwind", lambda sdm: sdm.ingest_sessions(sessions, args.batch_size))):
+        driver = StandInDriver(latency=args.latency_ms / 1000)
+        with SessionDataManager.SessionDataManager(":memory:", initialize_db=False, driver=driver) as sdm:
+            start = time.perf_counter()
+            run(sdm)
+            elapsed = time.perf_counter() - start
+        print(f"{name:>8}: {driver.round_trips:6d} round trips {elapsed:8.3f}s")
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,83 @@
+#!python3
+r""" bench_parse_cache.py - cold and warm music21 parse times through ParsedScoreCache
+
+Parses the first --limit tunes of the TheSession-data file three ways:
+plain converter.parse, through an empty cache (cold) and through the filled cache (warm).
+
+"""
+import argparse
+import pathlib
+import statistics
+import sys
+import tempfile
+import time
+from audio import AudioManager
+from parse_cache import ParsedScoreCache
+from tune_lookup import TheSessionTunes
+
+
+def time_parses(tunes, parse_cache):
+    timings = list()
+    for the_session_tune_id, abc, tune_meter, tune_mode in tunes:
+        audio_manager = AudioManager(parse_cache)
+        start = time.perf_counter()
+        try:
+            audio_manager.create_audio_converter(1, the_session_tune_id, tune_meter, tune_mode, abc)
+        except Exception:
+            continue
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    code_root = repo_root.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--session_db",
+        type=pathlib.Path,
+        default=code_root / "TheSession-data" / "thesession.db",
+        help="Filepath of the TheSession-data sqlite file")
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=200,
+        help="Number of tunes to parse")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    the_session_tunes = TheSessionTunes(args.session_db)
+    tune_ids = [str(row[0]) for row in the_session_tunes.conn.execute(
+        "SELECT DISTINCT tune_id FROM tunes LIMIT ?", (args.limit,))]
+    the_session_tunes.prefetch(tune_ids)
+    tunes = list()
+    for tune_id in tune_ids:
+        abc, tune_type, tune_meter, tune_mode = the_session_tunes.get(tune_id)
+        tunes.append((tune_id, abc, tune_meter, tune_mode))
+    the_session_tunes.close()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        parse_cache = ParsedScoreCache(cache_dir)
+        results = {
+            "uncached": time_parses(tunes, None),
+            "cold": time_parses(tunes, parse_cache),
+            "warm": time_parses(tunes, parse_cache)}
+        cache_bytes = sum(path.stat().st_size for path in pathlib.Path(cache_dir).glob("*/*"))
+
+    for name, timings in results.items():
+        if timings:
+            print(f"{name:>8}: {len(timings)} tunes, total {sum(timings):7.2f}s, "
+                  f"median {statistics.median(timings) * 1000:7.2f}ms per tune")
+    print(f"cache size {cache_bytes / 1024:.0f}KiB, {parse_cache.stats()}")
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,107 @@
+#!python3
+r""" bench_recognition.py - matches per second of FingerprintStore as the corpus grows
+
+Builds corpora of random walk melodies fingerprinted from their note events, then matches
+--queries clips cut from corpus tunes, played at a random tempo with noise added to the chroma.
+Reports the one off corpus transform, matches per second, median per stage timings and top 1 accuracy
+for each corpus size.
+
+"""
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+import numpy
+from recognition import FingerprintStore, events_chroma, fingerprint_repeats, frames_per_second
+
+
+def random_events(rng, notes=48, note_seconds=0.25, tempo=1.0):
+    """Note events of a random walk melody in the AudioManager.note_events layout, played repeats times"""
+    pitch = rng.randrange(60, 72)
+    pitches = list()
+    for note in range(notes):
+        pitch = min(max(pitch + rng.choice((-4, -2, -1, 0, 1, 2, 3, 5)), 55), 84)
+        pitches.append(pitch)
+    events = list()
+    for index, pitch in enumerate(pitches * fingerprint_repeats):
+        start = index * note_seconds / tempo
+        events.append((start, True, pitch, 90))
+        events.append((start + note_seconds / tempo, False, pitch, 0))
+    return events
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs='+',
+        default=[250, 1000, 4000, 16000],
+        help="Corpus sizes in tunes")
+    parser.add_argument(
+        "--queries",
+        type=int,
+        default=50,
+        help="Clips matched per corpus size")
+    parser.add_argument(
+        "--clip_seconds",
+        type=float,
+        default=8.0,
+        help="Length of each clip")
+    parser.add_argument(
+        '--transpose',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Also try each clip in every key")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    rng = random.Random(0)
+    noise = numpy.random.default_rng(0)
+    seeds = [rng.randrange(1 << 30) for _ in range(max(args.sizes))]
+    clip_frames = int(args.clip_seconds * frames_per_second)
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as store_dir:
+            start = time.perf_counter()
+            FingerprintStore.write(store_dir, ((key, events_chroma(random_events(random.Random(seeds[key])))) for key in range(size)))
+            build_seconds = time.perf_counter() - start
+            store = FingerprintStore(store_dir)
+
+            stages = dict()
+            hits = 0
+            match_seconds = list()
+            for query in range(args.queries + 1):
+                key = rng.randrange(size)
+                tempo = rng.uniform(0.85, 1.2)
+                chroma = events_chroma(random_events(random.Random(seeds[key]), tempo=tempo))
+                offset = rng.randrange(max(len(chroma) - clip_frames, 1))
+                clip = chroma[offset:offset + clip_frames] + noise.uniform(0, 0.3, (min(clip_frames, len(chroma) - offset), 12)).astype(numpy.float32)
+                start = time.perf_counter()
+                results, timings = store.match(clip, 1, args.transpose)
+                if query == 0:
+                    # the first match pays for the corpus transform
+                    corpus_seconds = timings["corpus_fft"]
+                    continue
+                match_seconds.append(time.perf_counter() - start)
+                hits += bool(results) and results[0][0] == str(key)
+                for stage, seconds in timings.items():
+                    stages.setdefault(stage, list()).append(seconds)
+
+        print(f"{size:>6} tunes, {len(store.matrix) * 48 / 1e6:6.1f}MB matrix, built in {build_seconds:5.2f}s, "
+              f"corpus fft {corpus_seconds * 1000:7.1f}ms, {len(match_seconds) / sum(match_seconds):7.1f} matches/s, "
+              f"top 1 {hits / len(match_seconds):.2f}, "
+              + ", ".join(f"{stage} {statistics.median(seconds) * 1000:.1f}ms" for stage, seconds in stages.items() if stage != "corpus_fft"))
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,211 @@
+#!python3
+r""" bench_scaling.py - parse, ingest and report timings at several sizes of synthetic history, kept as a history
+
+For each of --scales, generates --base_sessions times that many sessions with synthetic_history.py and times
+  parse index      scrape.session_info_tuples_from_html over each location's index page
+  parse sessions   scrape.set_info_tuplets_from_html over every session page
+  ingest sqlite    SessionDataManager.ingest_sessions into the SQLite backend in a temporary file
+  ingest standin   the same into the neo4j backend over standin.py's local graph, no latency
+  report range     read_tune_play_counts, the top 50 tunes of the middle year
+  report top       read_tune_play_counts, the top 50 tunes of the whole history
+Parse and report timings are the median of --repeats runs, each ingest runs once on a fresh database.
+
+Every run is appended as one JSON line to --history_file, with the commit and machine it ran on.
+The run is compared with the last one in the history of the same sizes on the same machine, and any
+timing more than --tolerance times slower is reported as a regression; --check then fails the run.
+
+"""
+import argparse
+import datetime
+import json
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import SessionDataManager
+from scrape import session_info_tuples_from_html, set_info_tuplets_from_html
+from standin import StandInDriver
+from synthetic_history import SyntheticHistory
+
+
+def median_seconds(run, repeats):
+    timings = list()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def ingest_seconds(history, backend, directory, schema_file):
+    driver = StandInDriver() if backend == "neo4j" else None
+    with SessionDataManager.SessionDataManager(
+            ":memory:", initialize_db=True, driver=driver, backend=backend,
+            db_file=pathlib.Path(directory) / f"{backend}.db", schema_file=schema_file) as sdm:
+        # initialize_database creates location 1, the rest get the next ids
+        for description, address, url in history.location_rows()[1:]:
+            sdm.create_location(description, address, url)
+        sessions = list(history.sessions())
+        start = time.perf_counter()
+        sdm.ingest_sessions(sessions)
+        return time.perf_counter() - start
+
+
+def scale_results(history, repeats, schema_file):
+    """{benchmark: {'seconds': ..., 'count': ..., 'unit': ...}} for one generated history"""
+    pages = dict(history.pages())
+    index_pages = [(f"https://ceol.io/{location['path']}", pages[f"{location['path']}index.html"])
+                   for location in history.locations]
+    session_pages = [content for path, content in pages.items() if not path.endswith("index.html")]
+    sets = sum(len(sets) for _, _, sets in history.session_list)
+    dates = sorted(session_date for _, session_date, _ in history.session_list)
+    middle = datetime.date.fromisoformat(dates[len(dates) // 2])
+    year_start, year_end = middle.replace(month=1, day=1).isoformat(), middle.replace(month=12, day=31).isoformat()
+
+    results = dict()
+    results["parse index"] = {
+        "seconds": median_seconds(lambda: [list(session_info_tuples_from_html(content, url)) for url, content in index_pages], repeats),
+        "count": len(session_pages), "unit": "links"}
+    results["parse sessions"] = {
+        "seconds": median_seconds(lambda: [list(set_info_tuplets_from_html(content)) for content in session_pages], repeats),
+        "count": len(session_pages), "unit": "pages"}
+    with tempfile.TemporaryDirectory() as directory:
+        for backend, name in (("sqlite", "ingest sqlite"), ("neo4j", "ingest standin")):
+            results[name] = {
+                "seconds": ingest_seconds(history, backend, directory, schema_file),
+                "count": len(history.session_list), "unit": "sessions"}
+
+        with SessionDataManager.SessionDataManager(
+                ":memory:", initialize_db=False, backend="sqlite",
+                db_file=pathlib.Path(directory) / "sqlite.db", schema_file=schema_file) as sdm:
+            results["report range"] = {
+                "seconds": median_seconds(lambda: sdm.read_tune_play_counts(year_start, year_end, 50), repeats),
+                "count": 1, "unit": "reports"}
+            results["report top"] = {
+                "seconds": median_seconds(lambda: sdm.read_tune_play_counts(dates[0], dates[-1], 50), repeats),
+                "count": 1, "unit": "reports"}
+    print(f"    {len(history.session_list)} sessions, {sets} sets, {len(session_pages)} pages")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=pathlib.Path(__file__).resolve().parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_history(history_file):
+    if not history_file.exists():
+        return list()
+    with open(history_file, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--scales",
+        type=int,
+        nargs='+',
+        default=[1, 10, 100],
+        help="Multiples of --base_sessions to run at")
+    parser.add_argument(
+        "--base_sessions",
+        type=int,
+        default=50,
+        help="Sessions at scale 1, about a year of sessions at a few venues")
+    parser.add_argument(
+        "--locations",
+        type=int,
+        default=3,
+        help="Venues the sessions are spread over")
+    parser.add_argument(
+        "--tune_pool",
+        type=int,
+        default=2000,
+        help="Number of tunes in the repertoire")
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="Runs of each parse and report timing, the median is kept")
+    parser.add_argument(
+        "--history_file",
+        type=pathlib.Path,
+        default=repo_root / "bench_history.jsonl",
+        help="JSON lines file every run is appended to")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.25,
+        help="Slowdown against the previous run reported as a regression")
+    parser.add_argument(
+        '--check',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Fail when a timing regressed")
+    parser.add_argument("--schema_file", type=pathlib.Path, default=repo_root / "init.sql")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    run = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.node(),
+        "base_sessions": args.base_sessions,
+        "locations": args.locations,
+        "tune_pool": args.tune_pool,
+        "results": dict(),  # 'benchmark@scale' : {'seconds': ..., 'count': ..., 'unit': ...}
+    }
+    for scale in args.scales:
+        print(f"scale {scale}x")
+        history = SyntheticHistory(args.base_sessions * scale, args.locations, args.tune_pool)
+        for name, result in scale_results(history, args.repeats, args.schema_file).items():
+            run["results"][f"{name}@{scale}x"] = result
+
+    comparable = ("machine", "base_sessions", "locations", "tune_pool")
+    previous = next((entry for entry in reversed(read_history(args.history_file))
+                     if all(entry.get(key) == run[key] for key in comparable)), None)
+    regressions = list()
+    print(f"\n{'benchmark':>24} {'seconds':>10} {'rate':>18} {'previous':>10}")
+    for key, result in run["results"].items():
+        rate = f"{result['count'] / result['seconds']:.1f} {result['unit']}/s"
+        line = f"{key:>24} {result['seconds']:10.4f} {rate:>18}"
+        before = previous and previous["results"].get(key)
+        if before:
+            ratio = result["seconds"] / before["seconds"]
+            line += f" {before['seconds']:10.4f} {ratio:5.2f}x"
+            if ratio > args.tolerance:
+                regressions.append(key)
+                line += " REGRESSION"
+        print(line)
+    if previous:
+        print(f"compared with {previous['time']} at {previous['commit']}, {len(regressions)} regressions")
+    else:
+        print("no earlier run of these sizes on this machine to compare with")
+
+    args.history_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(args.history_file, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run) + "\n")
+    print(f"Appended to {args.history_file}")
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,78 @@
+#!python3
+r""" bench_set_lookup.py - cost of finding a stored set as the number of sets grows
+
+Fills a SQLite backend with --set_counts synthetic sets and times read_or_create_set on stored sets,
+which seeks the unique fingerprint index, against looking the set up by description with the index
+switched off (NOT INDEXED), which is what MERGE on the unindexed description property did in neo4j.
+
+"""
+import argparse
+import pathlib
+import random
+import statistics
+import sys
+import tempfile
+import time
+import SessionDataManager
+from session_backend import set_fingerprint
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--set_counts",
+        type=int,
+        nargs='+',
+        default=[1000, 10000, 100000],
+        help="Numbers of stored sets to time lookups against")
+    parser.add_argument(
+        "--lookups",
+        type=int,
+        default=200,
+        help="Lookups timed at each set count")
+    parser.add_argument("--schema_file", type=pathlib.Path, default=repo_root / "init.sql")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        with SessionDataManager.SessionDataManager(
+                ":memory:", backend="sqlite", db_file=pathlib.Path(temporary_dir) / "sets.db",
+                schema_file=args.schema_file) as sdm:
+            sets = list()
+            for set_count in args.set_counts:
+                while len(sets) < set_count:
+                    tune_ids = [str(rng.randrange(25000)) for _ in range(rng.randrange(2, 5))]
+                    sets.append((", ".join(f"Tune {tune_id}" for tune_id in tune_ids), set_fingerprint(tune_ids)))
+                with sdm.backend.conn:
+                    sdm.backend.conn.executemany(
+                        "INSERT OR IGNORE INTO SetTable (description, fingerprint) VALUES (?, ?)", sets)
+
+                # Separate passes, a scan in between would push the index pages out of the page cache
+                lookups = rng.sample(sets, min(args.lookups, len(sets)))
+                timings = {"fingerprint": list(), "description scan": list()}
+                for description, fingerprint in lookups:
+                    start = time.perf_counter()
+                    sdm.read_or_create_set(description, fingerprint)
+                    timings["fingerprint"].append(time.perf_counter() - start)
+                for description, fingerprint in lookups:
+                    start = time.perf_counter()
+                    sdm.backend.conn.execute(
+                        "SELECT set_id FROM SetTable NOT INDEXED WHERE description = ?", (description,)).fetchone()
+                    timings["description scan"].append(time.perf_counter() - start)
+                for name, seconds in timings.items():
+                    print(f"{set_count:>8} sets {name:>16}: median {statistics.median(seconds) * 1e6:9.1f}us")
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
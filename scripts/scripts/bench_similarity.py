@@ -0,0 +1,141 @@
+#!python3
+r""" bench_similarity.py - recall and latency of TuneSimilarityIndex against a brute force scan
+
+Queries are random --fragment_notes long slices of indexed tunes, with --mutations notes
+moved a step up or down to stand in for a variant setting. A query is a hit when the tune the
+fragment came from is in the top --top results. The brute force scan intersects the fragment
+features with every tune's features in turn, which is what the index avoids.
+
+Uses the TheSession-data file when it exists, otherwise --synthetic random walk tunes.
+
+"""
+import argparse
+import pathlib
+import random
+import statistics
+import sys
+import tempfile
+import time
+import numpy
+from similarity import TuneSimilarityIndex, melody_features, the_session_tunes
+
+
+def synthetic_tunes(count, notes, seed=0):
+    rng = random.Random(seed)
+    letters = "CDEFGABcdefgab"
+    for key in range(count):
+        position = rng.randrange(len(letters))
+        melody = list()
+        for note in range(notes):
+            position = min(max(position + rng.choice((-2, -1, -1, 0, 1, 1, 2, 3)), 0), len(letters) - 1)
+            melody.append(letters[position])
+        yield str(key), "X:1\nK:D\n" + " ".join("".join(melody[i:i + 8]) + "|" for i in range(0, notes, 8))
+
+
+def fragment(abc, fragment_notes, mutations, rng):
+    notes = [note for note in abc.split("\n")[-1] if note.isalpha()]
+    if len(notes) > fragment_notes:
+        start = rng.randrange(len(notes) - fragment_notes)
+        notes = notes[start:start + fragment_notes]
+    letters = "CDEFGABcdefgab"
+    for _ in range(mutations):
+        position = rng.randrange(len(notes))
+        if notes[position] in letters:
+            step = min(max(letters.index(notes[position]) + rng.choice((-1, 1)), 0), len(letters) - 1)
+            notes[position] = letters[step]
+    return "".join(notes)
+
+
+def brute_force(tune_features, query_features, top):
+    scores = list()
+    for key, features in tune_features:
+        shared = len(numpy.intersect1d(features, query_features, assume_unique=True))
+        if shared:
+            scores.append((shared / numpy.sqrt(max(len(features), 1)), key))
+    scores.sort(reverse=True)
+    return [key for score, key in scores[:top]]
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    code_root = repo_root.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--session_db",
+        type=pathlib.Path,
+        default=code_root / "TheSession-data" / "thesession.db",
+        help="Filepath of the TheSession-data sqlite file")
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        default=5000,
+        help="Number of synthetic tunes when there is no TheSession-data file")
+    parser.add_argument(
+        "--queries",
+        type=int,
+        default=200,
+        help="Number of fragment queries")
+    parser.add_argument(
+        "--fragment_notes",
+        type=int,
+        default=16,
+        help="Notes per fragment")
+    parser.add_argument(
+        "--mutations",
+        type=int,
+        default=1,
+        help="Notes changed in each fragment")
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help="Recall is measured at this many results")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    if args.session_db.exists():
+        tunes = [(str(key), abc or "") for key, abc in the_session_tunes(args.session_db)]
+    else:
+        tunes = list(synthetic_tunes(args.synthetic, 64))
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = TuneSimilarityIndex(pathlib.Path(index_dir) / "index")
+        start = time.perf_counter()
+        index.add(tunes)
+        print(f"indexed {len(tunes)} settings in {time.perf_counter() - start:.2f}s")
+        tune_features = [(key, melody_features(abc)) for key, abc in tunes]
+
+        results = {"index": ([], []), "brute force": ([], [])}
+        for _ in range(args.queries):
+            key, abc = rng.choice(tunes)
+            query = fragment(abc, args.fragment_notes, args.mutations, rng)
+            query_features = melody_features(query)
+
+            start = time.perf_counter()
+            found = [found_key for found_key, score in index.query(query, args.top)]
+            results["index"][0].append(time.perf_counter() - start)
+            results["index"][1].append(key in found)
+
+            start = time.perf_counter()
+            found = brute_force(tune_features, query_features, args.top)
+            results["brute force"][0].append(time.perf_counter() - start)
+            results["brute force"][1].append(key in found)
+
+    for name, (timings, hits) in results.items():
+        print(f"{name:>12}: recall@{args.top} {sum(hits) / len(hits):.3f}, "
+              f"median {statistics.median(timings) * 1000:7.2f}ms, "
+              f"p95 {sorted(timings)[int(len(timings) * 0.95)] * 1000:7.2f}ms per query")
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,111 @@
+#!python3
+r""" bench_snapshot.py - write, random read and replay speed of a crawl snapshot, all offline
+
+Writes --sessions synthetic session pages and their index page to a snapshot as scrape.py --snapshot_file does,
+reads random single pages back through the mmap, then times scrape.snapshot_session_pages, the
+decompress and parse half of scrape.py --replay, with each of --workers processes.
+Give --snapshot_file to time the replay of a real snapshot instead, --url must then be the crawled index url.
+
+"""
+import argparse
+import datetime
+import pathlib
+import random
+import statistics
+import sys
+import tempfile
+import time
+from bench_ceol_html import synthetic_page
+from scrape import snapshot_session_pages
+from snapshot import SnapshotReader, SnapshotWriter
+
+
+def write_synthetic(snapshot_file, ceol_url, sessions, sets):
+    rng = random.Random(0)
+    first = datetime.date(2015, 1, 1)
+    dates = [(first + datetime.timedelta(days=7 * week)).isoformat() for week in range(sessions)]
+    index = "".join(f'<li><a href="{date}.html">{date}</a></li>' for date in dates)
+    pages = [(ceol_url, f'<html><body><ul>{index}</ul></body></html>'.encode('utf-8'))]
+    pages.extend((f"{ceol_url}{date}.html", synthetic_page(rng, sets)) for date in dates)
+
+    start = time.perf_counter()
+    with SnapshotWriter(snapshot_file) as writer:
+        for url, content in pages:
+            writer.add(url, content)
+    seconds = time.perf_counter() - start
+    raw = sum(len(content) for url, content in pages)
+    stored = pathlib.Path(snapshot_file).stat().st_size
+    print(f"wrote {len(pages)} pages in {seconds:.2f}s, {raw / seconds / 2 ** 20:.1f}MiB/s, "
+          f"{raw / 2 ** 20:.1f}MiB in {stored / 2 ** 20:.1f}MiB ({raw / stored:.1f}x)")
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--snapshot_file",
+        type=pathlib.Path,
+        help="Existing snapshot to time instead of a synthetic one")
+    parser.add_argument(
+        "--url",
+        type=str,
+        default="https://ceol.io/sessions/austin/mueller/",
+        help="Index page url in the snapshot")
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=2000,
+        help="Number of synthetic session pages")
+    parser.add_argument(
+        "--sets",
+        type=int,
+        default=25,
+        help="Sets per synthetic session page")
+    parser.add_argument(
+        "--reads",
+        type=int,
+        default=2000,
+        help="Random single page reads")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        help="Replay with each of these numbers of processes")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        snapshot_file = args.snapshot_file
+        if snapshot_file is None:
+            snapshot_file = pathlib.Path(temporary_dir) / "snapshot.ceol"
+            write_synthetic(snapshot_file, args.url, args.sessions, args.sets)
+
+        with SnapshotReader(snapshot_file) as reader:
+            urls = reader.urls()
+            rng = random.Random(1)
+            timings = list()
+            for _ in range(args.reads):
+                url = rng.choice(urls)
+                start = time.perf_counter()
+                reader.read(url)
+                timings.append(time.perf_counter() - start)
+        print(f"random page reads: median {statistics.median(timings) * 1e6:.0f}us, "
+              f"p95 {sorted(timings)[int(len(timings) * 0.95)] * 1e6:.0f}us")
+
+        for workers in args.workers:
+            start = time.perf_counter()
+            sessions = sum(1 for _ in snapshot_session_pages(args.url, snapshot_file, workers))
+            seconds = time.perf_counter() - start
+            print(f"replay with {workers} workers: {sessions} sessions in {seconds:.2f}s, {sessions / seconds:.0f} sessions/s")
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,97 @@
+#!python3
+r""" bench_synthesis.py - per tune latency of in-process synthesis against the fluidsynth command line
+
+The command line path is what AudioManager.write_wav used to do:
+write a .mid file, run fluidsynth on it and read the WAV back.
+
+Dependencies
+    fluidsynth on the PATH for the command line path
+
+"""
+import argparse
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from audio import AudioManager
+from tune_lookup import TheSessionTunes
+
+
+def render_with_cli(audio_manager, font_file, directory):
+    midi_file = os.path.join(directory, "tune.mid")
+    wav_file = os.path.join(directory, "tune.wav")
+    audio_manager.audio_stream.write('midi', midi_file)
+    subprocess.run(['fluidsynth', '-ni', str(font_file), midi_file, '-F', wav_file, '-n'], capture_output=True, check=True)
+    with wave.open(wav_file, 'rb') as f:
+        return f.readframes(f.getnframes())
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    code_root = repo_root.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--session_db",
+        type=pathlib.Path,
+        default=code_root / "TheSession-data" / "thesession.db",
+        help="Filepath of the TheSession-data sqlite file")
+    parser.add_argument(
+        "--soundfont_file",
+        type=pathlib.Path,
+        default=repo_root / "soundfonts" / "Tabla.sf2",
+        help="The SoundFont File to create audio from ABC notation")
+    parser.add_argument(
+        "--the_session_tune_ids",
+        type=str,
+        nargs='+',
+        default=["1", "2", "5", "8", "9", "21", "142", "320", "358", "1076"],
+        help="TheSession tunes to render")
+    parser.add_argument(
+        '--cli',
+        default=True,
+        action=argparse.BooleanOptionalAction,
+        help="Also time the fluidsynth command line path")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    the_session_tunes = TheSessionTunes(args.session_db)
+    the_session_tunes.prefetch(args.the_session_tune_ids)
+    timings = {"in-process": list(), "cli": list()}
+    with tempfile.TemporaryDirectory() as directory:
+        for the_session_tune_id in args.the_session_tune_ids:
+            abc, tune_type, tune_meter, tune_mode = the_session_tunes.get(the_session_tune_id)
+            if not abc:
+                continue
+            audio_manager = AudioManager()
+            audio_manager.create_audio_converter(1, the_session_tune_id, tune_meter, tune_mode, abc)
+
+            start = time.perf_counter()
+            audio_manager.pcm_buffer(args.soundfont_file)
+            timings["in-process"].append(time.perf_counter() - start)
+
+            if args.cli:
+                start = time.perf_counter()
+                render_with_cli(audio_manager, args.soundfont_file, directory)
+                timings["cli"].append(time.perf_counter() - start)
+    the_session_tunes.close()
+
+    for name, samples in timings.items():
+        if samples:
+            print(f"{name:>10}: {len(samples)} tunes, median {statistics.median(samples) * 1000:8.1f}ms, "
+                  f"max {max(samples) * 1000:8.1f}ms per tune")
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
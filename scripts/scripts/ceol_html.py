@@ -0,0 +1,162 @@
+#!python3
+r""" ceol_html.py - pull the set lists and session links out of ceol.io pages without building a tree
+
+BeautifulSoup with html.parser builds every element of a page in Python before find_all can run.
+scan() instead walks the markup with one precompiled regex and keeps only the stack of open element
+names, which is all that is needed to know which <a> tags sit inside which <li>. Elements are opened and
+closed the way BeautifulSoup's html.parser builder does it, an end tag closes everything opened after
+its start tag, an end tag with no open start tag is ignored, void elements never open and
+<script>/<style> contents and comments are skipped, so the results are the same as the
+find_all('li') / find_all('a') code kept here as set_info_tuplets_bs4 and anchors_bs4.
+bench_ceol_html.py times the two, check_ceol_html.py compares them over saved pages.
+
+Dependencies
+    py -m pip install bs4
+
+"""
+import concurrent.futures
+import html
+import re
+
+
+re_markup = re.compile(r'''
+    <!--.*?(?:-->|\Z)
+  | <[!?][^>]*>
+  | <(?P<raw>script|style)(?=[\s/>])(?:"[^"]*"|'[^']*'|[^'">])*>.*?(?:</(?P=raw)\s*>|\Z)
+  | <(?P<end>/?)(?P<name>[a-zA-Z][^\t\n\r\f />\x00]*)(?P<attrs>(?:"[^"]*"|'[^']*'|[^'">])*)>
+''', re.IGNORECASE | re.DOTALL | re.VERBOSE)
+re_href = re.compile(r'''(?:^|[\s/])href\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''', re.IGNORECASE)
+# The last path segment before any #setting anchor, https://thesession.org/tunes/123#setting456 -> 123
+re_tune_id = re.compile(r'([^/#]*)(?=#|$)')
+
+void_elements = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'keygen', 'link', 'menuitem', 'meta', 'param',
+    'source', 'track', 'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image', 'isindex', 'nextid', 'spacer'))
+
+
+def decode(content):
+    """Page text from requests style bytes, None if it is not UTF-8 and needs BeautifulSoup's encoding detection"""
+    if isinstance(content, str):
+        return content
+    try:
+        return content.decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+
+def scan(text):
+    """
+    Returns (anchors, items) for the page text.
+    anchors is [(href, link_text), ...] for every <a> in document order, href None when it has none,
+    items is one list of anchor indexes per <li> in document order, an anchor is in every <li> it is nested in.
+    """
+    anchors = list()  # [href, text start, text end] while open
+    items = list()
+    stack = list()  # (name, anchor index or None, item index or None) of the open elements
+    open_items = list()  # item indexes of the open <li>
+
+    def close(entry, position):
+        name, anchor, item = entry
+        if anchor is not None:
+            anchors[anchor][2] = position
+        if item is not None:
+            open_items.remove(item)
+
+    for match in re_markup.finditer(text):
+        name = match.group('name')
+        if name is None:
+            continue
+        name = name.lower()
+        if match.group('end'):
+            for depth in range(len(stack) - 1, -1, -1):
+                if stack[depth][0] == name:
+                    for entry in reversed(stack[depth:]):
+                        close(entry, match.start())
+                    del stack[depth:]
+                    break
+            continue
+
+        attrs = match.group('attrs')
+        anchor = item = None
+        if name == 'a':
+            href = None
+            for href_match in re_href.finditer(attrs):
+                href = html.unescape(next(value for value in href_match.groups() if value is not None))
+            anchor = len(anchors)
+            anchors.append([href, match.end(), None])
+            for open_item in open_items:
+                items[open_item].append(anchor)
+        elif name == 'li':
+            item = len(items)
+            items.append(list())
+            open_items.append(item)
+        entry = (name, anchor, item)
+        if name in void_elements or attrs.endswith('/'):
+            close(entry, match.end())
+        else:
+            stack.append(entry)
+
+    for entry in reversed(stack):
+        close(entry, len(text))
+    return [(href, html.unescape(re_markup.sub('', text[start:end]))) for href, start, end in anchors], items
+
+
+def tune_id(tune_url):
+    return re_tune_id.search(tune_url).group(1)
+
+
+def set_info_tuplets(content):
+    """
+    Yields (set_index, tunes) for each <li> of a ceol.io session page, 1 based,
+    where tunes is a list of (tune_name, tune_id, tune_url). <a> tags without an href are left out.
+    """
+    text = decode(content)
+    if text is None:
+        yield from set_info_tuplets_bs4(content)
+        return
+    anchors, items = scan(text)
+    for set_index, item in enumerate(items, start=1):
+        yield set_index, [
+            (anchors[anchor][1], tune_id(anchors[anchor][0]), anchors[anchor][0])
+            for anchor in item if anchors[anchor][0] is not None]
+
+
+def anchors(content):
+    """[(href, link_text), ...] of every <a> of a page"""
+    text = decode(content)
+    if text is None:
+        return anchors_bs4(content)
+    return scan(text)[0]
+
+
+def set_info_tuplets_bs4(content):
+    """The original BeautifulSoup extraction, the reference set_info_tuplets is checked against"""
+    # bs4 is only loaded for the reference and for pages that are not UTF-8
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
+    set_index = 0
+    for li in soup.find_all('li'):
+        set_index += 1
+        tunes = list()
+        for a_tag in li.find_all('a'):
+            tune_url = a_tag.get("href")
+            if tune_url is None:
+                continue
+            tunes.append((a_tag.text, tune_url.split("#")[0].split('/')[-1], tune_url))
+        yield set_index, tunes
+
+
+def anchors_bs4(content):
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
+    return [(a_tag.get("href"), a_tag.text) for a_tag in soup.find_all('a')]
+
+
+def set_info_lists(content):
+    return list(set_info_tuplets(content))
+
+
+def parse_set_pages(contents, workers=None, chunksize=16):
+    """Yields the list of set_info_tuplets for each page of contents, in order, parsed across a process pool"""
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(set_info_lists, contents, chunksize=chunksize)
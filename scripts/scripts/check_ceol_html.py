@@ -0,0 +1,96 @@
+#!python3
+r""" check_ceol_html.py - check ceol_html's fast extraction gives what BeautifulSoup gives
+
+Compares set_info_tuplets with set_info_tuplets_bs4 and anchors with anchors_bs4 on a set of
+awkward snippets, optionally on random tag soup, and on every saved page under --pages_dir (*.html, recursively, e.g. a fixture_server.py directory).
+Prints each page that differs and returns 1 if any does.
+
+"""
+import argparse
+import pathlib
+import random
+import sys
+from ceol_html import anchors, anchors_bs4, set_info_tuplets, set_info_tuplets_bs4
+
+
+snippets = {
+    "plain": '<ul><li><a href="https://thesession.org/tunes/1#setting1">The Kesh</a> <a href="https://thesession.org/tunes/2">Jig</a></li></ul>',
+    "entities": '<li><a href="/tunes/3?a=1&amp;b=2#setting9">Tom &amp; Jerry&#39;s &eacute;</a></li>',
+    "nested markup": '<li><a href=/tunes/4><b>Bold</b> <i>name</i></a></li>',
+    "unclosed li": '<ul><li><a href="/tunes/5">A</a><li><a href="/tunes/6">B</a></ul><a href="/tunes/7">after</a>',
+    "unclosed a": '<li><a href="/tunes/8">open <li>inner</li> tail</li><a href="/tunes/9">x</a>',
+    "end tag closes li": '<ul><li><a href="/tunes/10">A</a></ul><li><a href="/tunes/11">B</a></li>',
+    "stray end tags": '</li></a><li></div><a href="/tunes/12">A</a></li></li>',
+    "no href": '<li><a name="top">anchor</a><a href="/tunes/13">T</a></li>',
+    "comments and script": '<li><!-- <a href="/tunes/0">no</a> --><script>var s = "<a href=/tunes/0>";</script>'
+                           '<a href="/tunes/14">Real<!-- hidden --></a></li>',
+    "attribute with markup": '<li><div title="<a href=/tunes/0>"><a href=\'/tunes/15\' class="x">Q</a></div></li>',
+    "case and spacing": '<UL><LI><A HREF = "/tunes/16#setting2" >Upper</A ></LI ></UL>',
+    "self closing": '<li><a href="/tunes/17"/>after</li><li/><a href="/tunes/18">out</a>',
+    "void elements": '<li><a href="/tunes/19">one<br>two<img src=x></a><hr></li>',
+    "duplicate href": '<li><a href="/tunes/20" href="/tunes/21">dup</a></li>',
+    "empty": '',
+    "bytes": '<li><a href="/tunes/22">Café</a></li>'.encode('utf-8'),
+    "latin-1 bytes": '<li><a href="/tunes/23">Café</a></li>'.encode('latin-1'),
+}
+
+
+def random_page(rng, pieces=40):
+    """Random tag soup made of the markup the snippets exercise, for --fuzz"""
+    parts = (
+        '<li>', '</li>', '<ul>', '</ul>', '<div class="a>b">', '</div>', '<a href="/tunes/{n}#setting{n}">', "<a href='/tunes/{n}'>",
+        '<a href=/tunes/{n}>', '<a>', '</a>', '<a href="/tunes/{n}"/>', '<br>', '<b>', '</b>', '<!-- <li> -->',
+        '<script>"<a href=x>"</script>', ' Tune {n} ', '&amp;', '&#233;', '<LI>', '</A>', '<p>', '</p>')
+    return "".join(rng.choice(parts).format(n=rng.randrange(1000)) for _ in range(pieces))
+
+
+def differences(content):
+    """Names of the extractions that differ for one page"""
+    different = list()
+    if list(set_info_tuplets(content)) != list(set_info_tuplets_bs4(content)):
+        different.append("set_info_tuplets")
+    if anchors(content) != anchors_bs4(content):
+        different.append("anchors")
+    return different
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--pages_dir",
+        type=pathlib.Path,
+        help="Directory of saved pages to compare as well")
+    parser.add_argument(
+        "--fuzz",
+        type=int,
+        default=0,
+        help="Also compare this many pages of random tag soup")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    pages = list(snippets.items())
+    if args.pages_dir:
+        pages.extend((str(path), path.read_bytes()) for path in sorted(args.pages_dir.rglob("*.html")))
+    rng = random.Random(0)
+    pages.extend((f"fuzz {index}", random_page(rng)) for index in range(args.fuzz))
+    failed = 0
+    for name, content in pages:
+        different = differences(content)
+        if different:
+            failed += 1
+            print(f"DIFFERS {name}: {', '.join(different)}")
+            print(f"    fast {list(set_info_tuplets(content))} {anchors(content)}")
+            print(f"    bs4  {list(set_info_tuplets_bs4(content))} {anchors_bs4(content)}")
+    print(f"{len(pages) - failed} of {len(pages)} pages match")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
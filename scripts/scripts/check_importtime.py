@@ -0,0 +1,117 @@
+#!python3
+r""" check_importtime.py - keep `scripts --help` and the lightweight subcommands within a startup budget
+
+Runs cli.py with each of --cases under `python -X importtime` and adds up the cumulative time of the
+modules it imported beyond what a bare interpreter imports. A case fails when that is over --budget_ms,
+or when it imported one of --forbidden at all, the modules that take hundreds of milliseconds to seconds
+and belong to the subcommand that needs them. The heaviest imports of each case are listed.
+Import times depend on the machine and on a warm disk cache, so the median of --repeats runs is used.
+
+"""
+import argparse
+import pathlib
+import statistics
+import subprocess
+import sys
+
+default_cases = ["--help", "scrape --help", "render --help", "export --help"]
+default_forbidden = ["music21", "neo4j", "requests", "bs4", "sqlglot", "numpy", "scipy", "librosa", "pydub", "fluidsynth"]
+
+
+def importtime(command):
+    """
+    ({module: cumulative microseconds} of the modules command imported at the top level,
+     {every module it imported, nested ones included}) from -X importtime
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime"] + command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} exited with {result.returncode}\n{result.stderr[-2000:]}")
+    top_level = dict()
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # the header line
+        # 'import time: self | cumulative | name', nested imports indented under the module that imported them
+        name = fields[2][1:].rstrip()
+        modules.add(name.strip())
+        if name == name.lstrip():
+            top_level[name] = top_level.get(name, 0) + int(fields[1])
+    return top_level, modules
+
+
+def case_imports(case, baseline, repeats):
+    """
+    ({module: median cumulative microseconds} of the top level imports of `scripts case` not in baseline,
+     {top level package of every module it imported})
+    """
+    cli = str(pathlib.Path(__file__).resolve().parent / "cli.py")
+    runs = [importtime([cli] + case.split()) for _ in range(repeats)]
+    extra = {name: statistics.median(top_level.get(name, 0) for top_level, _ in runs)
+             for name in set().union(*(top_level for top_level, _ in runs)) if name not in baseline}
+    return extra, {name.split(".")[0] for _, modules in runs for name in modules}
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--cases",
+        type=str,
+        nargs='+',
+        default=default_cases,
+        help="cli.py arguments to time, each quoted as one")
+    parser.add_argument(
+        "--budget_ms",
+        type=float,
+        default=150,
+        help="Import time each case may spend beyond a bare interpreter")
+    parser.add_argument(
+        "--forbidden",
+        type=str,
+        nargs='*',
+        default=default_forbidden,
+        help="Top level packages the cases must not import")
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="Runs of each case, the median is compared with the budget")
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=5,
+        help="Heaviest imports listed for each case")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    baseline = set(importtime(["-c", "pass"])[0])
+    failures = 0
+    for case in args.cases:
+        extra, packages = case_imports(case, baseline, args.repeats)
+        total_ms = sum(extra.values()) / 1000
+        forbidden = sorted(packages & set(args.forbidden))
+
+        status = "ok"
+        if total_ms > args.budget_ms or forbidden:
+            status = "FAIL"
+            failures += 1
+        print(f"scripts {case}: {total_ms:.1f}ms of imports, budget {args.budget_ms:.0f}ms {status}")
+        if forbidden:
+            print(f"    imports {', '.join(forbidden)}")
+        for name, microseconds in sorted(extra.items(), key=lambda item: -item[1])[:args.top]:
+            print(f"    {microseconds / 1000:8.1f}ms {name}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
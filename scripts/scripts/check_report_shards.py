@@ -0,0 +1,149 @@
+#!python3
+r""" check_report_shards.py - check incremental report shards match a full publish and the live report joins
+
+Ingests a synthetic_history.py history into a temporary SQLite file in --steps batches, publishing the
+shards with report_shards.publish after each batch the way scrape.py --publish_dir does, then publishes
+everything again into a second directory. The two manifests must name the same shards, the names are
+content hashes. Then for --ranges random date ranges, with and without a key, the counts report_shards.read_range
+sums from the month shards must equal /tunes-in-range and /sets-in-range run against the database,
+and every published set must list the tunes /set gives. Returns 1 if anything differs.
+
+"""
+import argparse
+import datetime
+import pathlib
+import random
+import sys
+import tempfile
+import SessionDataManager
+import report_shards
+from scrape import ingested_plays
+from synthetic_history import SyntheticHistory
+
+# report_queries.sql /tunes-in-range and /sets-in-range as counts, the key filter as in their ?key variants
+live_tunes_query = (
+    "SELECT t.tune_id, COUNT(tts.tune_id) "
+    "FROM Tune t "
+    "JOIN TuneToSet tts ON t.tune_id = tts.tune_id "
+    "JOIN SetTable s ON s.set_id = tts.set_id "
+    "JOIN SetToSession st ON s.set_id = st.set_id "
+    "JOIN Session ses ON st.session_id = ses.session_id "
+    "WHERE ses.session_date BETWEEN ? AND ? AND (? IS NULL OR t.tune_mode = ?) "
+    "GROUP BY t.tune_id"
+)
+live_sets_query = (
+    "SELECT s.set_id, COUNT(*) "
+    "FROM SetTable s "
+    "JOIN SetToSession st ON s.set_id = st.set_id "
+    "JOIN Session ses ON st.session_id = ses.session_id "
+    "WHERE ses.session_date BETWEEN ? AND ? "
+    "AND (? IS NULL OR EXISTS (SELECT 1 FROM TuneToSet tts JOIN Tune t ON t.tune_id = tts.tune_id "
+    "                          WHERE tts.set_id = s.set_id AND t.tune_mode = ?)) "
+    "GROUP BY s.set_id"
+)
+
+
+def differences(manifest, other):
+    """The sections of two manifests that name different shards"""
+    return [section for section in ("top", "months", "sets", "tunes") if manifest[section] != other[section]]
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=300,
+        help="Sessions in the synthetic history")
+    parser.add_argument(
+        "--locations",
+        type=int,
+        default=2,
+        help="Venues the sessions are spread over")
+    parser.add_argument(
+        "--tune_pool",
+        type=int,
+        default=500,
+        help="Number of tunes in the repertoire")
+    parser.add_argument(
+        "--steps",
+        type=int,
+        default=4,
+        help="Ingest batches, each followed by an incremental publish")
+    parser.add_argument(
+        "--id_shards",
+        type=int,
+        default=16,
+        help="Shards the sets and tunes are spread over")
+    parser.add_argument(
+        "--ranges",
+        type=int,
+        default=20,
+        help="Random date ranges compared with the live joins")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--schema_file", type=pathlib.Path, default=repo_root / "init.sql")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    rng = random.Random(args.seed)
+    history = SyntheticHistory(args.sessions, args.locations, args.tune_pool, seed=args.seed)
+    sessions = list(history.sessions())
+    failures = 0
+    with tempfile.TemporaryDirectory() as directory, SessionDataManager.SessionDataManager(
+            ":memory:", initialize_db=True, backend="sqlite",
+            db_file=pathlib.Path(directory) / "sessions.db", schema_file=args.schema_file) as sdm:
+        for description, address, url in history.location_rows()[1:]:
+            sdm.create_location(description, address, url)
+        incremental_dir = pathlib.Path(directory) / "incremental"
+        full_dir = pathlib.Path(directory) / "full"
+
+        step = -(-len(sessions) // args.steps)
+        for start in range(0, len(sessions), step):
+            batch = sessions[start:start + step]
+            plays = list(ingested_plays(batch, sdm.ingest_sessions(batch)))
+            # The first publish has no manifest to add to and reads everything
+            incremental = report_shards.publish(sdm, incremental_dir, plays, id_shards=args.id_shards)
+        full = report_shards.publish(sdm, full_dir, id_shards=args.id_shards)
+
+        different = differences(incremental, full)
+        print(f"incremental and full publish: {', '.join(different) or 'the same shards'}")
+        failures += bool(different)
+
+        conn = sdm.backend.conn
+        dates = sorted(sdm.read_session_dates())
+        keys = sorted({row[0] for row in conn.execute("SELECT DISTINCT tune_mode FROM Tune WHERE tune_mode IS NOT NULL")})
+        first, last = datetime.date.fromisoformat(dates[0]), datetime.date.fromisoformat(dates[-1])
+        for _ in range(args.ranges):
+            start_date, end_date = sorted(
+                (first + datetime.timedelta(days=rng.randint(-10, (last - first).days + 10))).isoformat() for _ in range(2))
+            for key in (None, rng.choice(keys)):
+                tunes, sets = report_shards.read_range(incremental_dir, start_date, end_date, key)
+                published = ({tune_id: count for tune_id, _, _, count in tunes}, {set_id: count for set_id, _, count in sets})
+                live = tuple(dict(conn.execute(query, (start_date, end_date, key, key)).fetchall())
+                             for query in (live_tunes_query, live_sets_query))
+                if published != live:
+                    failures += 1
+                    print(f"{start_date} to {end_date} key {key}: shards {len(published[0])} tunes {len(published[1])} sets, "
+                          f"live {len(live[0])} tunes {len(live[1])} sets")
+
+        set_shards = [report_shards.read_shard(incremental_dir, path) for path in incremental["sets"].values()]
+        published_sets = {entry["set_id"]: [tune["tune_id"] for tune in entry["tunes"]] for shard in set_shards for entry in shard.values()}
+        wrong_sets = [set_id for set_id, tune_ids in published_sets.items()
+                      if tune_ids != [tune[0] for tune in sdm.read_set_tunes(set_id)]]
+        print(f"{args.ranges} date ranges compared, {len(published_sets)} sets, {len(wrong_sets)} with the wrong tunes")
+        failures += len(wrong_sets)
+    print(f"{failures} differences")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,66 @@
+#!python3
+r""" cli.py - one entry point for the session tunes scripts
+
+    scripts scrape ...   scrape.py, crawl ceol.io session pages into the session data
+    scripts render ...   parse_audio.py, render tunes or a practice set to WAV
+    scripts export ...   export.py, write tunes to ABC, MIDI and MusicXML archives
+    scripts schema ...   sql2puml.py, draw the init.sql schema as a PlantUml diagram
+    scripts publish ...  report_shards.py, write the site's reports as static JSON shards
+
+Everything after the subcommand goes to that script, `scripts render --help` prints its options.
+A subcommand's module, and with it music21, neo4j, requests or sqlglot, is only imported when that
+subcommand runs, so `scripts --help` and the subcommands' --help start quickly; check_importtime.py keeps them so.
+
+Installed as the `scripts` console script by `poetry install`, or run in place with `py cli.py`.
+
+"""
+import argparse
+import importlib
+import pathlib
+import sys
+
+# subcommand : module, the module is imported when its subcommand runs
+subcommands = {
+    "scrape": "scrape",
+    "render": "parse_audio",
+    "export": "export",
+    "schema": "sql2puml",
+    "publish": "report_shards",
+}
+
+
+def parser():
+    parser = argparse.ArgumentParser(
+        prog="scripts",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "subcommand",
+        choices=list(subcommands),
+        help="The script to run, see above")
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] in ("-h", "--help"):
+        parser().print_help()
+        return 0
+    name = parser().parse_args(argv[:1]).subcommand
+
+    # The scripts import each other by module name, and sql2puml.py sits at the repo root next to init.sql
+    scripts_dir = pathlib.Path(__file__).resolve().parent
+    repo_root = scripts_dir.parent.parent
+    for path in (scripts_dir, repo_root):
+        if str(path) not in sys.path:
+            sys.path.insert(0, str(path))
+
+    module = importlib.import_module(subcommands[name])
+    # The script's own parse() reads sys.argv, its usage line then reads 'scripts <subcommand>'
+    sys.argv = [f"scripts {name}"] + argv[1:]
+    return module.main()
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,306 @@
+#!python3
+r""" cooccurrence.py - which tunes are played together, for "what to learn next"
+
+The model is built from the plays SessionDataManager.read_tune_plays yields and kept as sparse matrices:
+
+    set_plays           tune x set played in a session, how often the tune was in it
+    session_incidence   tune x session, how often the tune was played in the session
+    cooccurrence        tune x tune, how often the two were played in the same set, set_plays @ set_plays.T
+
+Ranking the tunes played next to the ones you know is then a sparse matrix times the vector of known
+tunes, cooccurrence @ known. With a date range or a half life the set plays are weighted by their date,
+set_plays @ (weights * (set_plays.T @ known)), which is still two sparse products and no graph traversal.
+--scope session ranks by tunes played in the same session instead of the same set.
+
+    py cooccurrence.py --build
+    py cooccurrence.py --update                         add the sessions not in the model yet
+    py cooccurrence.py --known 1 27 55 --top 20         TheSession tune ids of the tunes you know
+    py cooccurrence.py --known 1 27 --start 2023-01-01 --half_life 180
+
+Dependencies
+    py -m pip install numpy
+    py -m pip install scipy
+
+"""
+import argparse
+import json
+import os
+import pathlib
+import sys
+import numpy
+import scipy.sparse
+import SessionDataManager
+
+
+class CooccurrenceModel:
+    """
+    The matrices and their row and column labels, stored in model_dir as .npz/.npy files and model.json.
+    Rows are the tunes in the order they were first played, set play and session columns are in session date order.
+    """
+    def __init__(self, model_dir, load=True):
+        self.model_dir = pathlib.Path(model_dir)
+        self.tune_ids = list()  # row : tune_id in the session database
+        self.the_session_tune_ids = list()  # row : TheSession tune id
+        self.names = list()  # row : tune name
+        self.session_ids = list()  # session column : session_id
+        self.rows = dict()  # str(tune_id) : row
+        self.the_session_rows = dict()  # TheSession tune id : row
+        self.set_play_dates = numpy.zeros(0, dtype='datetime64[D]')
+        self.set_play_sessions = numpy.zeros(0, dtype=numpy.int32)  # set play column : session column
+        self.session_dates = numpy.zeros(0, dtype='datetime64[D]')
+        self.set_plays = scipy.sparse.csr_matrix((0, 0), dtype=numpy.int32)
+        self.session_incidence = scipy.sparse.csr_matrix((0, 0), dtype=numpy.int32)
+        self.cooccurrence = scipy.sparse.csr_matrix((0, 0), dtype=numpy.int32)
+        if load and (self.model_dir / "model.json").exists():
+            self.load()
+
+    def __len__(self):
+        return len(self.tune_ids)
+
+    def last_date(self):
+        """The newest session date in the model as 'YYYY-MM-DD', None for an empty model"""
+        return str(self.session_dates.max()) if len(self.session_dates) else None
+
+    def new_session_ids(self, session_ids):
+        """
+        The ones of session_ids not in the model yet. Updating by session rather than by date also picks up
+        sessions ingested later for a date already in the model.
+        """
+        stored = {str(session_id) for session_id in self.session_ids}
+        return [session_id for session_id in session_ids if str(session_id) not in stored]
+
+    def load(self):
+        with (self.model_dir / "model.json").open('r', encoding='utf-8') as f:
+            labels = json.load(f)
+        self.tune_ids = labels["tune_ids"]
+        self.the_session_tune_ids = labels["the_session_tune_ids"]
+        self.names = labels["names"]
+        self.session_ids = labels["session_ids"]
+        self.rows = {str(tune_id): row for row, tune_id in enumerate(self.tune_ids)}
+        self.the_session_rows = {tune_id: row for row, tune_id in enumerate(self.the_session_tune_ids)}
+        self.set_play_dates = numpy.load(self.model_dir / "set_play_dates.npy")
+        self.set_play_sessions = numpy.load(self.model_dir / "set_play_sessions.npy")
+        self.session_dates = numpy.load(self.model_dir / "session_dates.npy")
+        self.set_plays = scipy.sparse.load_npz(self.model_dir / "set_plays.npz").tocsr()
+        self.session_incidence = scipy.sparse.load_npz(self.model_dir / "session_incidence.npz").tocsr()
+        self.cooccurrence = scipy.sparse.load_npz(self.model_dir / "cooccurrence.npz").tocsr()
+
+    def save(self):
+        """Every file is written beside its old version and renamed over it, model.json last"""
+        self.model_dir.mkdir(parents=True, exist_ok=True)
+
+        def replace(name, write):
+            temporary_file = self.model_dir / f"{name}.tmp"
+            with temporary_file.open('wb') as f:
+                write(f)
+            os.replace(temporary_file, self.model_dir / name)
+
+        replace("set_play_dates.npy", lambda f: numpy.save(f, self.set_play_dates))
+        replace("set_play_sessions.npy", lambda f: numpy.save(f, self.set_play_sessions))
+        replace("session_dates.npy", lambda f: numpy.save(f, self.session_dates))
+        replace("set_plays.npz", lambda f: scipy.sparse.save_npz(f, self.set_plays))
+        replace("session_incidence.npz", lambda f: scipy.sparse.save_npz(f, self.session_incidence))
+        replace("cooccurrence.npz", lambda f: scipy.sparse.save_npz(f, self.cooccurrence))
+        labels = {
+            "tune_ids": self.tune_ids,
+            "the_session_tune_ids": self.the_session_tune_ids,
+            "names": self.names,
+            "session_ids": self.session_ids}
+        replace("model.json", lambda f: f.write(json.dumps(labels).encode('utf-8')))
+
+    def add_plays(self, plays):
+        """
+        Add plays, rows in analytics.play_columns order as read_tune_plays yields them, for sessions not in the model yet.
+        Only the new set plays are multiplied out, their co-occurrence is added to the stored one.
+        Returns the number of set plays added.
+        """
+        tune_rows = list()
+        set_play_columns = list()
+        set_play_keys = dict()  # (session_id, set_index) : new set play column
+        session_keys = dict()  # session_id : new session column
+        dates = list()
+        set_play_sessions = list()
+        session_dates = list()
+        for session_date, session_id, set_id, set_index, tune_index, tune_id, the_session_tune_id, name, *_ in plays:
+            row = self.rows.get(str(tune_id))
+            if row is None:
+                row = self.rows[str(tune_id)] = len(self.tune_ids)
+                self.tune_ids.append(tune_id)
+                self.the_session_tune_ids.append(None if the_session_tune_id is None else str(the_session_tune_id))
+                self.the_session_rows.setdefault(self.the_session_tune_ids[-1], row)
+                self.names.append(name)
+            session_column = session_keys.get(session_id)
+            if session_column is None:
+                session_column = session_keys[session_id] = len(session_keys)
+                session_dates.append(str(session_date)[:10])
+            column = set_play_keys.get((session_id, set_index))
+            if column is None:
+                column = set_play_keys[(session_id, set_index)] = len(set_play_keys)
+                dates.append(str(session_date)[:10])
+                set_play_sessions.append(len(self.session_ids) + session_column)
+            tune_rows.append(row)
+            set_play_columns.append(column)
+        if not set_play_keys:
+            return 0
+
+        tunes = len(self.tune_ids)
+        new_set_plays = scipy.sparse.csr_matrix(
+            (numpy.ones(len(tune_rows), dtype=numpy.int32), (tune_rows, set_play_columns)),
+            shape=(tunes, len(set_play_keys)))
+        new_sessions = scipy.sparse.csr_matrix(
+            (numpy.ones(len(tune_rows), dtype=numpy.int32),
+             (tune_rows, [set_play_sessions[column] - len(self.session_ids) for column in set_play_columns])),
+            shape=(tunes, len(session_keys)))
+        added = (new_set_plays @ new_set_plays.T).tocsr()
+        added.setdiag(0)
+        added.eliminate_zeros()
+
+        self.set_plays = scipy.sparse.hstack([self._grown(self.set_plays, tunes), new_set_plays], format='csr')
+        self.session_incidence = scipy.sparse.hstack(
+            [self._grown(self.session_incidence, tunes), new_sessions], format='csr')
+        self.cooccurrence = (self._grown(self.cooccurrence, tunes, tunes) + added).tocsr()
+        self.set_play_dates = numpy.concatenate([self.set_play_dates, numpy.array(dates, dtype='datetime64[D]')])
+        self.set_play_sessions = numpy.concatenate(
+            [self.set_play_sessions, numpy.array(set_play_sessions, dtype=numpy.int32)])
+        self.session_dates = numpy.concatenate([self.session_dates, numpy.array(session_dates, dtype='datetime64[D]')])
+        self.session_ids.extend(session_keys)
+        return len(set_play_keys)
+
+    @staticmethod
+    def _grown(matrix, rows, columns=None):
+        """matrix with empty rows, and columns when given, added for tunes seen for the first time"""
+        matrix = matrix.tocsr()
+        matrix.resize((rows, matrix.shape[1] if columns is None else columns))
+        return matrix
+
+    def date_weights(self, dates, start=None, end=None, half_life=None, as_of=None):
+        """
+        Weight of each date, 0 outside start to end and halving every half_life days before as_of,
+        which defaults to the newest session in the model.
+        """
+        weights = numpy.ones(len(dates), dtype=numpy.float64)
+        if start is not None:
+            weights[dates < numpy.datetime64(start, 'D')] = 0.0
+        if end is not None:
+            weights[dates > numpy.datetime64(end, 'D')] = 0.0
+        if half_life:
+            as_of = numpy.datetime64(as_of or self.last_date(), 'D')
+            age = (as_of - dates).astype(numpy.float64)
+            weights *= numpy.exp2(-numpy.maximum(age, 0.0) / half_life)
+        return weights
+
+    def recommend(self, known, top=20, start=None, end=None, half_life=None, as_of=None, scope="set"):
+        """
+        The tunes most often played in the same set (or session with scope "session") as the known tunes,
+        known being TheSession tune ids. Returns [(the_session_tune_id, name, score), ...], best first,
+        without the known tunes and without tunes never played next to them.
+        """
+        known_rows = [self.the_session_rows.get(str(tune_id)) for tune_id in known]
+        known_rows = numpy.array(sorted({row for row in known_rows if row is not None}), dtype=numpy.int64)
+        if not len(known_rows):
+            return []
+        known_vector = numpy.zeros(len(self.tune_ids), dtype=numpy.float64)
+        known_vector[known_rows] = 1.0
+
+        weighted = start is not None or end is not None or half_life
+        if scope == "set" and not weighted:
+            scores = self.cooccurrence @ known_vector
+        else:
+            incidence, dates = (
+                (self.set_plays, self.set_play_dates) if scope == "set" else (self.session_incidence, self.session_dates))
+            weights = self.date_weights(dates, start, end, half_life, as_of)
+            scores = incidence @ (weights * (incidence.T @ known_vector))
+        scores[known_rows] = 0.0
+
+        candidates = numpy.flatnonzero(scores > 0)
+        if len(candidates) > top:
+            candidates = candidates[numpy.argpartition(-scores[candidates], top - 1)[:top]]
+        candidates = candidates[numpy.lexsort((candidates, -scores[candidates]))]
+        return [(self.the_session_tune_ids[row], self.names[row], float(scores[row])) for row in candidates]
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    code_root = repo_root.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--session_db",
+        type=pathlib.Path,
+        default=code_root / "TheSession-data" / "thesession.db",
+        help="Filepath of the TheSession-data sqlite file")
+    SessionDataManager.add_backend_arguments(parser, repo_root)
+    parser.add_argument(
+        "--model_dir",
+        type=pathlib.Path,
+        default=repo_root / "cooccurrence",
+        help="Directory of the stored model")
+    parser.add_argument(
+        '--build',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Build the model from every stored session, replacing any stored model")
+    parser.add_argument(
+        '--update',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Add the stored sessions that are not in the model yet")
+    parser.add_argument(
+        "--known",
+        type=str,
+        nargs='+',
+        help="TheSession tune ids of the tunes you know, prints the tunes most played next to them")
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=20,
+        help="Number of tunes to suggest")
+    parser.add_argument(
+        "--start",
+        type=str,
+        help="Only count sessions from this date, YYYY-MM-DD")
+    parser.add_argument(
+        "--end",
+        type=str,
+        help="Only count sessions up to this date, YYYY-MM-DD")
+    parser.add_argument(
+        "--half_life",
+        type=float,
+        help="Weight sessions down by half for every this many days before the newest one")
+    parser.add_argument(
+        "--scope",
+        type=str,
+        default="set",
+        choices=("set", "session"),
+        help="Count tunes played in the same set or in the same session")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    if args.build or args.update:
+        model = CooccurrenceModel(args.model_dir, load=args.update)
+        with SessionDataManager.SessionDataManager(
+                args.session_db, initialize_db=False, backend=args.backend, db_file=args.db_file, schema_file=args.schema_file) as sdm:
+            session_ids = model.new_session_ids(sdm.read_session_ids()) if args.update else None
+            added = model.add_plays(sdm.read_tune_plays(session_ids=session_ids))
+        model.save()
+        sessions = "every session" if session_ids is None else f"{len(session_ids)} new sessions"
+        print(f"Added {added} set plays of {sessions}, {len(model)} tunes, "
+              f"{model.cooccurrence.nnz} tune pairs, {model.set_plays.shape[1]} set plays in {args.model_dir}")
+
+    if args.known:
+        model = CooccurrenceModel(args.model_dir)
+        for the_session_tune_id, name, score in model.recommend(
+                args.known, args.top, args.start, args.end, args.half_life, scope=args.scope):
+            print(f"{score:9.2f} {the_session_tune_id:>7} {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
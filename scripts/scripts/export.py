@@ -0,0 +1,376 @@
+#!python3
+r""" export.py - write the ABC, MIDI and MusicXML of a session, a set, a date range or the whole repertoire to one archive
+
+The tunes are converted across a process pool and each file is streamed into the zip or tar archive
+as it comes back, nothing is collected in memory or in a temporary directory.
+Next to the archive, <output_file>.manifest.json keeps a hash of what every tune was exported from.
+On the next export to the same file, the members of tunes whose hash has not changed are copied
+over from the previous archive instead of being converted again.
+Tunes per second and the peak resident memory of this process and its workers are printed at the end.
+
+Dependencies
+    py -m pip install music21
+
+"""
+import argparse
+import concurrent.futures
+import datetime
+import hashlib
+import io
+import json
+import os
+import pathlib
+import re
+import sys
+import tarfile
+import time
+import zipfile
+import instrumentation
+import SessionDataManager
+
+# format : file extension of its members
+formats = {
+    "abc": ".abc",
+    "midi": ".mid",
+    "musicxml": ".musicxml",
+}
+
+tar_modes = {
+    ".tar": "w",
+    ".tgz": "w:gz",
+    ".gz": "w:gz",
+    ".bz2": "w:bz2",
+    ".xz": "w:xz",
+}
+
+re_unsafe = re.compile(r'[^A-Za-z0-9]+')
+
+
+def abc_text(title, meter, key, abc, default_length=None):
+    """A standalone ABC tune, the header fields create_audio_converter puts in front of the stored body"""
+    header = f"X: 1\nT: {title}\nM: {meter}\n"
+    if default_length:
+        header += f"L: {default_length}\n"
+    return header + f"K: {key}\n" + abc.strip() + "\n"
+
+
+def export_key(title, meter, key, abc, default_length, export_formats):
+    """Content hash of an exported tune, anything that changes one of its files changes the key"""
+    digest = hashlib.sha256()
+    for part in (title, abc.strip(), meter, key, default_length or "", ",".join(sorted(export_formats))):
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def member_names(tune_key, title, export_formats):
+    """Archive member name of each format, {format: 'midi/<tune_key>-<title>.mid'}"""
+    slug = re_unsafe.sub('-', title).strip('-').lower()[:60] or "untitled"
+    return {export_format: f"{export_format}/{tune_key}-{slug}{formats[export_format]}" for export_format in export_formats}
+
+
+def export_tune(title, meter, key, abc, default_length, export_formats, parse_cache=None):
+    """Convert one tune in a worker process, returns {format: bytes}"""
+    # Imported here so only the workers pay for music21, and export --help stays fast
+    from music21 import midi
+    from music21.musicxml import m21ToXml
+    from audio import AudioManager
+    files = dict()
+    if "abc" in export_formats:
+        files["abc"] = abc_text(title, meter, key, abc, default_length).encode('utf-8')
+    if "midi" in export_formats or "musicxml" in export_formats:
+        audio_manager = AudioManager(parse_cache)
+        audio_manager.create_audio_converter(1, title, meter, key, abc, default_length)
+        score = audio_manager.audio_stream
+        if "midi" in export_formats:
+            files["midi"] = midi.translate.streamToMidiFile(score).writestr()
+        if "musicxml" in export_formats:
+            files["musicxml"] = m21ToXml.GeneralObjectExporter(score).parse()
+    return files
+
+
+def archive_mode(archive_file):
+    """tarfile write mode of an archive file name, None for a zip, ValueError when it is neither"""
+    suffixes = pathlib.Path(archive_file).suffixes
+    if suffixes and suffixes[-1] == ".zip":
+        return None
+    if suffixes and (suffixes[-1] in (".tar", ".tgz") or (len(suffixes) > 1 and suffixes[-2] == ".tar")):
+        return tar_modes[suffixes[-1]]
+    raise ValueError(f"{archive_file} is neither a .zip nor a .tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz archive")
+
+
+class ArchiveWriter():
+    """Adds in memory members to a zip or tar archive, the kind is picked from the file suffix"""
+
+    def __init__(self, archive_file):
+        mode = archive_mode(archive_file)
+        if mode is None:
+            self.archive = zipfile.ZipFile(archive_file, 'w', compression=zipfile.ZIP_DEFLATED)
+        else:
+            self.archive = tarfile.open(archive_file, mode)
+
+    def add(self, name, data):
+        if isinstance(self.archive, zipfile.ZipFile):
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            self.archive.writestr(info, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self.archive.addfile(info, io.BytesIO(data))
+
+    def copy_from(self, previous_file, names):
+        """Copy the members named in names from a previous archive of the same kind one at a time, returns the names copied"""
+        names = set(names)
+        copied = set()
+        if isinstance(self.archive, zipfile.ZipFile):
+            with zipfile.ZipFile(previous_file) as previous:
+                for info in previous.infolist():
+                    if info.filename in names:
+                        with previous.open(info) as source, self.archive.open(info.filename, 'w') as target:
+                            for block in iter(lambda: source.read(1 << 20), b''):
+                                target.write(block)
+                        copied.add(info.filename)
+        else:
+            # Read in order, compressed tar files cannot seek back
+            with tarfile.open(previous_file, 'r:*') as previous:
+                for info in previous:
+                    if info.name in names:
+                        self.archive.addfile(info, previous.extractfile(info))
+                        copied.add(info.name)
+        return copied
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def manifest_file(output_file):
+    output_file = pathlib.Path(output_file)
+    return output_file.with_name(output_file.name + ".manifest.json")
+
+
+def read_manifest(output_file):
+    """{tune_key: {'hash': ..., 'members': [...]}} of the previous export to output_file, empty when there is none"""
+    filepath = manifest_file(output_file)
+    if not filepath.exists() or not pathlib.Path(output_file).exists():
+        return dict()
+    with open(filepath, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def export(tunes, output_file, export_formats=tuple(formats), workers=None, parse_cache=None, force=False):
+    """
+    Export tunes to output_file, a .zip or .tar(.gz/.bz2/.xz) archive.
+    tunes is an iterable of (tune_key, title, meter, key, abc, default_length).
+    Yields (tune_key, status, error) as each tune is written, status is 'unchanged', 'exported' or 'failed'
+    and one failed tune never stops the others.
+    The archive is built under a temporary name and only replaces output_file, together with its manifest,
+    once every tune is written. At most twice workers tunes are converted or waiting to be written at a time.
+    """
+    output_file = pathlib.Path(output_file)
+    archive_mode(output_file)
+    export_formats = [export_format for export_format in formats if export_format in export_formats]
+    workers = workers or os.cpu_count()
+    previous = dict() if force else read_manifest(output_file)
+    temporary_file = output_file.with_name(f"{output_file.stem}.{os.getpid()}.tmp{''.join(output_file.suffixes)}")
+    temporary_manifest = manifest_file(temporary_file)
+    manifest = dict()  # tune_key : {'hash': content_key, 'members': [name, ...]}
+
+    pending = list()
+    unchanged = dict()  # tune_key : tune
+    for tune in tunes:
+        tune_key, title, meter, key, abc, default_length = tune
+        content_key = export_key(title, meter, key, abc, default_length, export_formats)
+        if previous.get(str(tune_key), {}).get("hash") == content_key:
+            unchanged[str(tune_key)] = (content_key, tune)
+        else:
+            pending.append((content_key, tune))
+
+    try:
+        with ArchiveWriter(temporary_file) as writer:
+            names = [name for tune_key in unchanged for name in previous[tune_key]["members"]]
+            copied = writer.copy_from(output_file, names) if names else set()
+            for tune_key, (content_key, tune) in unchanged.items():
+                if all(name in copied for name in previous[tune_key]["members"]):
+                    manifest[tune_key] = previous[tune_key]
+                    yield tune[0], 'unchanged', None
+                else:
+                    # A member has gone missing from the previous archive, convert the tune again
+                    pending.append((content_key, tune))
+
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                queued = iter(pending)
+                in_flight = dict()  # future : (content_key, tune)
+                while True:
+                    for content_key, tune in queued:
+                        tune_key, title, meter, key, abc, default_length = tune
+                        future = executor.submit(export_tune, title, meter, key, abc, default_length, export_formats, parse_cache)
+                        in_flight[future] = (content_key, tune)
+                        if len(in_flight) >= 2 * workers:
+                            break
+                    if not in_flight:
+                        break
+                    done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        content_key, tune = in_flight.pop(future)
+                        try:
+                            files = future.result()
+                        except Exception as err:
+                            yield tune[0], 'failed', f"{type(err).__name__}: {err}"
+                            continue
+                        names = member_names(tune[0], tune[1], export_formats)
+                        for export_format, data in files.items():
+                            writer.add(names[export_format], data)
+                        manifest[str(tune[0])] = {"hash": content_key, "members": list(names.values())}
+                        yield tune[0], 'exported', None
+
+        with open(temporary_manifest, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(temporary_file, output_file)
+        os.replace(temporary_manifest, manifest_file(output_file))
+    finally:
+        for filepath in (temporary_file, temporary_manifest):
+            if filepath.exists():
+                filepath.unlink()
+
+
+def peak_rss_mb():
+    """(this process, largest worker) peak resident memory in MiB, None where the resource module is missing"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale)
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    code_root = repo_root.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--session_db",
+        type=pathlib.Path,
+        default=code_root / "TheSession-data" / "thesession.db",
+        help="Filepath of the TheSession-data sqlite file")
+    SessionDataManager.add_backend_arguments(parser, repo_root)
+    parser.add_argument(
+        "--output_file",
+        type=pathlib.Path,
+        default=repo_root / "export" / "tunes.zip",
+        help="Archive to write, .zip, .tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz")
+    parser.add_argument(
+        "--formats",
+        type=str,
+        nargs='+',
+        choices=list(formats),
+        default=list(formats),
+        help="Formats written for each tune")
+    parser.add_argument(
+        "--session_id",
+        type=str,
+        help="Export the tunes played at this session")
+    parser.add_argument(
+        "--set_id",
+        type=str,
+        help="Export the tunes of this set")
+    parser.add_argument(
+        "--start",
+        type=str,
+        help="Export the tunes played from this date, YYYY-MM-DD")
+    parser.add_argument(
+        "--end",
+        type=str,
+        help="Export the tunes played up to this date, YYYY-MM-DD")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of export processes, defaults to the number of CPUs")
+    parser.add_argument(
+        "--parse_cache_dir",
+        type=pathlib.Path,
+        default=repo_root / "parse_cache",
+        help="Directory of parsed music21 scores addressed by a hash of the normalised ABC")
+    parser.add_argument(
+        "--parse_cache_mb",
+        type=int,
+        default=512,
+        help="Size the parsed score cache is kept under")
+    parser.add_argument(
+        '--force',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Convert every tune again instead of copying unchanged ones from the previous archive")
+    instrumentation.add_arguments(parser)
+    return parser.parse_args()
+
+
+def selected_tune_ids(sdm, args):
+    """tune_ids picked by --set_id, --session_id or --start/--end in the order they were played, None for the whole repertoire"""
+    if args.set_id:
+        return [row[0] for row in sdm.read_set_tunes(args.set_id)]
+    if not (args.session_id or args.start or args.end):
+        return None
+    since = None
+    if args.start:
+        since = (datetime.date.fromisoformat(args.start) - datetime.timedelta(days=1)).isoformat()
+    tune_ids = dict()
+    for session_date, session_id, _, _, _, tune_id, *_ in sdm.read_tune_plays(since):
+        if args.end and session_date > args.end:
+            break
+        if args.session_id is None or str(session_id) == args.session_id:
+            tune_ids[tune_id] = True
+    return list(tune_ids)
+
+
+def main():
+    args = parse()
+    print(args)
+
+    with instrumentation.run(args):
+        with SessionDataManager.SessionDataManager(
+                args.session_db, initialize_db=False, backend=args.backend, db_file=args.db_file, schema_file=args.schema_file) as sdm:
+            rows = sdm.read_tunes(selected_tune_ids(sdm, args))
+        # (tune_key, title, meter, key, abc, default_length), TheSession's id is the stable key where there is one
+        tunes = [(the_session_tune_id or f"tune{tune_id}", name, tune_meter, tune_mode, abc, None)
+                 for tune_id, the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url in rows if abc]
+        print(f"{len(tunes)} tunes selected, {len(rows) - len(tunes)} without ABC left out")
+
+        args.output_file.parent.mkdir(parents=True, exist_ok=True)
+        from parse_cache import ParsedScoreCache
+        parse_cache = ParsedScoreCache(args.parse_cache_dir, args.parse_cache_mb * 1024 * 1024)
+        counts = {'unchanged': 0, 'exported': 0, 'failed': 0}
+        start = time.perf_counter()
+        for tune_key, status, error in export(tunes, args.output_file, args.formats, args.workers, parse_cache, args.force):
+            counts[status] += 1
+            if error:
+                print(f"{tune_key}: {status} {error}")
+        seconds = time.perf_counter() - start
+
+    print(", ".join(f"{count} {status}" for status, count in counts.items()) + f" to {args.output_file}")
+    print(f"{seconds:.2f}s, {sum(counts.values()) / seconds:.1f} tunes/s, "
+          f"{counts['exported'] / seconds:.1f} converted tunes/s")
+    peak = peak_rss_mb()
+    if peak is None:
+        print("peak RSS is not available on this platform")
+    else:
+        print(f"peak RSS {peak[0]:.0f}MiB in this process, {peak[1]:.0f}MiB in the largest worker")
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,89 @@
+#!python3
+r""" fetcher.py - pooled, rate limited HTTP fetching for the ceol.io crawl
+
+One requests.Session is shared by every worker so connections (and TLS handshakes)
+are reused, failed requests are retried with exponential backoff, and with a rate requests to
+the same host are spaced out so a parallel crawl stays polite.
+
+Dependencies
+    py -m pip install requests
+
+"""
+import collections
+import concurrent.futures
+import threading
+import time
+import urllib.parse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class RateLimiter:
+    """Allow at most rate requests per second to each host."""
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.lock = threading.Lock()
+        self.next_allowed = dict()  # host : monotonic time of the next allowed request
+
+    def wait(self, url):
+        if not self.interval:
+            return
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_allowed.get(host, now))
+            self.next_allowed[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Fetcher:
+    def __init__(self, workers=1, rate=0, retries=3, backoff=0.5, timeout=30):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.rate_limiter = RateLimiter(rate)
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            # Hand back the last response once the retries run out, fetch_page reports it and the crawl goes on
+            raise_on_status=False,
+            allowed_methods=frozenset({"GET", "HEAD"}))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.workers, max_retries=retry)
+        self.http = requests.Session()
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.http.close()
+
+    def get(self, url, **kwargs):
+        self.rate_limiter.wait(url)
+        kwargs.setdefault("timeout", self.timeout)
+        return self.http.get(url, **kwargs)
+
+    def map_ordered(self, function, items):
+        """
+        Like map(function, items) but runs up to workers calls at once.
+        Results are yielded in the order of items and at most 2 * workers calls are in flight,
+        so a long crawl never holds more than a small window of pages in memory.
+        """
+        if self.workers == 1:
+            yield from map(function, items)
+            return
+        window = 2 * self.workers
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as executor:
+            in_flight = collections.deque()
+            for item in items:
+                in_flight.append(executor.submit(function, item))
+                if len(in_flight) >= window:
+                    yield in_flight.popleft().result()
+            while in_flight:
+                yield in_flight.popleft().result()
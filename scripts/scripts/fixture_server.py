@@ -0,0 +1,122 @@
+#!python3
+r""" fixture_server.py - serve saved ceol.io pages for local crawl testing
+
+Save the pages with the same path layout as the site, for example
+    fixtures/sessions/austin/mueller/index.html
+    fixtures/sessions/austin/mueller/2024-01-04.html
+then run
+    py fixture_server.py --directory fixtures
+    py scrape.py --url http://localhost:8000/sessions/austin/mueller/ --workers 8
+
+--fail answers the given paths with 503 on every request and --delay_ms holds every response back,
+to try out retries and parallel fetching. The tests run a FixtureServer in a thread the same way.
+
+"""
+import argparse
+import http.server
+import pathlib
+import sys
+import threading
+import time
+
+
+class FixtureRequestHandler(http.server.SimpleHTTPRequestHandler):
+    def __init__(self, request, client_address, server):
+        super().__init__(request, client_address, server, directory=server.directory)
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append((self.path, time.monotonic()))
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        status = self.server.failing.get(self.path)
+        if status:
+            self.send_error(status)
+            return
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class FixtureServer(http.server.ThreadingHTTPServer):
+    """
+    Serves directory on localhost, port 0 picks a free port.
+    failing is a dict of path : status code answered instead of the page, delay is seconds before every response,
+    requests records (path, monotonic time) of every request received.
+    """
+    daemon_threads = True
+
+    def __init__(self, directory, port=0, failing=None, delay=0.0, quiet=False):
+        self.directory = str(directory)
+        self.failing = dict(failing or {})
+        self.delay = delay
+        self.quiet = quiet
+        self.requests = list()
+        self.lock = threading.Lock()
+        self.thread = None
+        super().__init__(("localhost", port), FixtureRequestHandler)
+
+    @property
+    def url(self):
+        return f"http://localhost:{self.server_address[1]}/"
+
+    def start(self):
+        """Serve from a background thread until close"""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        if self.thread is not None:
+            self.shutdown()
+            self.thread.join()
+        self.server_close()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--directory",
+        type=pathlib.Path,
+        default=pathlib.Path.cwd(),
+        help="Directory of saved pages to serve")
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Port to listen on")
+    parser.add_argument(
+        "--fail",
+        type=str,
+        nargs='*',
+        default=[],
+        help="Paths answered with 503 on every request, e.g. /sessions/austin/mueller/2024-01-04.html")
+    parser.add_argument(
+        "--delay_ms",
+        type=float,
+        default=0.0,
+        help="Delay before every response")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+    with FixtureServer(args.directory, args.port, {path: 503 for path in args.fail}, args.delay_ms / 1000) as server:
+        print(f"Serving {args.directory} on {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,246 @@
+#!python3
+r""" instrumentation.py - where the time of a run goes, stage by stage
+
+Functions and methods are marked with @timed("stage") or a `with timer("stage"):` block,
+events with count("name"). Nothing is recorded until enable() is called, a disabled @timed
+costs one flag check per call. Scripts add the options with add_arguments and wrap their work in run(args):
+
+    --timings                   print a table of every stage at the end of the run
+    --timings_json FILE         write the stages and counters as JSON
+    --timings_prometheus FILE   write them in the Prometheus text format
+    --profile FILE              run under cProfile and write the stats, FILE.txt has the top functions
+
+Only the calling process is recorded, the work of batch_render's worker processes is not.
+Each stage keeps a count, total, min, max and a histogram over fixed bucket bounds,
+the percentiles in the table are read off the histogram.
+
+"""
+import argparse
+import bisect
+import contextlib
+import cProfile
+import collections
+import functools
+import inspect
+import io
+import json
+import pathlib
+import pstats
+import threading
+import time
+
+
+enabled = False
+# Upper bounds in seconds of the histogram buckets, the last bucket is everything slower
+bucket_bounds = (
+    0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005,
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Stage:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+        self.buckets = [0] * (len(bucket_bounds) + 1)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(bucket_bounds, seconds)] += 1
+
+    def percentile(self, fraction):
+        """Estimated by interpolating inside the bucket holding the fraction'th call, within the min and max seen"""
+        rank = fraction * self.count
+        seen = 0
+        lower = self.min
+        for bound, bucket in zip(bucket_bounds + (self.max,), self.buckets):
+            upper = min(bound, self.max)
+            if bucket and seen + bucket >= rank:
+                return lower + (upper - lower) * max(rank - seen, 0) / bucket
+            seen += bucket
+            lower = max(upper, self.min)
+        return self.max
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "min_seconds": self.min if self.count else 0.0,
+            "max_seconds": self.max,
+            "buckets": dict(zip([str(bound) for bound in bucket_bounds] + ["+Inf"], self.buckets))}
+
+
+stages = collections.defaultdict(Stage)  # stage name : Stage
+counters = collections.Counter()  # counter name : count
+lock = threading.Lock()  # the crawl records from fetcher threads
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    with lock:
+        stages.clear()
+        counters.clear()
+
+
+def record(stage, seconds):
+    with lock:
+        stages[stage].add(seconds)
+
+
+def count(name, amount=1):
+    if enabled:
+        with lock:
+            counters[name] += amount
+
+
+@contextlib.contextmanager
+def timer(stage):
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start)
+
+
+def timed(stage):
+    """
+    Decorator recording each call of the function under stage, the call is made as is while disabled.
+    For a generator function the time spent producing all of its items is recorded once it is exhausted or closed.
+    Stages nest, a stage's time includes any stage it calls.
+    """
+    def decorator(function):
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                if not enabled:
+                    return function(*args, **kwargs)
+                return timed_items(stage, function(*args, **kwargs))
+            return generator_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def timed_items(stage, items):
+    """Yields from the iterator items, recording the time spent inside it under stage once it ends"""
+    iterator = iter(items)
+    seconds = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                seconds += time.perf_counter() - start
+            yield item
+    finally:
+        record(stage, seconds)
+
+
+def summary():
+    """The stages as a text table, most total time first, then the counters"""
+    lines = [f"{'stage':<40} {'count':>8} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+    with lock:
+        for name, stage in sorted(stages.items(), key=lambda item: -item[1].total):
+            lines.append(
+                f"{name:<40} {stage.count:>8} {stage.total:>9.3f} {stage.total / stage.count * 1000:>9.3f} "
+                f"{stage.percentile(0.5) * 1000:>9.3f} {stage.percentile(0.95) * 1000:>9.3f} {stage.max * 1000:>9.3f}")
+        for name, value in sorted(counters.items()):
+            lines.append(f"{name:<40} {value:>8}")
+    return "\n".join(lines)
+
+
+def as_json():
+    with lock:
+        return {
+            "stages": {name: stage.as_dict() for name, stage in stages.items()},
+            "counters": dict(counters)}
+
+
+def as_prometheus(prefix="session_tunes"):
+    """The stages as one histogram family labelled by stage, counters as one counter family"""
+    lines = [
+        f"# HELP {prefix}_stage_seconds Time spent per call of each pipeline stage",
+        f"# TYPE {prefix}_stage_seconds histogram"]
+    with lock:
+        for name, stage in sorted(stages.items()):
+            cumulative = 0
+            for bound, bucket in zip([str(bound) for bound in bucket_bounds] + ["+Inf"], stage.buckets):
+                cumulative += bucket
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage.total}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage.count}')
+        lines.append(f"# HELP {prefix}_events_total Pipeline event counters")
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        for name, value in sorted(counters.items()):
+            lines.append(f'{prefix}_events_total{{name="{name}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        '--timings',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Print how long each stage of the run took")
+    parser.add_argument(
+        "--timings_json",
+        type=pathlib.Path,
+        help="Write the stage timings and counters to this JSON file")
+    parser.add_argument(
+        "--timings_prometheus",
+        type=pathlib.Path,
+        help="Write the stage timings and counters to this file in the Prometheus text format")
+    parser.add_argument(
+        "--profile",
+        type=pathlib.Path,
+        help="Run under cProfile and write the stats to this file")
+
+
+@contextlib.contextmanager
+def run(args):
+    """Record the stages of the body when any of the add_arguments outputs was asked for and report them after"""
+    reporting = args.timings or args.timings_json or args.timings_prometheus
+    enable(bool(reporting))
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(str(args.profile))
+            text = io.StringIO()
+            pstats.Stats(profiler, stream=text).sort_stats("cumulative").print_stats(40)
+            pathlib.Path(f"{args.profile}.txt").write_text(text.getvalue(), encoding='utf-8')
+            print(f"Profile written to {args.profile} and {args.profile}.txt")
+        if args.timings:
+            print(summary())
+        if args.timings_json:
+            args.timings_json.write_text(json.dumps(as_json(), indent=2), encoding='utf-8')
+        if args.timings_prometheus:
+            args.timings_prometheus.write_text(as_prometheus(), encoding='utf-8')
+        enable(False)
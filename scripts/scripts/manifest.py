@@ -0,0 +1,66 @@
+#!python3
+r""" manifest.py - remember which crawled pages have not changed
+
+Keeps the ETag, Last-Modified and a content hash of every page the crawl has processed
+in a small JSON file, sends them back as conditional request headers and reports a page
+as unchanged on a 304 or when the body hashes the same as last time.
+A page fetched is only remembered once commit is called for it, after whatever was parsed from it is stored,
+so a page that failed to ingest is fetched and processed again next time.
+
+"""
+import hashlib
+import json
+import os
+import pathlib
+
+
+class PageManifest:
+    def __init__(self, manifest_file):
+        self.manifest_file = pathlib.Path(manifest_file)
+        self.pages = dict()  # url : {"etag", "last_modified", "sha256"}
+        self.fetched = dict()  # url : entry of the pages fetched this run and not yet committed
+        if self.manifest_file.exists():
+            with self.manifest_file.open('r', encoding='utf-8') as f:
+                self.pages = json.load(f)
+
+    def fetch(self, url, http):
+        """
+        Returns the content of url, or None if it could not be retrieved or is unchanged since the last crawl.
+        """
+        entry = self.pages.get(url, dict())
+        headers = dict()
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        response = http.get(url, headers=headers)
+        if response.status_code == 304:
+            print(f"Unchanged since last crawl: {url}")
+            return None
+        if response.status_code != 200:
+            print(f"Failed to retrieve content from {url}. Status code: {response.status_code}")
+            return None
+
+        sha256 = hashlib.sha256(response.content).hexdigest()
+        self.fetched[url] = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha256": sha256}
+        if entry.get("sha256") == sha256:
+            print(f"Unchanged since last crawl: {url}")
+            return None
+        return response.content
+
+    def commit(self, urls):
+        """Remember the pages of urls fetched this run, once what was parsed from them is stored"""
+        for url in urls:
+            if url in self.fetched:
+                self.pages[url] = self.fetched.pop(url)
+
+    def save(self):
+        # Write then rename so an interrupted run never leaves a truncated manifest
+        temporary_file = self.manifest_file.with_suffix(self.manifest_file.suffix + ".tmp")
+        with temporary_file.open('w', encoding='utf-8') as f:
+            json.dump(self.pages, f, indent=1, sort_keys=True)
+        os.replace(temporary_file, self.manifest_file)
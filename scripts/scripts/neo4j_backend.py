@@ -0,0 +1,497 @@
+#!python3
+r""" neo4j_backend.py - session data in the hosted neo4j graph
+
+The graph and its credentials are taken from the NEO4J_URI, NEO4J_USERNAME (default neo4j)
+and NEO4J_PASSWORD environment variables.
+
+"""
+import collections
+import os
+import neo4j
+import instrumentation
+from neo4j.exceptions import ResultConsumedError
+from session_backend import SessionBackend
+
+
+class Neo4jBackend(SessionBackend):
+    def __init__(self, driver=None, initialize_db=True):
+        if driver is None:
+            uri = os.environ.get("NEO4J_URI")
+            password = os.environ.get("NEO4J_PASSWORD")
+            if not uri or not password:
+                raise RuntimeError(
+                    "--backend neo4j needs the graph in NEO4J_URI and its password in NEO4J_PASSWORD "
+                    "(NEO4J_USERNAME defaults to neo4j), or use --backend sqlite")
+            driver = neo4j.GraphDatabase.driver(uri, auth=(os.environ.get("NEO4J_USERNAME", "neo4j"), password))
+            driver.verify_connectivity()
+        self.driver = driver
+        if initialize_db:
+            self.initialize_database()
+
+    def close(self):
+        self.driver.close()
+
+    def initialize_database(self):
+        initialization_commands = [
+            # Create constraints
+            "CREATE CONSTRAINT IF NOT EXISTS FOR (l:Location) REQUIRE l.location_id IS UNIQUE;",
+            "CREATE CONSTRAINT IF NOT EXISTS FOR (s:Session) REQUIRE s.session_id IS UNIQUE;",
+            "CREATE CONSTRAINT IF NOT EXISTS FOR (st:SetTable) REQUIRE st.set_id IS UNIQUE;",
+            "CREATE CONSTRAINT IF NOT EXISTS FOR (st:SetTable) REQUIRE st.fingerprint IS UNIQUE;",
+            "CREATE CONSTRAINT IF NOT EXISTS FOR (t:Tune) REQUIRE t.tune_id IS UNIQUE;",
+            # Create indexes
+            "CREATE RANGE INDEX IF NOT EXISTS FOR (s:Session) ON (s.session_date);",
+            "CREATE RANGE INDEX IF NOT EXISTS FOR (t:Tune) ON (t.the_session_tune_id);",
+            # Play count aggregates, see increment_play_counts
+            "CREATE CONSTRAINT IF NOT EXISTS FOR (c:TunePlayCount) REQUIRE (c.tune_id, c.bucket, c.period) IS UNIQUE;",
+            "CREATE CONSTRAINT IF NOT EXISTS FOR (c:SetPlayCount) REQUIRE (c.set_id, c.bucket, c.period) IS UNIQUE;",
+            "CREATE RANGE INDEX IF NOT EXISTS FOR (c:TunePlayCount) ON (c.bucket, c.period);",
+            "CREATE RANGE INDEX IF NOT EXISTS FOR (c:SetPlayCount) ON (c.bucket, c.period);",
+            # Define node properties (similar to table columns)
+            "CREATE (:Location {location_id: 0, description: '', address: '', url: ''});",
+            "CREATE (:Session {session_id: 0, session_date: date(), start_time: time(), end_time: time(), description: ''});",
+            "CREATE (:SetTable {set_id: 0, description: ''});",
+            "CREATE (:Tune {tune_id: 0, the_session_tune_id: 0, name: '', abc: '', tune_type: '', tune_meter: '', tune_mode: '', tune_url: ''});",
+        ]
+        with self.driver.session() as session:
+            for command in initialization_commands:
+                session.run(command)
+            session.write_transaction(self._create_initial_location)
+
+    @staticmethod
+    def _create_initial_location(tx):
+        query = (
+            "MERGE (l:Location {location_id: 1}) "
+            "SET l.description = $description, "
+            "    l.address = $address, "
+            "    l.url = $url"
+        )
+        tx.run(
+            query,
+            description="B.D.Riley Thursday Session at Mueller in Austin, Texas.",
+            address="1905 Aldrich St #130, Austin, TX 78723",
+            url="https://bdrileys.com/")
+
+    def create_session(self, location_id, session_date, start_time, end_time, description):
+        query = (
+            "CREATE (s:Session {session_id: randomUUID(), "
+            "location_id: $location_id, "
+            "session_date: date($session_date), "
+            "start_time: time($start_time), "
+            "end_time: time($end_time), "
+            "description: $description}) "
+            "RETURN s.session_id as session_id"
+        )
+        with self.driver.session() as session:
+            result = session.run(
+                query,
+                location_id=location_id,
+                session_date=session_date,
+                start_time=start_time,
+                end_time=end_time,
+                description=description)
+            return result.single()["session_id"]
+
+    def update_session_end(self, session_id, end_time, description):
+        query = (
+            "MATCH (s:Session {session_id: $session_id}) "
+            "SET s.end_time = time($end_time), s.description = $description"
+        )
+        with self.driver.session() as session:
+            session.run(query, session_id=session_id, end_time=end_time, description=description)
+
+    def read_session_dates(self):
+        # session_id 0 is the placeholder node initialize_database creates
+        query = (
+            "MATCH (s:Session) "
+            "WHERE s.session_date IS NOT NULL AND s.session_id <> 0 "
+            "RETURN DISTINCT toString(s.session_date) as session_date"
+        )
+        with self.driver.session() as session:
+            result = session.run(query)
+            return {record["session_date"] for record in result}
+
+    def read_session_ids(self):
+        query = (
+            "MATCH (s:Session) "
+            "WHERE s.session_id <> 0 "
+            "RETURN s.session_id as session_id"
+        )
+        with self.driver.session() as session:
+            return {record["session_id"] for record in session.run(query)}
+
+    def read_tune_plays(self, since=None, session_ids=None):
+        query = (
+            "MATCH (s:Session)-[i:INCLUDES]->(st:SetTable)-[c:CONTAINS]->(t:Tune) "
+            "WHERE ($since IS NULL OR s.session_date > date($since)) "
+            "AND ($session_ids IS NULL OR s.session_id IN $session_ids) "
+            "RETURN toString(s.session_date) as session_date, s.session_id as session_id, "
+            "st.set_id as set_id, i.set_index as set_index, c.tune_index as tune_index, "
+            "t.tune_id as tune_id, t.the_session_tune_id as the_session_tune_id, t.name as name, "
+            "t.tune_type as tune_type, t.tune_meter as tune_meter, t.tune_mode as tune_mode "
+            "ORDER BY s.session_date, i.set_index, c.tune_index"
+        )
+        with self.driver.session() as session:
+            session_ids = None if session_ids is None else list(session_ids)
+            for record in session.run(query, since=since, session_ids=session_ids):
+                yield tuple(record.values())
+
+    def create_location(self, description, address, url):
+        query = (
+            "CREATE (l:Location {location_id: randomUUID(), "
+            "description: $description, "
+            "address: $address, "
+            "url: $url}) "
+            "RETURN l.location_id as location_id"
+        )
+        with self.driver.session() as session:
+            result = session.run(
+                query,
+                description=description,
+                address=address,
+                url=url)
+            return result.single()["location_id"]
+
+    def read_or_create_set(self, description, fingerprint):
+        query = (
+            "MERGE (s:SetTable {fingerprint: $fingerprint}) "
+            "ON CREATE SET s.set_id = randomUUID(), s.description = $description "
+            "RETURN s.set_id as set_id"
+        )
+        with self.driver.session() as session:
+            result = session.run(
+                query,
+                description=description,
+                fingerprint=fingerprint)
+            return result.single()["set_id"]
+
+    def read_set_tunes(self, set_id):
+        query = (
+            "MATCH (st:SetTable {set_id: $set_id})-[r:CONTAINS]->(t:Tune) "
+            "RETURN t.tune_id as tune_id, t.name as name, t.abc as abc, "
+            "t.tune_type as tune_type, t.tune_meter as tune_meter, t.tune_mode as tune_mode "
+            "ORDER BY r.tune_index"
+        )
+        with self.driver.session() as session:
+            result = session.run(query, set_id=set_id)
+            return [
+                (record["tune_id"], record["name"], record["abc"],
+                 record["tune_type"], record["tune_meter"], record["tune_mode"])
+                for record in result]
+
+    def create_tune(self, the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url):
+        query = (
+            "CREATE (t:Tune {tune_id: randomUUID(), "
+            "the_session_tune_id: $the_session_tune_id, "
+            "name: $name, "
+            "abc: $abc, "
+            "tune_type: $tune_type, "
+            "tune_meter: $tune_meter, "
+            "tune_mode: $tune_mode, "
+            "tune_url: $tune_url}) "
+            "RETURN t.tune_id as tune_id"
+        )
+        with self.driver.session() as session:
+            result = session.run(
+                query,
+                the_session_tune_id=the_session_tune_id,
+                name=name,
+                abc=abc,
+                tune_type=tune_type,
+                tune_meter=tune_meter,
+                tune_mode=tune_mode,
+                tune_url=tune_url)
+            return result.single()["tune_id"]
+
+    def get_id_or_create_tune(self, the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url):
+        query = (
+            "MERGE (t:Tune {the_session_tune_id: $the_session_tune_id}) "
+            "ON CREATE SET t.tune_id = randomUUID(), "
+            "t.name = $name, "
+            "t.abc = $abc, "
+            "t.tune_type = $tune_type, "
+            "t.tune_meter = $tune_meter, "
+            "t.tune_mode = $tune_mode, "
+            "t.tune_url = $tune_url "
+            "RETURN t.tune_id as tune_id"
+        )
+        with self.driver.session() as session:
+            result = session.run(
+                query,
+                the_session_tune_id=the_session_tune_id,
+                name=name,
+                abc=abc,
+                tune_type=tune_type,
+                tune_meter=tune_meter,
+                tune_mode=tune_mode,
+                tune_url=tune_url)
+            return result.single()["tune_id"]
+
+
+    def create_set_to_session(self, session_id, set_id, set_index):
+        query = (
+            "MATCH (s:Session {session_id: $session_id}), (st:SetTable {set_id: $set_id}) "
+            "MERGE (s)-[r:INCLUDES {set_index: $set_index}]->(st) "
+            "RETURN r.set_index as relationship_id"
+        )
+        with self.driver.session() as session:
+            result = session.run(
+                query,
+                session_id=session_id,
+                set_id=set_id,
+                set_index=set_index)
+            try:
+                return result.single()["relationship_id"]
+            except ResultConsumedError:
+                # If the relationship already existed, return the set_index
+                return set_index
+
+    def create_tune_to_set(self, tune_id, set_id, tune_index):
+        query = (
+            "MATCH (t:Tune {tune_id: $tune_id}), (st:SetTable {set_id: $set_id}) "
+            "MERGE (st)-[r:CONTAINS {tune_index: $tune_index}]->(t) "
+            "RETURN r.tune_index as relationship_id"
+        )
+        with self.driver.session() as session:
+            result = session.run(
+                query,
+                tune_id=tune_id,
+                set_id=set_id,
+                tune_index=tune_index)
+            try:
+                return result.single()["relationship_id"]
+            except ResultConsumedError:
+                # If the relationship already existed, return the tune_index
+                return tune_index
+
+    def read_tune(self, tune_id):
+        query = (
+            "MATCH (t:Tune {tune_id: $tune_id}) "
+            "RETURN t.tune_id as tune_id, t.the_session_tune_id as the_session_tune_id, t.name as name, "
+            "t.abc as abc, t.tune_type as tune_type, t.tune_meter as tune_meter, t.tune_mode as tune_mode, "
+            "t.tune_url as tune_url"
+        )
+        with self.driver.session() as session:
+            record = session.run(query, tune_id=tune_id).single()
+            return tuple(record.values()) if record else None
+
+    def read_tunes(self, tune_ids=None):
+        # tune_id 0 is the placeholder node initialize_database creates
+        query = (
+            "MATCH (t:Tune) WHERE ($tune_ids IS NULL AND t.tune_id <> 0) OR t.tune_id IN $tune_ids "
+            "RETURN t.tune_id as tune_id, t.the_session_tune_id as the_session_tune_id, t.name as name, "
+            "t.abc as abc, t.tune_type as tune_type, t.tune_meter as tune_meter, t.tune_mode as tune_mode, "
+            "t.tune_url as tune_url"
+        )
+        with self.driver.session() as session:
+            result = session.run(query, tune_ids=None if tune_ids is None else list(dict.fromkeys(tune_ids)))
+            return [tuple(record.values()) for record in result]
+
+    _merge_tunes_query = (
+        "UNWIND $rows AS row "
+        "MERGE (t:Tune {the_session_tune_id: row.the_session_tune_id}) "
+        "ON CREATE SET t.tune_id = randomUUID(), "
+        "t.name = row.name, "
+        "t.abc = row.abc, "
+        "t.tune_type = row.tune_type, "
+        "t.tune_meter = row.tune_meter, "
+        "t.tune_mode = row.tune_mode, "
+        "t.tune_url = row.tune_url "
+        "RETURN row.key as key, t.tune_id as id"
+    )
+    _merge_sets_query = (
+        "UNWIND $rows AS row "
+        "MERGE (s:SetTable {fingerprint: row.fingerprint}) "
+        "ON CREATE SET s.set_id = randomUUID(), s.description = row.description "
+        "RETURN row.key as key, s.set_id as id"
+    )
+    _create_sessions_query = (
+        "UNWIND $rows AS row "
+        "CREATE (s:Session {session_id: randomUUID(), "
+        "location_id: row.location_id, "
+        "session_date: date(row.session_date), "
+        "start_time: time(row.start_time), "
+        "end_time: time(row.end_time), "
+        "description: row.description}) "
+        "RETURN row.key as key, s.session_id as id"
+    )
+    _merge_sets_to_sessions_query = (
+        "UNWIND $rows AS row "
+        "MATCH (s:Session {session_id: row.session_id}), (st:SetTable {set_id: row.set_id}) "
+        "MERGE (s)-[r:INCLUDES {set_index: row.set_index}]->(st)"
+    )
+    _merge_tunes_to_sets_query = (
+        "UNWIND $rows AS row "
+        "MATCH (t:Tune {tune_id: row.tune_id}), (st:SetTable {set_id: row.set_id}) "
+        "MERGE (st)-[r:CONTAINS {tune_index: row.tune_index}]->(t)"
+    )
+
+    def _write_nodes(self, tune_rows, set_rows, session_rows, batch_size):
+        with self.driver.session() as session:
+            tune_ids = self._run_batches(session, self._merge_tunes_query, tune_rows, batch_size)
+            set_ids = self._run_batches(session, self._merge_sets_query, set_rows, batch_size)
+            session_ids = self._run_batches(session, self._create_sessions_query, session_rows, batch_size)
+        return tune_ids, set_ids, session_ids
+
+    def _write_links(self, set_to_session_rows, tune_to_set_rows, batch_size):
+        with self.driver.session() as session:
+            self._run_batches(session, self._merge_sets_to_sessions_query, set_to_session_rows, batch_size)
+            self._run_batches(session, self._merge_tunes_to_sets_query, tune_to_set_rows, batch_size)
+
+    _increment_tune_play_counts_query = (
+        "UNWIND $rows AS row "
+        "MERGE (c:TunePlayCount {tune_id: row.id, bucket: row.bucket, period: row.period}) "
+        "ON CREATE SET c.count = 0 "
+        "SET c.count = c.count + row.count"
+    )
+    _increment_set_play_counts_query = (
+        "UNWIND $rows AS row "
+        "MERGE (c:SetPlayCount {set_id: row.id, bucket: row.bucket, period: row.period}) "
+        "ON CREATE SET c.count = 0 "
+        "SET c.count = c.count + row.count"
+    )
+
+    def _add_play_counts(self, tune_rows, set_rows, batch_size):
+        with self.driver.session() as session:
+            self._run_batches(session, self._increment_tune_play_counts_query, tune_rows, batch_size)
+            self._run_batches(session, self._increment_set_play_counts_query, set_rows, batch_size)
+
+    def _replace_play_counts(self, tune_rows, set_rows, batch_size):
+        with self.driver.session() as session:
+            session.run("MATCH (c:TunePlayCount) DETACH DELETE c").consume()
+            session.run("MATCH (c:SetPlayCount) DETACH DELETE c").consume()
+        self._add_play_counts(tune_rows, set_rows, batch_size)
+
+    def read_tune_play_counts(self, start_date, end_date, limit=None):
+        query = (
+            "UNWIND $buckets AS b "
+            "MATCH (c:TunePlayCount {bucket: b[0], period: b[1]}) "
+            "WITH c.tune_id as tune_id, sum(c.count) as tune_count "
+            "MATCH (t:Tune {tune_id: tune_id}) "
+            "RETURN tune_id, t.name as name, t.tune_url as tune_url, tune_count "
+            "ORDER BY tune_count DESC"
+        )
+        if limit:
+            query += " LIMIT $limit"
+        with self.driver.session() as session:
+            result = session.run(query, buckets=self.range_buckets(start_date, end_date), limit=limit)
+            return [(record["tune_id"], record["name"], record["tune_url"], record["tune_count"]) for record in result]
+
+    def read_set_play_counts(self, start_date, end_date):
+        query = (
+            "UNWIND $buckets AS b "
+            "MATCH (c:SetPlayCount {bucket: b[0], period: b[1]}) "
+            "WITH c.set_id as set_id, sum(c.count) as set_count "
+            "MATCH (st:SetTable {set_id: set_id}) "
+            "RETURN set_id, st.description as description, set_count "
+            "ORDER BY set_count DESC"
+        )
+        with self.driver.session() as session:
+            result = session.run(query, buckets=self.range_buckets(start_date, end_date))
+            return [(record["set_id"], record["description"], record["set_count"]) for record in result]
+
+    def read_set_lists(self, set_ids=None):
+        # set_id 0 is the placeholder node initialize_database creates
+        query = (
+            "MATCH (st:SetTable) WHERE ($set_ids IS NULL AND st.set_id <> 0) OR st.set_id IN $set_ids "
+            "OPTIONAL MATCH (st)-[c:CONTAINS]->(t:Tune) "
+            "WITH st, c, t ORDER BY c.tune_index "
+            "RETURN st.set_id as set_id, st.description as description, "
+            "collect([t.tune_id, t.name, t.tune_url, t.tune_mode, t.abc]) as tunes"
+        )
+        with self.driver.session() as session:
+            result = session.run(query, set_ids=None if set_ids is None else list(dict.fromkeys(set_ids)))
+            return {
+                record["set_id"]: (record["description"], [tuple(tune) for tune in record["tunes"] if tune[0] is not None])
+                for record in result}
+
+    def read_tune_sets(self, tune_ids=None):
+        query = (
+            "MATCH (st:SetTable)-[:CONTAINS]->(t:Tune) "
+            "WHERE ($tune_ids IS NULL AND t.tune_id <> 0) OR t.tune_id IN $tune_ids "
+            "WITH DISTINCT t, st ORDER BY st.set_id "
+            "RETURN t.tune_id as tune_id, collect([st.set_id, st.description]) as sets"
+        )
+        with self.driver.session() as session:
+            result = session.run(query, tune_ids=None if tune_ids is None else list(dict.fromkeys(tune_ids)))
+            return {record["tune_id"]: [tuple(row) for row in record["sets"]] for record in result}
+
+    def count_sets_without_fingerprint(self):
+        # set_id 0 is the placeholder node initialize_database creates
+        query = "MATCH (st:SetTable) WHERE st.fingerprint IS NULL AND st.set_id <> 0 RETURN count(st) as count"
+        with self.driver.session() as session:
+            return session.run(query).single()["count"]
+
+    def _read_set_tune_ids(self):
+        query = (
+            "MATCH (st:SetTable) WHERE st.set_id <> 0 "
+            "OPTIONAL MATCH (st)-[c:CONTAINS]->(t:Tune) "
+            "WITH st, c, t ORDER BY c.tune_index, t.the_session_tune_id "
+            "RETURN st.set_id as set_id, st.fingerprint as fingerprint, collect(t.the_session_tune_id) as tune_ids"
+        )
+        with self.driver.session() as session:
+            return {
+                record["set_id"]: (record["fingerprint"], list(record["tune_ids"]))
+                for record in session.run(query)}
+
+    _merge_duplicate_sets_query = (
+        "UNWIND $rows AS row "
+        "MATCH (old:SetTable {set_id: row.set_id}), (keep:SetTable {set_id: row.keep}) "
+        "OPTIONAL MATCH (s:Session)-[i:INCLUDES]->(old) "
+        "FOREACH (_ IN CASE WHEN s IS NULL THEN [] ELSE [1] END | "
+        "    MERGE (s)-[:INCLUDES {set_index: i.set_index}]->(keep)) "
+        "WITH DISTINCT old "
+        "DETACH DELETE old"
+    )
+    _write_set_fingerprints_query = (
+        "UNWIND $rows AS row "
+        "MATCH (st:SetTable {set_id: row.set_id}) "
+        "SET st.fingerprint = row.fingerprint"
+    )
+
+    def _merge_sets(self, merge_rows, batch_size):
+        with self.driver.session() as session:
+            self._run_batches(session, self._merge_duplicate_sets_query, merge_rows, batch_size)
+
+    def _write_set_fingerprints(self, fingerprint_rows, batch_size):
+        with self.driver.session() as session:
+            self._run_batches(session, self._write_set_fingerprints_query, fingerprint_rows, batch_size)
+
+    _live_play_queries = {
+        "TunePlayCount": (
+            "MATCH (s:Session)-[:INCLUDES]->(st:SetTable)-[:CONTAINS]->(t:Tune) "
+            "RETURN t.tune_id as id, toString(s.session_date) as session_date, count(*) as count"),
+        "SetPlayCount": (
+            "MATCH (s:Session)-[:INCLUDES]->(st:SetTable) "
+            "RETURN st.set_id as id, toString(s.session_date) as session_date, count(*) as count"),
+    }
+
+    def _read_live_play_counts(self, label):
+        with self.driver.session() as session:
+            return collections.Counter({
+                (record["id"], record["session_date"]): record["count"]
+                for record in session.run(self._live_play_queries[label])})
+
+    def _read_stored_play_counts(self, label):
+        id_property = "tune_id" if label == "TunePlayCount" else "set_id"
+        with self.driver.session() as session:
+            return {
+                (record["id"], record["bucket"], record["period"]): record["count"]
+                for record in session.run(
+                    f"MATCH (c:{label}) RETURN c.{id_property} as id, c.bucket as bucket, c.period as period, c.count as count")}
+
+    @staticmethod
+    def _run_batches(session, query, rows, batch_size):
+        """
+        Run an UNWIND query over rows in transactions of at most batch_size rows.
+        Returns a dict of key : id for queries that return them.
+        """
+        ids = dict()
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            with instrumentation.timer("neo4j.write_transaction"):
+                records = session.execute_write(lambda tx: list(tx.run(query, rows=batch)))
+            instrumentation.count("neo4j.rows_written", len(batch))
+            for record in records:
+                ids[record["key"]] = record["id"]
+        return ids
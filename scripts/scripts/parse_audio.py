@@ -1,7 +1,9 @@
 import SessionDataManager
 import pathlib
 import argparse
-from audio import AudioManager
+import instrumentation
+# audio and parse_cache load music21, which takes seconds, so they are imported where a tune is rendered
+# and --help stays fast
 import sys
 
 def parse():
@@ -16,16 +18,7 @@ def parse():
         type=str,
         default="https://ceol.io/sessions/austin/mueller/",
         help="URL of the HTML page to parse")
-    parser.add_argument(
-        "--db_file",
-        type=pathlib.Path,
-        default=repo_root / "mueller.db",
-        help="The file of the database to write to")
-    parser.add_argument(
-        "--schema_file",
-        type=pathlib.Path,
-        default=repo_root / "init.sql",
-        help="Filepath for a file containing the SQL commands that initialize the database")
+    SessionDataManager.add_backend_arguments(parser, repo_root)
     parser.add_argument(
         "--session_db",
         type=pathlib.Path,
@@ -36,18 +29,123 @@ def parse():
         type=pathlib.Path,
         default=repo_root / "soundfonts" / "Tabla.sf2",
         help="The SoundFont File to create audio from ABC notation")
+    parser.add_argument(
+        "--tune_id",
+        type=str,
+        default="113",
+        help="Session data tune_id of the single test tune, written to test.wav")
+    parser.add_argument(
+        "--the_session_tune_ids",
+        type=str,
+        nargs='+',
+        help="Render these TheSession tunes in one batch instead of the single test tune")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of render processes, defaults to the number of CPUs")
+    parser.add_argument(
+        "--render_cache_dir",
+        type=pathlib.Path,
+        default=repo_root / "render_cache",
+        help="Directory of rendered WAV files addressed by a hash of the ABC, meter, key, default length and soundfont")
+    parser.add_argument(
+        "--parse_cache_dir",
+        type=pathlib.Path,
+        default=repo_root / "parse_cache",
+        help="Directory of parsed music21 scores addressed by a hash of the normalised ABC")
+    parser.add_argument(
+        "--parse_cache_mb",
+        type=int,
+        default=512,
+        help="Size the parsed score cache is kept under")
+    parser.add_argument(
+        "--set_id",
+        type=str,
+        help="Render this set as one practice track instead of the single test tune")
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=2,
+        help="Times each tune of the set is played")
+    parser.add_argument(
+        "--crossfade",
+        type=float,
+        default=0.5,
+        help="Seconds each tune of the set crossfades into the next")
+    parser.add_argument(
+        "--output_file",
+        type=pathlib.Path,
+        default=pathlib.Path("set.wav"),
+        help="WAV file the set is written to")
+    instrumentation.add_arguments(parser)
     return parser.parse_args()
 
 
+def open_session_data(args):
+    return SessionDataManager.SessionDataManager(
+        args.session_db, initialize_db=False, backend=args.backend, db_file=args.db_file, schema_file=args.schema_file)
+
+
+def render_practice_set(args):
+    from audio import render_set
+    from parse_cache import ParsedScoreCache
+    with open_session_data(args) as sdm:
+        tunes = [(name, tune_meter, tune_mode, abc) for _, name, abc, _, tune_meter, tune_mode in sdm.read_set_tunes(args.set_id)]
+    if not tunes:
+        print(f"Set {args.set_id} has no tunes")
+        return 1
+    parse_cache = ParsedScoreCache(args.parse_cache_dir, args.parse_cache_mb * 1024 * 1024)
+    render_set(tunes, args.soundfont_file, args.output_file, args.repeats, args.crossfade, parse_cache=parse_cache)
+    print(f"Wrote {len(tunes)} tunes to {args.output_file}")
+    return 0
+
+
+def render_batch(args):
+    from audio import batch_render
+    from parse_cache import ParsedScoreCache
+    from tune_lookup import TheSessionTunes
+    the_session_tunes = TheSessionTunes(args.session_db)
+    the_session_tunes.prefetch(args.the_session_tune_ids)
+    tunes = list()
+    for the_session_tune_id in args.the_session_tune_ids:
+        abc, tune_type, tune_meter, tune_mode = the_session_tunes.get(the_session_tune_id)
+        tunes.append((the_session_tune_id, the_session_tune_id, tune_meter, tune_mode, abc, None))
+    the_session_tunes.close()
+
+    parse_cache = ParsedScoreCache(args.parse_cache_dir, args.parse_cache_mb * 1024 * 1024)
+    counts = {'cached': 0, 'rendered': 0, 'failed': 0}
+    for tune_key, status, wav_filepath, error in batch_render(tunes, args.soundfont_file, args.render_cache_dir, args.workers, parse_cache):
+        counts[status] += 1
+        print(f"{tune_key}: {status} {wav_filepath}" + (f" {error}" if error else ""))
+    print(", ".join(f"{count} {status}" for status, count in counts.items()))
+    return 1 if counts['failed'] else 0
+
+
 def main():
     args = parse()
     print(args)
 
-    with SessionDataManager.SessionDataManager(args.db_file, args.schema_file, args.session_db, initialize_db=False) as sdm:
-        audio_manager = AudioManager()
-        _, _, name, abc, tune_type, tune_meter, tune_mode, _ = sdm.read_tune(113)
-        audio_manager.create_audio_converter(1, name, tune_meter, tune_mode, abc)
-        audio_manager.write_wav("test.wav", str(args.soundfont_file))
+    with instrumentation.run(args):
+        if args.the_session_tune_ids:
+            return render_batch(args)
+        if args.set_id:
+            return render_practice_set(args)
+
+        with open_session_data(args) as sdm:
+            # SQLite ids are integers and neo4j ones UUIDs, the default only exists in a SQLite file
+            tune = sdm.read_tune(args.tune_id)
+            if tune is None:
+                print(f"No tune {args.tune_id} in the {args.backend} session data, "
+                      "pass one that exists with --tune_id or render by --the_session_tune_ids")
+                return 1
+            from audio import AudioManager
+            from parse_cache import ParsedScoreCache
+            audio_manager = AudioManager(ParsedScoreCache(args.parse_cache_dir, args.parse_cache_mb * 1024 * 1024))
+            _, _, name, abc, tune_type, tune_meter, tune_mode, _ = tune
+            audio_manager.create_audio_converter(1, name, tune_meter, tune_mode, abc)
+            audio_manager.write_wav("test.wav", str(args.soundfont_file))
+        return 0
 
 if __name__ == "__main__":
     rc = main()
@@ -0,0 +1,110 @@
+#!python3
+r""" parse_cache.py - on disk cache of parsed music21 scores
+
+converter.parse on ABC is the slowest step of rendering a tune. Parsed scores are frozen with
+music21's StreamFreezer, zlib compressed and stored under a hash of the normalised ABC, so any
+later use of the same tune (audio, export, key detection) thaws it instead of parsing it again.
+The cache is kept under max_bytes by evicting the least recently used scores.
+
+Dependencies
+    py -m pip install music21
+
+"""
+import hashlib
+import os
+import pathlib
+import zlib
+from music21 import converter
+from music21.freezeThaw import StreamFreezer, StreamThawer
+
+
+def normalise_abc(abc_notation):
+    """
+    Strip trailing spaces, line ending differences and blank lines at either end, which change nothing music21 parses.
+    A blank line ends a tune in ABC, so blank lines inside are kept, a run of them as one.
+    """
+    lines = list()
+    for line in abc_notation.splitlines():
+        line = line.rstrip()
+        if line or (lines and lines[-1]):
+            lines.append(line)
+    return "\n".join(lines).strip("\n")
+
+
+def abc_key(abc_notation):
+    return hashlib.sha256(normalise_abc(abc_notation).encode('utf-8')).hexdigest()
+
+
+class ParsedScoreCache:
+    suffix = ".m21.z"
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.total_bytes = None  # scanned on the first store, then kept up to date
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / f"{key}{self.suffix}"
+
+    def parse(self, abc_notation):
+        """converter.parse(abc_notation, format='abc') through the cache"""
+        path = self._path(abc_key(abc_notation))
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            data = None
+        if data is not None:
+            try:
+                thawer = StreamThawer()
+                thawer.openStr(zlib.decompress(data))
+                # Touch it so eviction sees it as recently used
+                os.utime(path)
+                self.hits += 1
+                return thawer.stream
+            except Exception:
+                # Written by another music21 version or damaged, parse it again
+                path.unlink(missing_ok=True)
+
+        self.misses += 1
+        score = converter.parse(abc_notation, format='abc')
+        self.store(path, score)
+        return score
+
+    def store(self, path, score):
+        data = zlib.compress(StreamFreezer(score).writeStr(fmt='pickle'))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temporary_path.write_bytes(data)
+        os.replace(temporary_path, path)
+        if self.total_bytes is None:
+            self.evict()
+        else:
+            self.total_bytes += len(data)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        """Scan the cache and remove least recently used scores until it fits in max_bytes"""
+        entries = list()
+        total_bytes = 0
+        for path in self.cache_dir.glob(f"*/*{self.suffix}"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+        if total_bytes > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total_bytes <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total_bytes -= size
+        self.total_bytes = total_bytes
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,85 @@
+#!python3
+r""" play_counts.py - rebuild, check and query the play count aggregates
+
+scrape.py keeps TunePlayCount and SetPlayCount nodes up to date as it ingests sessions.
+--rebuild recomputes them from the Session/SetTable/Tune graph,
+--check compares them with the live join and fails if any differ,
+--start/--end prints the most played tunes and sets in a date range from the aggregates.
+
+"""
+import argparse
+import pathlib
+import sys
+import SessionDataManager
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    code_root = repo_root.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--session_db",
+        type=pathlib.Path,
+        default=code_root / "TheSession-data" / "thesession.db",
+        help="Filepath of the TheSession-data sqlite file")
+    SessionDataManager.add_backend_arguments(parser, repo_root)
+    parser.add_argument(
+        '--rebuild',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Recompute the aggregates from scratch")
+    parser.add_argument(
+        '--check',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Compare the aggregates with the live join")
+    parser.add_argument(
+        "--start",
+        type=str,
+        help="First session date of the report, YYYY-MM-DD")
+    parser.add_argument(
+        "--end",
+        type=str,
+        help="Last session date of the report, YYYY-MM-DD")
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=50,
+        help="Number of tunes and sets in the report")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    with SessionDataManager.SessionDataManager(
+            args.session_db, initialize_db=False, backend=args.backend, db_file=args.db_file, schema_file=args.schema_file) as sdm:
+        if args.rebuild:
+            sdm.rebuild_play_counts()
+            print("Rebuilt play counts")
+
+        if args.check:
+            mismatches = sdm.check_play_counts()
+            for label, item_id, bucket, period, stored, live in mismatches:
+                print(f"{label} {item_id} {bucket} {period}: aggregate {stored} live {live}")
+            print(f"{len(mismatches)} play counts differ from the live join")
+            if mismatches:
+                return 1
+
+        if args.start and args.end:
+            print(f"Top tunes {args.start} to {args.end}")
+            for tune_id, name, tune_url, tune_count in sdm.read_tune_play_counts(args.start, args.end, args.limit):
+                print(f"{tune_count:5d} {name} {tune_url}")
+            print(f"Top sets {args.start} to {args.end}")
+            for set_id, description, set_count in sdm.read_set_play_counts(args.start, args.end)[:args.limit]:
+                print(f"{set_count:5d} {description}")
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,395 @@
+#!python3
+r""" recognition.py - recognise which tune a recorded clip is playing
+
+Every tune is reduced to a chroma fingerprint, the energy of each of the 12 pitch classes
+frames_per_second times a second. Fingerprints come from the note events AudioManager builds
+(no synthesis needed), from the audio AudioManager renders with --soundfont_file, or from MIDI files.
+All fingerprints are stored end to end in one contiguous float32 matrix with an offsets array,
+so a clip is matched against the whole corpus in one FFT cross-correlation instead of a loop over tunes.
+Each clip is tried at a few tempos and, with --transpose, in every key.
+
+    py recognition.py --build --limit 2000             fingerprint TheSession-data settings
+    py recognition.py --midi_dir midi                  fingerprint MIDI files, keyed by file name
+    py recognition.py --match clip.wav
+
+Dependencies
+    py -m pip install numpy scipy librosa mido music21
+
+"""
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import pathlib
+import sqlite3
+import sys
+import time
+import librosa
+import mido
+import numpy
+import scipy.fft
+from audio import AudioManager
+
+
+frames_per_second = 10
+sample_rate = 22050
+tempos = (0.8, 0.9, 1.0, 1.1, 1.25)
+fingerprint_repeats = 2  # tunes are fingerprinted played through twice, as they are at a session
+
+
+def events_chroma(events, fps=frames_per_second):
+    """(frames, 12) chroma of note events as AudioManager.note_events makes them, velocity weighted"""
+    frames = int((events[-1][0] if events else 0.0) * fps) + 1
+    chroma = numpy.zeros((frames, 12), dtype=numpy.float32)
+    sounding = dict()  # midi_pitch : (start_seconds, velocity)
+    for seconds, is_note_on, midi_pitch, velocity in events:
+        if is_note_on:
+            sounding[midi_pitch] = (seconds, velocity)
+        elif midi_pitch in sounding:
+            start, velocity = sounding.pop(midi_pitch)
+            chroma[int(start * fps):max(int(seconds * fps), int(start * fps) + 1), midi_pitch % 12] += velocity / 127
+    return chroma
+
+
+def midi_events(midi_file):
+    """The note events of a MIDI file in the AudioManager.note_events layout"""
+    events = list()
+    seconds = 0.0
+    for message in mido.MidiFile(midi_file):
+        seconds += message.time
+        if message.type == 'note_on' and message.velocity:
+            events.append((seconds, True, message.note, message.velocity))
+        elif message.type in ('note_on', 'note_off'):
+            events.append((seconds, False, message.note, 0))
+    return events
+
+
+def audio_chroma(samples, rate=sample_rate, fps=frames_per_second):
+    """(frames, 12) chroma of mono float samples"""
+    hop_length = rate // fps
+    return librosa.feature.chroma_stft(y=samples, sr=rate, n_fft=4 * hop_length, hop_length=hop_length).T.astype(numpy.float32)
+
+
+def normalise_frames(chroma):
+    """Each frame scaled to unit length so a correlation is a sum of cosine similarities, silent frames stay zero"""
+    norms = numpy.linalg.norm(chroma, axis=1, keepdims=True)
+    return numpy.divide(chroma, norms, out=numpy.zeros_like(chroma), where=norms > 0)
+
+
+def tune_fingerprint(title, meter, key, abc, font_file=None, parse_cache=None):
+    """
+    Fingerprint one tune in a worker process, from its note events or with font_file from the rendered audio.
+    Returns (chroma, {stage: seconds})
+    """
+    timings = dict()
+    start = time.perf_counter()
+    audio_manager = AudioManager(parse_cache)
+    audio_manager.create_audio_converter(1, title, meter, key, abc)
+    events = audio_manager.note_events(fingerprint_repeats)
+    timings["parse"] = time.perf_counter() - start
+    if font_file is None:
+        start = time.perf_counter()
+        chroma = events_chroma(events)
+        timings["chroma"] = time.perf_counter() - start
+        return chroma, timings
+
+    start = time.perf_counter()
+    pcm = audio_manager.pcm_buffer(font_file, sample_rate, fingerprint_repeats)
+    timings["synthesis"] = time.perf_counter() - start
+    start = time.perf_counter()
+    chroma = audio_chroma(pcm.mean(axis=1, dtype=numpy.float32) / 32768)
+    timings["chroma"] = time.perf_counter() - start
+    return chroma, timings
+
+
+class FingerprintStore:
+    """
+    All fingerprints as one contiguous (frames, 12) matrix, tune i is matrix[offsets[i]:offsets[i + 1]].
+    For matching the matrix is cut into block_frames long blocks that overlap by the longest clip,
+    and the spectrum of every block is kept after the first match, so a match only transforms the clip
+    at block length and correlates all blocks in one batched multiply and inverse transform.
+    """
+    block_frames = 4096
+    variant_batch = 8  # clip variants correlated at once, bounds memory when transposing
+
+    def __init__(self, store_dir, max_clip_seconds=20.0):
+        self.store_dir = pathlib.Path(store_dir)
+        self.matrix = numpy.load(self.store_dir / "matrix.npy", mmap_mode='r')
+        self.offsets = numpy.load(self.store_dir / "offsets.npy")
+        with (self.store_dir / "keys.json").open('r', encoding='utf-8') as f:
+            self.keys = json.load(f)
+        self.max_clip_frames = int(max_clip_seconds * frames_per_second)
+        self.fft_length = scipy.fft.next_fast_len(self.block_frames + self.max_clip_frames, real=True)
+        self.spectrum = None
+        self.remaining = None
+
+    @staticmethod
+    def write(store_dir, fingerprints):
+        """fingerprints is an iterable of (key, chroma), empty ones are left out. Returns the number written."""
+        keys = list()
+        chromas = list()
+        for key, chroma in fingerprints:
+            if len(chroma):
+                keys.append(str(key))
+                chromas.append(normalise_frames(chroma))
+        store_dir = pathlib.Path(store_dir)
+        store_dir.mkdir(parents=True, exist_ok=True)
+        offsets = numpy.zeros(len(chromas) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(chroma) for chroma in chromas], out=offsets[1:])
+        matrix = numpy.lib.format.open_memmap(store_dir / "matrix.npy", mode='w+', dtype=numpy.float32, shape=(int(offsets[-1]), 12))
+        for chroma, start in zip(chromas, offsets):
+            matrix[start:start + len(chroma)] = chroma
+        matrix.flush()
+        numpy.save(store_dir / "offsets.npy", offsets)
+        with (store_dir / "keys.json").open('w', encoding='utf-8') as f:
+            json.dump(keys, f)
+        return len(keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _spectrum(self):
+        """(fft_length // 2 + 1, blocks, 12) spectra of the overlapping blocks of the matrix"""
+        if self.spectrum is None:
+            frames = len(self.matrix)
+            blocks = max(-(-frames // self.block_frames), 1)
+            padded = numpy.zeros((blocks * self.block_frames + self.fft_length, 12), dtype=numpy.float32)
+            padded[:frames] = self.matrix
+            windows = numpy.lib.stride_tricks.sliding_window_view(padded, self.fft_length, axis=0)[::self.block_frames][:blocks]
+            self.spectrum = scipy.fft.rfft(windows, axis=-1, workers=-1).transpose(2, 0, 1).copy()
+        return self.spectrum
+
+    def _remaining(self):
+        """
+        (block_frames, blocks) frames from each position to the end of its tune, laid out like the correlation.
+        Unlimited at the first frame of a tune and zero past the end of the matrix, as a clip may only start
+        where it fits inside one tune, or at the start of a tune shorter than it.
+        """
+        if self.remaining is None:
+            frames = len(self.matrix)
+            blocks = self.spectrum.shape[1]
+            remaining = numpy.zeros(blocks * self.block_frames, dtype=numpy.int32)
+            remaining[:frames] = numpy.repeat(self.offsets[1:], numpy.diff(self.offsets)) - numpy.arange(frames)
+            remaining[self.offsets[:-1]] = numpy.iinfo(numpy.int32).max
+            self.remaining = remaining.reshape(blocks, self.block_frames).T.copy()
+        return self.remaining
+
+    def variants(self, clip_chroma, transpose=False):
+        """The clip at every tempo, and with transpose in every key, zero padded to one length. Returns (variants, lengths)"""
+        clip_chroma = normalise_frames(clip_chroma[:self.max_clip_frames])
+        frames = len(clip_chroma)
+        shifts = range(12) if transpose else (0,)
+        stretched = list()
+        for tempo in tempos:
+            length = min(max(int(round(frames * tempo)), 1), self.max_clip_frames)
+            stretched.append(clip_chroma[numpy.minimum((numpy.arange(length) / tempo).astype(int), frames - 1)])
+        width = max(len(variant) for variant in stretched)
+        variants = numpy.zeros((len(stretched) * len(shifts), width, 12), dtype=numpy.float32)
+        lengths = numpy.zeros(len(variants), dtype=numpy.float32)
+        for index, (variant, shift) in enumerate((variant, shift) for variant in stretched for shift in shifts):
+            variants[index, :len(variant)] = numpy.roll(variant, shift, axis=1)
+            lengths[index] = len(variant)
+        return variants, lengths
+
+    def match(self, clip_chroma, top=10, transpose=False):
+        """
+        The top tunes for a clip as ([(key, score, offset_seconds), ...], {stage: seconds}), best first.
+        score is the mean cosine similarity of the clip frames with the best aligned stretch of the tune.
+        """
+        timings = dict()
+        if not len(clip_chroma) or not len(self.keys):
+            return [], timings
+        start = time.perf_counter()
+        spectrum = self._spectrum()
+        timings["corpus_fft"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        variants, lengths = self.variants(clip_chroma, transpose)
+        # (frequencies, 12, variants) so each frequency is one (blocks, 12) @ (12, variants) product
+        variant_spectra = numpy.conj(scipy.fft.rfft(variants, n=self.fft_length, axis=1, workers=-1)).transpose(1, 2, 0)
+        frames = len(self.matrix)
+        remaining = self._remaining()
+        best = numpy.full(remaining.shape, -numpy.inf, dtype=numpy.float32)
+        for first in range(0, len(variants), self.variant_batch):
+            batch = variant_spectra[..., first:first + self.variant_batch]
+            # (frequencies, blocks, variants), transformed back along the frequencies to (block offset, blocks, variants)
+            scores = scipy.fft.irfft(numpy.matmul(spectrum, batch), n=self.fft_length, axis=0, workers=-1)[:self.block_frames]
+            for index, length in enumerate(lengths[first:first + self.variant_batch]):
+                variant_scores = scores[..., index]
+                variant_scores /= length
+                variant_scores[remaining < length] = -numpy.inf
+                numpy.maximum(best, variant_scores, out=best)
+        best = best.T.reshape(-1)[:frames]
+        timings["correlate"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        starts = self.offsets[:-1]
+        tune_scores = numpy.maximum.reduceat(best, starts)
+        candidates = min(top * 4, len(tune_scores))
+        ranked = numpy.argpartition(-tune_scores, candidates - 1)[:candidates]
+        by_key = dict()
+        for tune in ranked:
+            position = int(numpy.argmax(best[starts[tune]:self.offsets[tune + 1]]))
+            key = self.keys[tune]
+            if tune_scores[tune] > by_key.get(key, (-numpy.inf,))[0]:
+                by_key[key] = (float(tune_scores[tune]), position / frames_per_second)
+        results = sorted(((key, score, offset) for key, (score, offset) in by_key.items()), key=lambda result: -result[1])[:top]
+        timings["rank"] = time.perf_counter() - start
+        return results, timings
+
+    def recognise(self, clip_file, top=10, transpose=False):
+        """Match a recorded audio clip, timings include loading and the clip chroma"""
+        start = time.perf_counter()
+        samples, rate = librosa.load(str(clip_file), sr=sample_rate, mono=True)
+        load_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        clip_chroma = audio_chroma(samples, rate)
+        chroma_seconds = time.perf_counter() - start
+        results, timings = self.match(clip_chroma, top, transpose)
+        return results, {"load": load_seconds, "chroma": chroma_seconds, **timings}
+
+
+def the_session_settings(session_db, limit=None):
+    """(tune_id, name, meter, mode, abc) of the TheSession-data settings"""
+    conn = sqlite3.connect(f"{pathlib.Path(session_db).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        query = "SELECT tune_id, name, meter, mode, abc FROM tunes ORDER BY rowid"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        yield from conn.execute(query)
+    finally:
+        conn.close()
+
+
+def fingerprint_settings(settings, font_file=None, workers=None):
+    """
+    Fingerprint settings across a process pool, in order.
+    Yields (key, chroma, timings), chroma is None with the error string in timings["error"] when a tune fails.
+    At most twice workers settings are read ahead, so memory does not grow with the number of settings.
+    """
+    workers = workers or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        queued = iter(settings)
+        in_flight = collections.deque()  # (tune_id, future) in settings order
+        while True:
+            for tune_id, name, meter, mode, abc in queued:
+                in_flight.append((tune_id, executor.submit(tune_fingerprint, name, meter, mode, abc, font_file)))
+                if len(in_flight) >= 2 * workers:
+                    break
+            if not in_flight:
+                break
+            tune_id, future = in_flight.popleft()
+            try:
+                chroma, timings = future.result()
+            except Exception as err:
+                chroma, timings = None, {"error": f"{type(err).__name__}: {err}"}
+            del future  # a suspended generator keeps its locals, the chroma should go with the caller
+            yield tune_id, chroma, timings
+
+
+def print_timings(title, timings):
+    print(title + ", ".join(f"{stage} {seconds * 1000:.1f}ms" for stage, seconds in timings.items()))
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    code_root = repo_root.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--session_db",
+        type=pathlib.Path,
+        default=code_root / "TheSession-data" / "thesession.db",
+        help="Filepath of the TheSession-data sqlite file")
+    parser.add_argument(
+        "--store_dir",
+        type=pathlib.Path,
+        default=repo_root / "fingerprints",
+        help="Directory of the fingerprint matrix")
+    parser.add_argument(
+        '--build',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Fingerprint the TheSession-data settings")
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=None,
+        help="Fingerprint only the first this many settings")
+    parser.add_argument(
+        "--midi_dir",
+        type=pathlib.Path,
+        help="Fingerprint the .mid files of this directory instead")
+    parser.add_argument(
+        "--soundfont_file",
+        type=pathlib.Path,
+        default=None,
+        help="Fingerprint the audio rendered with this SoundFont instead of the note events")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of fingerprinting processes, defaults to the number of CPUs")
+    parser.add_argument(
+        "--match",
+        type=pathlib.Path,
+        nargs='+',
+        help="Audio clips to recognise")
+    parser.add_argument(
+        '--transpose',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Also try each clip in every key")
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=5,
+        help="Number of candidate tunes to list")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    if args.midi_dir:
+        start = time.perf_counter()
+        fingerprints = ((path.stem, events_chroma(midi_events(path))) for path in sorted(args.midi_dir.glob("*.mid")))
+        written = FingerprintStore.write(args.store_dir, fingerprints)
+        print(f"Fingerprinted {written} MIDI files in {time.perf_counter() - start:.1f}s")
+    elif args.build:
+        start = time.perf_counter()
+        stages = dict()
+        failed = 0
+
+        def fingerprints():
+            nonlocal failed
+            for tune_id, chroma, timings in fingerprint_settings(
+                    the_session_settings(args.session_db, args.limit), args.soundfont_file, args.workers):
+                if chroma is None:
+                    failed += 1
+                    continue
+                for stage, seconds in timings.items():
+                    stages[stage] = stages.get(stage, 0.0) + seconds
+                yield tune_id, chroma
+
+        written = FingerprintStore.write(args.store_dir, fingerprints())
+        print(f"Fingerprinted {written} settings, {failed} failed, in {time.perf_counter() - start:.1f}s")
+        print_timings("worker time: ", stages)
+
+    if args.match:
+        store = FingerprintStore(args.store_dir)
+    for clip_file in args.match or []:
+        results, timings = store.recognise(clip_file, args.top, args.transpose)
+        print_timings(f"{clip_file}: ", timings)
+        for key, score, offset_seconds in results:
+            print(f"{score:6.3f} at {offset_seconds:6.1f}s  https://thesession.org/tunes/{key}")
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
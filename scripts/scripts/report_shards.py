@@ -0,0 +1,327 @@
+#!python3
+r""" report_shards.py - publish the site's reports as static, precompressed JSON shards
+
+Every page in dist/ asks server.js for reports that only change when scrape.py ingests sessions.
+This writes them to --publish_dir once instead, for any static server to hand out:
+
+    manifest.json               which file holds each shard, the only file that keeps its name
+    top.<hash>.json             the --top_limit most played tunes of all time, as /top-tunes
+    months/YYYY-MM.<hash>.json  every tune and set played in the month, with its key, play count and plays per session day
+    sets/<shard>.<hash>.json    {set_id: description and tunes in play order} for the sets in the shard, as /set
+    tunes/<shard>.<hash>.json   {tune_id: the tune, its ABC and the sets it is played in} for the tunes in the shard, as /tune and /abc
+
+A date range report, /tunes-in-range or /sets-in-range, is the sum of the month shards it covers, using the
+per day counts in the months at either end; a key is matched against tune_mode, a set is in every key one of its
+tunes is in. Sets and tunes are spread over --id_shards shards by crc32(str(id)) % id_shards.
+
+Each shard is named by a hash of its content so it can be cached for good, and has a .gz and, when the brotli
+package is installed, a .br next to it. Shards whose content did not change are not written again, and the files
+of the manifest before are kept one more publish for pages still reading them.
+scrape.py --publish_dir calls publish with the sessions it ingested so only their months, sets and tunes are
+read again; run this script for a full publish after set_fingerprints.py --migrate or play_counts.py --rebuild.
+
+"""
+import argparse
+import collections
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import pathlib
+import sys
+import zlib
+import SessionDataManager
+
+manifest_name = "manifest.json"
+version = 1
+
+
+def shard_of(item_id, id_shards):
+    """The shard a set or tune id is published in, the pages compute the same crc32"""
+    return str(zlib.crc32(str(item_id).encode('utf-8')) % id_shards)
+
+
+def encoders():
+    """{encoding: (suffix, compress)} for the precompressed copies, brotli only when it is installed"""
+    encodings = {"gzip": (".gz", lambda data: gzip.compress(data, compresslevel=9, mtime=0))}
+    try:
+        import brotli
+    except ImportError:
+        return encodings
+    encodings["br"] = (".br", lambda data: brotli.compress(data, quality=11))
+    return encodings
+
+
+class ShardWriter:
+    """Writes content-hashed shards with their compressed copies under publish_dir and counts what it did"""
+    def __init__(self, publish_dir):
+        self.publish_dir = pathlib.Path(publish_dir)
+        self.encoders = encoders()
+        self.written = 0
+        self.unchanged = 0
+
+    def write(self, name, payload):
+        """Path of the shard holding payload relative to publish_dir, name is its path without hash and extension"""
+        data = json.dumps(payload, separators=(",", ":"), ensure_ascii=False, sort_keys=True).encode('utf-8')
+        path = f"{name}.{hashlib.sha256(data).hexdigest()[:16]}.json"
+        filepath = self.publish_dir / path
+        if filepath.exists() and all(filepath.with_name(filepath.name + suffix).exists() for suffix, _ in self.encoders.values()):
+            self.unchanged += 1
+            return path
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        # The plain file goes last, its presence says the compressed copies are complete
+        for suffix, compress in self.encoders.values():
+            self._replace(filepath.with_name(filepath.name + suffix), compress(data))
+        self._replace(filepath, data)
+        self.written += 1
+        return path
+
+    @staticmethod
+    def _replace(filepath, data):
+        temporary_file = filepath.with_name(filepath.name + ".tmp")
+        with open(temporary_file, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_file, filepath)
+
+
+def read_manifest(publish_dir):
+    filepath = pathlib.Path(publish_dir) / manifest_name
+    if not filepath.exists():
+        return None
+    with open(filepath, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def manifest_paths(manifest):
+    """Every shard path a manifest refers to"""
+    if not manifest:
+        return set()
+    paths = {manifest["top"]}
+    for section in ("months", "sets", "tunes"):
+        paths.update(manifest[section].values())
+    return paths
+
+
+def read_shard(publish_dir, path):
+    with open(pathlib.Path(publish_dir) / path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def month_payload(sdm, month, session_dates):
+    """The tunes and sets played in month ('YYYY-MM'), most played first, from the day play count aggregates"""
+    days = sorted(day for day in session_dates if day.startswith(month))
+    tunes = dict()
+    sets = dict()
+    for day in days:
+        for tune_id, name, tune_url, tune_count in sdm.read_tune_play_counts(day, day):
+            row = tunes.setdefault(tune_id, {
+                "tune_id": tune_id, "name": name, "tune_url": tune_url, "tune_count": 0, "days": dict()})
+            row["tune_count"] += tune_count
+            row["days"][day] = tune_count
+        for set_id, description, set_count in sdm.read_set_play_counts(day, day):
+            row = sets.setdefault(set_id, {
+                "set_id": set_id, "description": description, "set_count": 0, "days": dict()})
+            row["set_count"] += set_count
+            row["days"][day] = set_count
+
+    # Every tune played that month is in one of the month's sets, their lists give both keys
+    tune_modes = dict()
+    for set_id, (_, set_tunes) in sdm.read_set_lists(list(sets)).items():
+        sets[set_id]["tune_modes"] = sorted({tune_mode for _, _, _, tune_mode, _ in set_tunes if tune_mode})
+        tune_modes.update((tune_id, tune_mode) for tune_id, _, _, tune_mode, _ in set_tunes)
+    for tune_id, row in tunes.items():
+        row["tune_mode"] = tune_modes.get(tune_id)
+    return {
+        "month": month,
+        "sessions": days,
+        "tunes": sorted(tunes.values(), key=lambda row: (-row["tune_count"], str(row["tune_id"]))),
+        "sets": sorted(sets.values(), key=lambda row: (-row["set_count"], str(row["set_id"]))),
+    }
+
+
+def set_entries(sdm, set_ids):
+    """{str(set_id): entry} for the set shards"""
+    return {
+        str(set_id): {
+            "set_id": set_id,
+            "description": description,
+            "tunes": [
+                {"tune_id": tune_id, "name": name, "tune_url": tune_url, "tune_mode": tune_mode, "abc": abc}
+                for tune_id, name, tune_url, tune_mode, abc in tunes]}
+        for set_id, (description, tunes) in sdm.read_set_lists(set_ids).items()}
+
+
+def tune_entries(sdm, tune_ids):
+    """{str(tune_id): entry} for the tune shards"""
+    tune_sets = sdm.read_tune_sets(tune_ids)
+    return {
+        str(tune_id): {
+            "tune_id": tune_id,
+            "the_session_tune_id": the_session_tune_id,
+            "name": name,
+            "abc": abc,
+            "tune_type": tune_type,
+            "tune_meter": tune_meter,
+            "tune_mode": tune_mode,
+            "tune_url": tune_url,
+            "sets": [{"set_id": set_id, "description": description} for set_id, description in tune_sets.get(tune_id, [])]}
+        for tune_id, the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url in sdm.read_tunes(tune_ids)}
+
+
+def publish_entries(writer, previous, section, entries, id_shards, full):
+    """
+    {shard: path} of the set or tune shards after putting entries in them.
+    A full publish writes entries as they are, otherwise they are merged into the previous shards they belong in.
+    """
+    shards = collections.defaultdict(dict)
+    for key, entry in entries.items():
+        shards[shard_of(key, id_shards)][key] = entry
+    paths = dict() if full else dict(previous[section])
+    for shard, shard_entries in shards.items():
+        if not full and shard in paths:
+            shard_entries = dict(read_shard(writer.publish_dir, paths[shard]), **shard_entries)
+        paths[shard] = writer.write(f"{section}/{shard}", shard_entries)
+    return dict(sorted(paths.items(), key=lambda item: int(item[0])))
+
+
+def remove_stale(publish_dir, keep):
+    """Delete the shard files, compressed copies included, of no path in keep. Returns the number of shards removed"""
+    publish_dir = pathlib.Path(publish_dir)
+    removed = set()
+    for filepath in publish_dir.glob("**/*.json*"):
+        path = filepath.relative_to(publish_dir).as_posix()
+        shard_path = path[:path.index(".json") + len(".json")]
+        if shard_path == manifest_name or shard_path in keep:
+            continue
+        filepath.unlink()
+        removed.add(shard_path)
+    return len(removed)
+
+
+def publish(sdm, publish_dir, plays=None, id_shards=64, top_limit=50):
+    """
+    Publish the reports under publish_dir and return the new manifest.
+    plays are the (session_date, set_id, tune_ids) of the sets just ingested, in the form increment_play_counts
+    takes, and only their months, sets and tunes are read again. Everything is read when plays is None,
+    or when there is no earlier publish with the same id_shards to add to.
+    """
+    publish_dir = pathlib.Path(publish_dir)
+    previous = read_manifest(publish_dir)
+    full = plays is None or previous is None or previous.get("version") != version or previous.get("id_shards") != id_shards
+    writer = ShardWriter(publish_dir)
+    session_dates = sdm.read_session_dates()
+
+    if full:
+        months = {day[:7] for day in session_dates}
+        set_ids = None
+        tune_ids = None
+    else:
+        plays = list(plays)
+        months = {session_date[:7] for session_date, _, _ in plays}
+        set_ids = list(dict.fromkeys(set_id for _, set_id, _ in plays))
+        tune_ids = list(dict.fromkeys(tune_id for _, _, tune_ids in plays for tune_id in tune_ids))
+
+    top = list()
+    if session_dates:
+        top = [
+            {"tune_id": tune_id, "name": name, "tune_url": tune_url, "tune_count": tune_count}
+            for tune_id, name, tune_url, tune_count in sdm.read_tune_play_counts(min(session_dates), max(session_dates), top_limit)]
+
+    month_paths = dict() if full else dict(previous["months"])
+    for month in sorted(months):
+        month_paths[month] = writer.write(f"months/{month}", month_payload(sdm, month, session_dates))
+
+    manifest = {
+        "version": version,
+        "generated": datetime.datetime.now().isoformat(timespec="seconds"),
+        "encodings": list(writer.encoders),
+        "id_shards": id_shards,
+        "first_date": min(session_dates, default=None),
+        "last_date": max(session_dates, default=None),
+        "top": writer.write("top", top),
+        "months": dict(sorted(month_paths.items())),
+        "sets": publish_entries(writer, previous, "sets", set_entries(sdm, set_ids), id_shards, full),
+        "tunes": publish_entries(writer, previous, "tunes", tune_entries(sdm, tune_ids), id_shards, full),
+    }
+    ShardWriter._replace(publish_dir / manifest_name, json.dumps(manifest, indent=1).encode('utf-8'))
+    removed = remove_stale(publish_dir, manifest_paths(manifest) | manifest_paths(previous))
+    print(f"Published {'all' if full else len(months)} months to {publish_dir}: "
+          f"{writer.written} shards written, {writer.unchanged} unchanged, {removed} removed, encodings {', '.join(manifest['encodings'])}")
+    return manifest
+
+
+def read_range(publish_dir, start_date, end_date, key=None):
+    """
+    ([(tune_id, name, tune_url, tune_count)], [(set_id, description, set_count)]) for start_date to end_date
+    inclusive, most played first, summed from the published month shards the way a page would.
+    key limits them to the tunes in that key and the sets with a tune in it, as ?key does.
+    """
+    manifest = read_manifest(publish_dir)
+    start_date, end_date = str(start_date), str(end_date)
+    tunes = collections.Counter()
+    sets = collections.Counter()
+    names = dict()
+    for month, path in manifest["months"].items():
+        if not start_date[:7] <= month <= end_date[:7]:
+            continue
+        shard = read_shard(publish_dir, path)
+        for section, counts, modes in (("tunes", tunes, "tune_mode"), ("sets", sets, "tune_modes")):
+            for row in shard[section]:
+                if key and key not in ([row[modes]] if section == "tunes" else row[modes]):
+                    continue
+                count = sum(plays for day, plays in row["days"].items() if start_date <= day <= end_date)
+                if count:
+                    item_id = row["tune_id"] if section == "tunes" else row["set_id"]
+                    counts[item_id] += count
+                    names[(section, item_id)] = (row["name"], row["tune_url"]) if section == "tunes" else (row["description"],)
+    return (
+        [(tune_id, *names[("tunes", tune_id)], count) for tune_id, count in tunes.most_common()],
+        [(set_id, *names[("sets", set_id)], count) for set_id, count in sets.most_common()])
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    code_root = repo_root.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--session_db",
+        type=pathlib.Path,
+        default=code_root / "TheSession-data" / "thesession.db",
+        help="Filepath of the TheSession-data sqlite file")
+    SessionDataManager.add_backend_arguments(parser, repo_root)
+    parser.add_argument(
+        "--publish_dir",
+        type=pathlib.Path,
+        default=repo_root / "dist" / "reports",
+        help="Directory the manifest and shards are written to")
+    parser.add_argument(
+        "--id_shards",
+        type=int,
+        default=64,
+        help="Number of shards the sets and the tunes are each spread over")
+    parser.add_argument(
+        "--top_limit",
+        type=int,
+        default=50,
+        help="Number of tunes in the top tunes shard")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    with SessionDataManager.SessionDataManager(
+            args.session_db, initialize_db=False, backend=args.backend, db_file=args.db_file, schema_file=args.schema_file) as sdm:
+        manifest = publish(sdm, args.publish_dir, id_shards=args.id_shards, top_limit=args.top_limit)
+    print(f"{len(manifest['months'])} months, {len(manifest['sets'])} set shards, {len(manifest['tunes'])} tune shards")
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -13,34 +13,73 @@ Dependencies
 
 """
 import argparse
-import requests
-from bs4 import BeautifulSoup
+import collections
+import concurrent.futures
+import contextlib
 import os
 import pathlib
 import sys
 import re
 from datetime import datetime, time
 import SessionDataManager
+from session_backend import set_fingerprint
+import ceol_html
+import instrumentation
+from manifest import PageManifest
+from snapshot import RecordingHttp, SnapshotReader, SnapshotWriter
 
 
 re_session_url = re.compile(r'\d')
-def ceol_session_info_tuples(ceol_url):
+# Requests per second to each host when --workers fetch in parallel and no --rate_limit is given
+parallel_rate_limit = 4.0
+
+
+@instrumentation.timed("scrape.fetch_page")
+def fetch_page(url, http=None, manifest=None):
+    """
+    Returns the content of url or None if it could not be retrieved.
+    http is anything with a requests style get, the requests module or a fetcher.Fetcher, requests when None.
+    With a manifest.PageManifest, None is also returned when the page is unchanged since the last crawl.
+    """
+    # Imported on first use so scrape --help never loads requests
+    import requests
+    if http is None:
+        http = requests
+    try:
+        if manifest is not None:
+            return manifest.fetch(url, http)
+        response = http.get(url)
+    except requests.RequestException as e:
+        print(f"Failed to retrieve content from {url}. {e}")
+        return None
+    if response.status_code != 200:
+        print(f"Failed to retrieve content from {url}. Status code: {response.status_code}")
+        return None
+    return response.content
+
+
+@instrumentation.timed("scrape.ceol_session_info_tuples")
+def ceol_session_info_tuples(ceol_url, http=None, manifest=None):
     """
     Yields information for each session url from https://ceol.io/sessions/austin/mueller/
     (session_url, location_id, session_date, start_time, end_time)
     """
+    content = fetch_page(ceol_url, http, manifest)
+    if content is None:
+        return
+    yield from session_info_tuples_from_html(content, ceol_url)
+
+
+@instrumentation.timed("scrape.session_info_tuples_from_html")
+def session_info_tuples_from_html(content, ceol_url):
     # Define start and end times, these are hard coded for this set of sessions.
     location_id = 1
     start_time = time(19, 0)  # 7:00 PM
     end_time = time(22, 30)   # 10:30 PM
 
-    response = requests.get(ceol_url)
-    if response.status_code != 200:
-        print(f"Failed to retrieve content from {ceol_url}. Status code: {response.status_code}")
-        return
-    soup = BeautifulSoup(response.content, 'html.parser')
-    for a_tag in soup.find_all('a'):
-        href = a_tag.get("href")
+    for href, _ in ceol_html.anchors(content):
+        if href is None:
+            continue
         try:
             session_date = datetime.strptime(href.split(".")[0], '%Y-%m-%d')
         except ValueError:
@@ -49,27 +88,99 @@ def ceol_session_info_tuples(ceol_url):
         yield session_url, location_id, session_date, start_time, end_time
 
 
-def ceol_set_info_tuplets(session_url):
+@instrumentation.timed("scrape.ceol_set_info_tuplets")
+def ceol_set_info_tuplets(session_url, http=None, manifest=None):
     """
     Yields tune information for each session at mueller https://ceol.io/sessions/austin/mueller/{session_date}.html
     (set_index, tunes) where tunes is a list of (tune_name, tune_id, tune_url)
     """
-    response = requests.get(session_url)
-    if response.status_code != 200:
-        print(f"Failed to retrieve content from {session_url}. Status code: {response.status_code}")
+    content = fetch_page(session_url, http, manifest)
+    if content is None:
         return
-    soup = BeautifulSoup(response.content, 'html.parser')
+    yield from set_info_tuplets_from_html(content)
+
+
+@instrumentation.timed("scrape.set_info_tuplets_from_html")
+def set_info_tuplets_from_html(content):
     # Note that we will yield 1 based indexes because that matches what SQL does
-    set_index = 0
-    for li in soup.find_all('li'):
-        set_index += 1
-        tunes = list()
-        for a_tag in li.find_all('a'):
-            tune_name = a_tag.text
-            tune_url = a_tag.get("href")
-            tune_id = tune_url.split("#")[0].split('/')[-1]
-            tunes.append((tune_name, tune_id, tune_url))
-        yield set_index, tunes
+    yield from ceol_html.set_info_tuplets(content)
+
+
+def ceol_session_pages(ceol_url, fetcher, skip_dates=frozenset(), manifest=None):
+    """
+    Yields (session_info, set_infos) for each session in index order,
+    where session_info is a tuple from ceol_session_info_tuples and set_infos is the list from ceol_set_info_tuplets.
+    Session pages are fetched by up to fetcher.workers threads, but the order never changes.
+    Sessions whose 'YYYY-MM-DD' date is in skip_dates are never downloaded,
+    and with a manifest neither are session pages that have not changed since the last crawl.
+    The index is always downloaded, an unchanged index still links the session pages an earlier run failed on.
+    """
+    def fetch_sets(session_info):
+        # None when the page failed to download or is unchanged, a page without sets is still a page
+        content = fetch_page(session_info[0], fetcher, manifest)
+        return session_info, None if content is None else list(set_info_tuplets_from_html(content))
+
+    def new_sessions():
+        for session_info in ceol_session_info_tuples(ceol_url, fetcher):
+            if session_info[2].strftime('%Y-%m-%d') in skip_dates:
+                continue
+            yield session_info
+
+    for session_info, set_infos in fetcher.map_ordered(fetch_sets, new_sessions()):
+        if set_infos is None:
+            if manifest is not None:
+                # Unchanged since an earlier run ingested it, or it failed to download and is not in the manifest
+                # so the next run will retry it
+                continue
+            set_infos = list()
+        yield session_info, set_infos
+
+
+snapshot_readers = dict()  # snapshot_file : SnapshotReader, one per process
+
+
+def snapshot_set_infos(snapshot_file, session_url):
+    """The list of ceol_set_info_tuplets for session_url read from a snapshot, run in snapshot_session_pages' processes"""
+    reader = snapshot_readers.get(snapshot_file)
+    if reader is None:
+        reader = snapshot_readers[snapshot_file] = SnapshotReader(snapshot_file)
+    content = reader.read(session_url)
+    if content is None:
+        print(f"Not in snapshot {snapshot_file}: {session_url}")
+        return list()
+    return list(set_info_tuplets_from_html(content))
+
+
+def snapshot_session_pages(ceol_url, snapshot_file, workers=1, skip_dates=frozenset()):
+    """
+    ceol_session_pages with every page read from a snapshot written by --snapshot_file instead of the network.
+    Session pages are decompressed and parsed by up to workers processes, each mapping the snapshot itself,
+    and at most 2 * workers pages are in flight so the parsed sets never pile up ahead of the database writes.
+    """
+    with SnapshotReader(snapshot_file) as reader:
+        content = reader.read(ceol_url)
+    if content is None:
+        print(f"Not in snapshot {snapshot_file}: {ceol_url}")
+        return
+    session_infos = [
+        session_info for session_info in session_info_tuples_from_html(content, ceol_url)
+        if session_info[2].strftime('%Y-%m-%d') not in skip_dates]
+
+    if workers <= 1:
+        for session_info in session_infos:
+            yield session_info, snapshot_set_infos(snapshot_file, session_info[0])
+        return
+    window = 2 * workers
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = collections.deque()
+        for session_info in session_infos:
+            in_flight.append((session_info, executor.submit(snapshot_set_infos, snapshot_file, session_info[0])))
+            if len(in_flight) >= window:
+                session_info, future = in_flight.popleft()
+                yield session_info, future.result()
+        while in_flight:
+            session_info, future = in_flight.popleft()
+            yield session_info, future.result()
 
 
 def parse():
@@ -90,39 +201,201 @@ def parse():
         type=pathlib.Path,
         default=code_root / "TheSession-data" / "thesession.db",
         help="Filepath for a file containing the SQL commands that initialize the database")
+    SessionDataManager.add_backend_arguments(parser, repo_root)
     parser.add_argument(
         '--initialize_db',
         default=False,
         action=argparse.BooleanOptionalAction)
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=500,
+        help="Rows per UNWIND transaction when writing to the database, 0 writes one row per round trip")
+    parser.add_argument(
+        "--ingest_every",
+        type=int,
+        default=25,
+        help="Sessions parsed before they are written to the database together, what a failed backfill can lose")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of session pages to fetch in parallel, or with --replay to parse in parallel processes, 1 works serially")
+    parser.add_argument(
+        "--rate_limit",
+        type=float,
+        help=f"Maximum requests per second to each host, 0 for no limit. "
+             f"Defaults to {parallel_rate_limit} with --workers above 1 and no limit for a serial crawl")
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="Retries with exponential backoff for failed requests")
+    parser.add_argument(
+        '--incremental',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Only ingest sessions whose dates are not already in the database and pages that changed since the last crawl")
+    parser.add_argument(
+        "--manifest_file",
+        type=pathlib.Path,
+        default=repo_root / "crawl_manifest.json",
+        help="Filepath for the ETag/Last-Modified/content hash manifest used by --incremental")
+    parser.add_argument(
+        "--snapshot_file",
+        type=pathlib.Path,
+        help="Also save every page fetched to this snapshot file, added to if it exists. Pages --incremental finds unchanged are not fetched so not saved")
+    parser.add_argument(
+        "--replay",
+        type=pathlib.Path,
+        help="Ingest from this snapshot file instead of crawling, nothing is fetched")
+    parser.add_argument(
+        "--publish_dir",
+        type=pathlib.Path,
+        help="After ingest, publish the reports as static shards here, only the ones the new sessions change, see report_shards.py")
+    instrumentation.add_arguments(parser)
     return parser.parse_args()
 
 
+def ceol_session_payloads(session_pages, sdm):
+    """
+    Yields (session_url, payload) for each session of session_pages, from ceol_session_pages or snapshot_session_pages,
+    where payload is in the form SessionDataManager.ingest_sessions takes
+    (location_id, session_date, start_time, end_time, description, sets)
+    """
+    for session_info, set_infos in session_pages:
+        session_url, location_id, session_date, start_time, end_time = session_info
+        print(f"Parse session: {session_url=}, {location_id=}, {session_date=}, {start_time=}, {end_time=}")
+        sdm.prefetch_tunes_from_TheSession(
+            the_session_tune_id for _, tunes in set_infos for _, the_session_tune_id, _ in tunes)
+        sets = list()
+        #(set_index, tunes) where tunes is a list of (tune_name, the_session_tune_id, tune_url)
+        for set_index, tunes in set_infos:
+            set_description = ', '.join([tune_name for tune_name, the_session_tune_id, tune_url in tunes])
+            set_tunes = list()
+            for tune_name, the_session_tune_id, tune_url in tunes:
+                abc, tune_type, tune_meter, tune_mode = sdm.get_tune_from_TheSession(the_session_tune_id)
+                set_tunes.append((the_session_tune_id, tune_name, abc, tune_type, tune_meter, tune_mode, tune_url))
+            sets.append((set_index, set_description, set_tunes))
+        yield session_url, (
+            location_id,
+            session_date.strftime('%Y-%m-%d'),
+            start_time.strftime('%H:%M:%S'),
+            end_time.strftime('%H:%M:%S'),
+            "",
+            sets)
+
+
+def crawl_rate(rate_limit, workers):
+    """Requests per second to each host, a serial crawl is only limited when --rate_limit asks for it"""
+    if rate_limit is not None:
+        return rate_limit
+    return parallel_rate_limit if workers > 1 else 0
+
+
+def ingested_plays(payloads, ingested):
+    """(session_date, set_id, tune_ids) of each set of payloads, from the ids ingest_sessions returned for them"""
+    for payload, (_, session_sets) in zip(payloads, ingested):
+        for set_id, tune_ids in session_sets:
+            yield payload[1], set_id, tune_ids
+
+
 def main():
     args = parse()
     print(args)
 
-    with SessionDataManager.SessionDataManager(args.session_db, args.initialize_db) as sdm:
-        for session_url, location_id, session_date, start_time, end_time in ceol_session_info_tuples(args.url):
-            print(f"Create session: {session_url=}, {location_id=}, {session_date=}, {start_time=}, {end_time=}")
-            session_id = sdm.create_session(
-                location_id,
-                session_date.strftime('%Y-%m-%d'),
-                start_time.strftime('%H:%M:%S'),
-                end_time.strftime('%H:%M:%S'),
-                "")
-
-            #(set_index, tunes) where tunes is a list of (tune_name, the_session_tune_id, tune_url)
-            for set_index, tunes in ceol_set_info_tuplets(session_url):
-                set_description = ', '.join([tune_name for tune_name, the_session_tune_id, tune_url in tunes])
-                set_id = sdm.read_or_create_set(set_description)
-                sdm.create_set_to_session(session_id, set_id, set_index)
-
-                tune_number_in_set = 0
-                for tune_name, the_session_tune_id, tune_url in tunes:
-                    tune_number_in_set += 1
-                    abc, tune_type, tune_meter, tune_mode = sdm.get_tune_from_TheSession(the_session_tune_id)
-                    our_tune_id = sdm.get_id_or_create_tune(the_session_tune_id, tune_name, abc, tune_type, tune_meter, tune_mode, tune_url)
-                    sdm.create_tune_to_set(our_tune_id, set_id, tune_number_in_set)
+    from fetcher import Fetcher
+    fetcher = Fetcher(workers=args.workers, rate=crawl_rate(args.rate_limit, args.workers), retries=args.retries)
+    with instrumentation.run(args), fetcher, contextlib.ExitStack() as stack, SessionDataManager.SessionDataManager(
+            args.session_db, args.initialize_db, backend=args.backend, db_file=args.db_file, schema_file=args.schema_file) as sdm:
+        if not sdm.the_session_tunes.has_tune_id_index():
+            print(f"No index on tunes.tune_id in {args.session_db}, see scripts/README.md")
+        if sdm.count_sets_without_fingerprint():
+            print("Some stored sets have no fingerprint and will not be matched, run set_fingerprints.py --migrate")
+
+        skip_dates = frozenset()
+        manifest = None
+        if args.incremental:
+            skip_dates = sdm.read_session_dates()
+            if not args.replay:
+                manifest = PageManifest(args.manifest_file)
+            print(f"Incremental crawl, {len(skip_dates)} sessions already ingested")
+
+        if args.replay:
+            print(f"Replaying {args.replay}, nothing is fetched")
+            session_pages = snapshot_session_pages(args.url, args.replay, args.workers, skip_dates)
+        else:
+            http = fetcher
+            if args.snapshot_file:
+                snapshot_writer = stack.enter_context(SnapshotWriter(args.snapshot_file))
+                http = RecordingHttp(fetcher, snapshot_writer)
+            session_pages = ceol_session_pages(args.url, http, skip_dates, manifest)
+
+        # (session_date, set_id, tune_ids) of every set ingested, for --publish_dir
+        ingested = list()
+        if args.batch_size <= 0:
+            for session_info, set_infos in session_pages:
+                session_url, location_id, session_date, start_time, end_time = session_info
+                print(f"Create session: {session_url=}, {location_id=}, {session_date=}, {start_time=}, {end_time=}")
+                session_id = sdm.create_session(
+                    location_id,
+                    session_date.strftime('%Y-%m-%d'),
+                    start_time.strftime('%H:%M:%S'),
+                    end_time.strftime('%H:%M:%S'),
+                    "")
+
+                sdm.prefetch_tunes_from_TheSession(
+                    the_session_tune_id for _, tunes in set_infos for _, the_session_tune_id, _ in tunes)
+                plays = list()
+                #(set_index, tunes) where tunes is a list of (tune_name, the_session_tune_id, tune_url)
+                for set_index, tunes in set_infos:
+                    set_description = ', '.join([tune_name for tune_name, the_session_tune_id, tune_url in tunes])
+                    fingerprint = set_fingerprint(the_session_tune_id for _, the_session_tune_id, _ in tunes)
+                    set_id = sdm.read_or_create_set(set_description, fingerprint)
+                    sdm.create_set_to_session(session_id, set_id, set_index)
+                    set_tune_ids = list()
+                    plays.append((session_date.strftime('%Y-%m-%d'), set_id, set_tune_ids))
+
+                    tune_number_in_set = 0
+                    for tune_name, the_session_tune_id, tune_url in tunes:
+                        tune_number_in_set += 1
+                        abc, tune_type, tune_meter, tune_mode = sdm.get_tune_from_TheSession(the_session_tune_id)
+                        our_tune_id = sdm.get_id_or_create_tune(the_session_tune_id, tune_name, abc, tune_type, tune_meter, tune_mode, tune_url)
+                        sdm.create_tune_to_set(our_tune_id, set_id, tune_number_in_set)
+                        set_tune_ids.append(our_tune_id)
+                sdm.increment_play_counts(plays)
+                ingested.extend(plays)
+                if manifest is not None:
+                    manifest.commit([session_url])
+        else:
+            # Write ingest_every sessions at a time so a failure part way through a backfill keeps the earlier ones
+            pending = list()
+            pending_urls = list()
+            for session_url, payload in ceol_session_payloads(session_pages, sdm):
+                pending.append(payload)
+                pending_urls.append(session_url)
+                if len(pending) >= max(1, args.ingest_every):
+                    ingested.extend(ingested_plays(pending, sdm.ingest_sessions(pending, args.batch_size)))
+                    if manifest is not None:
+                        manifest.commit(pending_urls)
+                        manifest.save()
+                    pending = list()
+                    pending_urls = list()
+            if pending:
+                ingested.extend(ingested_plays(pending, sdm.ingest_sessions(pending, args.batch_size)))
+                if manifest is not None:
+                    manifest.commit(pending_urls)
+
+        print(f"TheSession tune lookups: {sdm.the_session_tunes.stats()}")
+
+        if args.publish_dir:
+            import report_shards
+            # A fresh database replaces whatever was published from the one before
+            report_shards.publish(sdm, args.publish_dir, None if args.initialize_db else ingested)
+
+        # Only pages whose sessions are in the database were committed
+        if manifest is not None:
+            manifest.save()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,323 @@
+#!python3
+r""" session_backend.py - the storage interface behind SessionDataManager
+
+A backend stores Locations, Sessions, Sets and Tunes and the links between them.
+neo4j_backend.Neo4jBackend keeps them in the hosted graph, sqlite_backend.SQLiteBackend in a local
+file with the init.sql schema. The batching and play count bookkeeping that does not depend on
+the store lives here, the backends only implement the reads and writes.
+
+"""
+import collections
+import datetime
+import hashlib
+
+
+def set_fingerprint(the_session_tune_ids):
+    """
+    The identity of a set, a hash of its TheSession tune ids in play order.
+    The same tunes in the same order give the same fingerprint however they are named on the page.
+    """
+    return hashlib.sha1(",".join(str(tune_id) for tune_id in the_session_tune_ids).encode('utf-8')).hexdigest()
+
+
+class SessionBackend:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        raise NotImplementedError
+
+    def initialize_database(self):
+        raise NotImplementedError
+
+    # Single row reads and writes, each is its own transaction
+    def create_session(self, location_id, session_date, start_time, end_time, description):
+        raise NotImplementedError
+
+    def update_session_end(self, session_id, end_time, description):
+        """Sets the end time and description of a session created before it ended"""
+        raise NotImplementedError
+
+    def create_location(self, description, address, url):
+        raise NotImplementedError
+
+    def read_or_create_set(self, description, fingerprint):
+        """The set_id of the set with fingerprint, a new set is created with description when there is none."""
+        raise NotImplementedError
+
+    def create_tune(self, the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url):
+        raise NotImplementedError
+
+    def get_id_or_create_tune(self, the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url):
+        raise NotImplementedError
+
+    def create_set_to_session(self, session_id, set_id, set_index):
+        raise NotImplementedError
+
+    def create_tune_to_set(self, tune_id, set_id, tune_index):
+        raise NotImplementedError
+
+    def read_tune(self, tune_id):
+        """
+        Returns (tune_id, the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url)
+        or None if there is no such tune.
+        """
+        raise NotImplementedError
+
+    def read_tunes(self, tune_ids=None):
+        """Rows in the read_tune layout for each of tune_ids that exists, or for every tune when tune_ids is None."""
+        raise NotImplementedError
+
+    def read_session_dates(self):
+        """Returns the set of session dates already stored as 'YYYY-MM-DD' strings."""
+        raise NotImplementedError
+
+    def read_set_tunes(self, set_id):
+        """
+        Returns the tunes of a set in play order as a list of
+        (tune_id, name, abc, tune_type, tune_meter, tune_mode)
+        """
+        raise NotImplementedError
+
+    def read_session_ids(self):
+        """Returns the set of session ids stored, to tell which sessions an export or model is missing."""
+        raise NotImplementedError
+
+    def read_tune_plays(self, since=None, session_ids=None):
+        """
+        Yields one row per tune played, in session date order, for the analytics export
+        (session_date, session_id, set_id, set_index, tune_index, tune_id, the_session_tune_id,
+         name, tune_type, tune_meter, tune_mode)
+        Only sessions after since ('YYYY-MM-DD') are read when it is given, and only those in session_ids when it is.
+        """
+        raise NotImplementedError
+
+    def read_tune_play_counts(self, start_date, end_date, limit=None):
+        """
+        Returns [(tune_id, name, tune_url, tune_count), ...] for start_date to end_date, most played first,
+        the same rows /tunes-in-range builds with the five table join.
+        """
+        raise NotImplementedError
+
+    def read_set_play_counts(self, start_date, end_date):
+        """Returns [(set_id, description, set_count), ...] for start_date to end_date, most played first."""
+        raise NotImplementedError
+
+    def read_set_lists(self, set_ids=None):
+        """
+        Returns {set_id: (description, tunes)} for each of set_ids that exists, or for every set when set_ids is None,
+        tunes is a list of (tune_id, name, tune_url, tune_mode, abc) in play order, the rows /set gives.
+        """
+        raise NotImplementedError
+
+    def read_tune_sets(self, tune_ids=None):
+        """
+        Returns {tune_id: [(set_id, description), ...]} of the sets each of tune_ids is played in,
+        or for every tune when tune_ids is None, the rows /tune gives.
+        """
+        raise NotImplementedError
+
+    def count_sets_without_fingerprint(self):
+        """Number of sets stored before sets had fingerprints, migrate_set_fingerprints gives them one."""
+        raise NotImplementedError
+
+    # Batched writes, implemented by the backends
+    def _write_nodes(self, tune_rows, set_rows, session_rows, batch_size):
+        """
+        Merge tunes on the_session_tune_id and sets on fingerprint, create the sessions.
+        Returns (tune_ids, set_ids, session_ids) dicts of row key : id.
+        """
+        raise NotImplementedError
+
+    def _write_links(self, set_to_session_rows, tune_to_set_rows, batch_size):
+        raise NotImplementedError
+
+    def _add_play_counts(self, tune_rows, set_rows, batch_size):
+        raise NotImplementedError
+
+    def _replace_play_counts(self, tune_rows, set_rows, batch_size):
+        raise NotImplementedError
+
+    def _read_set_tune_ids(self):
+        """dict of set_id : (stored fingerprint or None, [the_session_tune_id, ...] in tune_index order) for every set"""
+        raise NotImplementedError
+
+    def _merge_sets(self, merge_rows, batch_size):
+        """For each {"set_id", "keep"} row move the sessions of set_id to set keep and delete set_id with its tune links"""
+        raise NotImplementedError
+
+    def _write_set_fingerprints(self, fingerprint_rows, batch_size):
+        """Store each {"set_id", "fingerprint"} row"""
+        raise NotImplementedError
+
+    def _read_live_play_counts(self, label):
+        """Counter of (id, 'YYYY-MM-DD') : plays from the live join, label is 'TunePlayCount' or 'SetPlayCount'"""
+        raise NotImplementedError
+
+    def _read_stored_play_counts(self, label):
+        """dict of (id, bucket, period) : count from the aggregates"""
+        raise NotImplementedError
+
+    def ingest_sessions(self, sessions, batch_size=500):
+        """
+        Write whole parsed sessions with a few batched transactions instead of one round trip per row.
+        sessions is an iterable of (location_id, session_date, start_time, end_time, description, sets)
+        where sets is a list of (set_index, set_description, tunes)
+        and tunes is a list of (the_session_tune_id, tune_name, abc, tune_type, tune_meter, tune_mode, tune_url)
+        Sets are identified by the set_fingerprint of their tunes, a new set keeps the first description given.
+        Returns a list of (session_id, [(set_id, [tune_id, ...]), ...]) in the order the sessions were given,
+        the same ids create_session, read_or_create_set and get_id_or_create_tune would have returned.
+        """
+        sessions = list(sessions)
+        tune_rows = dict()
+        set_rows = dict()
+        session_rows = list()
+        for key, (location_id, session_date, start_time, end_time, description, sets) in enumerate(sessions):
+            session_rows.append({
+                "key": key,
+                "location_id": location_id,
+                "session_date": session_date,
+                "start_time": start_time,
+                "end_time": end_time,
+                "description": description})
+            for set_index, set_description, tunes in sets:
+                fingerprint = set_fingerprint(tune[0] for tune in tunes)
+                set_rows.setdefault(fingerprint, {"key": fingerprint, "fingerprint": fingerprint, "description": set_description})
+                for the_session_tune_id, tune_name, abc, tune_type, tune_meter, tune_mode, tune_url in tunes:
+                    tune_rows.setdefault(str(the_session_tune_id), {
+                        "key": str(the_session_tune_id),
+                        "the_session_tune_id": the_session_tune_id,
+                        "name": tune_name,
+                        "abc": abc,
+                        "tune_type": tune_type,
+                        "tune_meter": tune_meter,
+                        "tune_mode": tune_mode,
+                        "tune_url": tune_url})
+
+        tune_ids, set_ids, session_ids = self._write_nodes(
+            list(tune_rows.values()), list(set_rows.values()), session_rows, batch_size)
+
+        result = list()
+        set_to_session_rows = list()
+        tune_to_set_rows = list()
+        plays = list()
+        for key, (_, session_date, _, _, _, sets) in enumerate(sessions):
+            session_id = session_ids[key]
+            session_sets = list()
+            for set_index, set_description, tunes in sets:
+                set_id = set_ids[set_fingerprint(tune[0] for tune in tunes)]
+                set_to_session_rows.append({"session_id": session_id, "set_id": set_id, "set_index": set_index})
+                set_tune_ids = list()
+                # 1 based to match create_tune_to_set in scrape.main
+                for tune_index, tune in enumerate(tunes, start=1):
+                    tune_id = tune_ids[str(tune[0])]
+                    tune_to_set_rows.append({"tune_id": tune_id, "set_id": set_id, "tune_index": tune_index})
+                    set_tune_ids.append(tune_id)
+                session_sets.append((set_id, set_tune_ids))
+                plays.append((session_date, set_id, set_tune_ids))
+            result.append((session_id, session_sets))
+
+        self._write_links(set_to_session_rows, tune_to_set_rows, batch_size)
+        self.increment_play_counts(plays, batch_size)
+        return result
+
+    def migrate_set_fingerprints(self, batch_size=500):
+        """
+        Give every set the fingerprint of its tunes and merge the sets that turn out to be the same,
+        their sessions move to the one set kept and the play counts are rebuilt.
+        The kept set is the one that already has the fingerprint, otherwise the lowest set_id.
+        Returns (fingerprints written, sets merged away).
+        """
+        by_fingerprint = collections.defaultdict(list)
+        stored = dict()
+        for set_id, (stored_fingerprint, the_session_tune_ids) in self._read_set_tune_ids().items():
+            stored[set_id] = stored_fingerprint
+            by_fingerprint[set_fingerprint(the_session_tune_ids)].append(set_id)
+
+        merge_rows = list()
+        fingerprint_rows = list()
+        for fingerprint, set_ids in by_fingerprint.items():
+            keep = min(set_ids, key=lambda set_id: (stored[set_id] != fingerprint, set_id))
+            merge_rows.extend({"set_id": set_id, "keep": keep} for set_id in set_ids if set_id != keep)
+            if stored[keep] != fingerprint:
+                fingerprint_rows.append({"set_id": keep, "fingerprint": fingerprint})
+
+        # Merge first so no two sets ever hold the same fingerprint under the uniqueness constraint
+        self._merge_sets(merge_rows, batch_size)
+        self._write_set_fingerprints(fingerprint_rows, batch_size)
+        if merge_rows:
+            self.rebuild_play_counts(batch_size)
+        return len(fingerprint_rows), len(merge_rows)
+
+    # Play counts are kept per tune and per set in 'day' buckets (period 'YYYY-MM-DD') and
+    # 'month' buckets (period 'YYYY-MM') so a date range report sums a few rows instead of joining all history.
+    @staticmethod
+    def _play_count_rows(counts):
+        """Rows for the play count writes from a Counter of (id, 'YYYY-MM-DD') : plays"""
+        totals = collections.Counter()
+        for (item_id, session_date), count in counts.items():
+            totals[(item_id, 'day', session_date)] += count
+            totals[(item_id, 'month', session_date[:7])] += count
+        return [
+            {"id": item_id, "bucket": bucket, "period": period, "count": count}
+            for (item_id, bucket, period), count in totals.items()]
+
+    def increment_play_counts(self, plays, batch_size=500):
+        """
+        Add plays to the play count aggregates.
+        plays is an iterable of (session_date, set_id, tune_ids) with one entry per set played in a session,
+        session_date is 'YYYY-MM-DD' and a tune that appears twice in the set is counted twice, like the report joins do.
+        """
+        tune_counts = collections.Counter()
+        set_counts = collections.Counter()
+        for session_date, set_id, tune_ids in plays:
+            set_counts[(set_id, session_date)] += 1
+            for tune_id in tune_ids:
+                tune_counts[(tune_id, session_date)] += 1
+        self._add_play_counts(self._play_count_rows(tune_counts), self._play_count_rows(set_counts), batch_size)
+
+    @staticmethod
+    def range_buckets(start_date, end_date):
+        """
+        The fewest (bucket, period) pairs that exactly cover start_date to end_date inclusive,
+        whole months as 'month' buckets and the partial months at either end as 'day' buckets.
+        """
+        start_date = datetime.date.fromisoformat(str(start_date))
+        end_date = datetime.date.fromisoformat(str(end_date))
+        buckets = list()
+        day = start_date
+        while day <= end_date:
+            month_start = day.replace(day=1)
+            next_month = (month_start + datetime.timedelta(days=32)).replace(day=1)
+            if day == month_start and next_month - datetime.timedelta(days=1) <= end_date:
+                buckets.append(("month", day.strftime('%Y-%m')))
+                day = next_month
+            else:
+                buckets.append(("day", day.isoformat()))
+                day += datetime.timedelta(days=1)
+        return buckets
+
+    def rebuild_play_counts(self, batch_size=500):
+        """Throw the aggregates away and recompute them from the stored sessions."""
+        tune_rows = self._play_count_rows(self._read_live_play_counts("TunePlayCount"))
+        set_rows = self._play_count_rows(self._read_live_play_counts("SetPlayCount"))
+        self._replace_play_counts(tune_rows, set_rows, batch_size)
+
+    def check_play_counts(self):
+        """
+        Compare every aggregate with the live join.
+        Returns a list of (label, id, bucket, period, aggregate_count, live_count) for the ones that differ.
+        """
+        mismatches = list()
+        for label in ("TunePlayCount", "SetPlayCount"):
+            live = {
+                (row["id"], row["bucket"], row["period"]): row["count"]
+                for row in self._play_count_rows(self._read_live_play_counts(label))}
+            stored = self._read_stored_play_counts(label)
+            for key in sorted(set(live) | set(stored), key=str):
+                if live.get(key, 0) != stored.get(key, 0):
+                    mismatches.append((label, *key, stored.get(key, 0), live.get(key, 0)))
+        return mismatches
@@ -0,0 +1,397 @@
+#!python3
+r""" session_logger.py - log the tunes of a session live from a recording
+
+Audio is read in fixed size chunks from a WAV file or stdin and turned into chroma frames as it arrives.
+The last --window seconds are kept in a ring buffer and matched against the recognition.py fingerprints
+every --step seconds. A tune is confirmed after --confirm matches in a row agree, and a set ends when
+nothing matches for --set_gap seconds. With --write each finished set is stored through SessionDataManager.
+Memory and the work per chunk do not depend on the length of the recording.
+
+    py session_logger.py --wav_file session.wav
+    arecord -f S16_LE -r 22050 -c 1 | py session_logger.py --wav_file - --write --backend sqlite
+
+Dependencies
+    py -m pip install numpy scipy librosa
+
+"""
+import argparse
+import datetime
+import pathlib
+import re
+import sys
+import time
+import wave
+import librosa
+import numpy
+import SessionDataManager
+from session_backend import set_fingerprint
+from recognition import FingerprintStore, frames_per_second, normalise_frames
+
+
+def pcm_chunks(wav_reader, chunk_frames):
+    """Mono float32 chunks of chunk_frames samples from an open wave reader, the last may be shorter"""
+    channels = wav_reader.getnchannels()
+    sample_width = wav_reader.getsampwidth()
+    if sample_width != 2:
+        raise ValueError(f"Expected 16 bit PCM, got {8 * sample_width} bit")
+    while True:
+        data = wav_reader.readframes(chunk_frames)
+        if not data:
+            return
+        samples = numpy.frombuffer(data, dtype=numpy.int16).reshape(-1, channels)
+        yield samples.mean(axis=1, dtype=numpy.float32) / 32768
+
+
+class ChromaStream:
+    """
+    Chroma frames of a stream of sample chunks, the same analysis recognition.audio_chroma does,
+    but with the window overlap carried from one chunk to the next so chunk boundaries do not show.
+    """
+    def __init__(self, sample_rate, fps=frames_per_second):
+        self.hop_length = sample_rate // fps
+        self.n_fft = 4 * self.hop_length
+        self.window = numpy.hanning(self.n_fft).astype(numpy.float32)
+        self.filters = librosa.filters.chroma(sr=sample_rate, n_fft=self.n_fft).astype(numpy.float32)
+        self.carry = numpy.zeros(0, dtype=numpy.float32)
+
+    def frames(self, chunk):
+        """(frames, 12) chroma of every whole window that ends in chunk"""
+        samples = numpy.concatenate((self.carry, chunk))
+        count = max(0, (len(samples) - self.n_fft) // self.hop_length + 1)
+        self.carry = samples[count * self.hop_length:]
+        if not count:
+            return numpy.zeros((0, 12), dtype=numpy.float32)
+        windows = numpy.lib.stride_tricks.sliding_window_view(samples, self.n_fft)[::self.hop_length][:count]
+        power = numpy.abs(numpy.fft.rfft(windows * self.window, axis=1)) ** 2
+        return (power @ self.filters.T).astype(numpy.float32)
+
+
+class TuneTracker:
+    """
+    Turns a match every step into tune and set events, all times in seconds into the recording
+        ('tune_start', seconds, tune_key, score)
+        ('tune_end', seconds, tune_key)
+        ('set_end', seconds, [tune_key, ...])
+    """
+    def __init__(self, min_score=0.6, confirm=3, set_gap_seconds=20.0):
+        self.min_score = min_score
+        self.confirm = confirm
+        self.set_gap_seconds = set_gap_seconds
+        self.current = None  # confirmed tune key
+        self.last_seen = 0.0  # last time the confirmed tune matched
+        self.candidate = None
+        self.candidate_since = 0.0
+        self.candidate_count = 0
+        self.set_tunes = list()
+
+    def update(self, seconds, results):
+        """results is FingerprintStore.match output for the window ending at seconds, returns the events"""
+        events = list()
+        key, score = (results[0][0], results[0][1]) if results else (None, 0.0)
+        if score < self.min_score:
+            key = None
+
+        if key is not None and key == self.current:
+            self.last_seen = seconds
+            self.candidate = None
+        elif key is not None:
+            if key != self.candidate:
+                self.candidate, self.candidate_since, self.candidate_count = key, seconds, 0
+            self.candidate_count += 1
+            if self.candidate_count >= self.confirm:
+                if self.current is not None:
+                    events.append(('tune_end', self.candidate_since, self.current))
+                events.append(('tune_start', self.candidate_since, key, score))
+                self.current, self.last_seen, self.candidate = key, seconds, None
+                self.set_tunes.append(key)
+        else:
+            # Matches must agree in a row, a window without one starts the count again
+            self.candidate, self.candidate_count = None, 0
+            if self.current is not None and seconds - self.last_seen >= self.set_gap_seconds:
+                events.extend(self.finish())
+        return events
+
+    def finish(self):
+        """Close the tune and set in progress, at the end of the recording or after a long gap"""
+        events = list()
+        if self.current is not None:
+            events.append(('tune_end', self.last_seen, self.current))
+        if self.set_tunes:
+            events.append(('set_end', self.last_seen, self.set_tunes))
+        self.current, self.candidate, self.set_tunes = None, None, list()
+        return events
+
+
+def stream_events(chunks, sample_rate, store, window_seconds=8.0, step_seconds=2.0, tracker=None, stats=None):
+    """
+    Yields tune and set events (see TuneTracker) from an iterable of mono sample chunks.
+    Only the window ring buffer and one chunk are ever held. stats, a dict, collects chunk count and latencies.
+    """
+    tracker = tracker or TuneTracker()
+    stats = stats if stats is not None else dict()
+    stats.setdefault("chunks", 0)
+    stats.setdefault("max_chunk_seconds", 0.0)
+    stats.setdefault("match_seconds", 0.0)
+    chroma_stream = ChromaStream(sample_rate)
+    window_frames = int(window_seconds * frames_per_second)
+    step_frames = max(int(step_seconds * frames_per_second), 1)
+    ring = numpy.zeros((window_frames, 12), dtype=numpy.float32)
+    filled = 0  # frames in the ring, up to window_frames
+    frame_count = 0
+    since_match = 0
+    for chunk in chunks:
+        start = time.perf_counter()
+        events = list()
+        for frame in chroma_stream.frames(chunk):
+            ring[frame_count % window_frames] = frame
+            frame_count += 1
+            filled = min(filled + 1, window_frames)
+            since_match += 1
+            if since_match < step_frames or filled < window_frames:
+                continue
+            since_match = 0
+            oldest = frame_count % window_frames
+            window = numpy.concatenate((ring[oldest:], ring[:oldest]))
+            match_start = time.perf_counter()
+            results, _ = store.match(normalise_frames(window), 1)
+            stats["match_seconds"] += time.perf_counter() - match_start
+            events.extend(tracker.update(frame_count / frames_per_second, results))
+        stats["chunks"] += 1
+        stats["max_chunk_seconds"] = max(stats["max_chunk_seconds"], time.perf_counter() - start)
+        yield from events
+    stats["audio_seconds"] = frame_count / frames_per_second
+    yield from tracker.finish()
+
+
+def session_times(session_date, start_time, recorded_seconds):
+    """
+    (start_time, end_time, description) of a session recorded from start_time ('HH:MM:SS') on session_date for recorded_seconds.
+    A session has no end date, so one recorded past midnight ends at 23:59:59 and its description says when it really ended.
+    """
+    start = datetime.datetime.strptime(f"{session_date} {start_time}", '%Y-%m-%d %H:%M:%S')
+    end = start + datetime.timedelta(seconds=recorded_seconds)
+    if end.date() == start.date():
+        return start_time, end.strftime('%H:%M:%S'), ""
+    return start_time, "23:59:59", f"Recorded until {end.strftime('%Y-%m-%d %H:%M:%S')}"
+
+
+re_leading_tune_id = re.compile(r'(\d+)\b')
+
+
+class SetWriter:
+    """
+    Stores finished sets through SessionDataManager, flush_sets at a time, creating the session with the first.
+    The tunes of a set are fingerprint store keys, TheSession tune ids for a store built from TheSession-data,
+    MIDI file names for one built with --midi_dir. Names are resolved to the TheSession tune id they start with
+    or the tune they name, and tunes that resolve to nothing are left out of the set rather than stored as some other tune.
+    The session ends recorded_seconds after start_time, as far as the recording has got; a stream's length is
+    not known up front, so every set moves the end on and close stores the end of the whole recording.
+    """
+    def __init__(self, sdm, location_id, session_date, start_time, recorded_seconds=0.0, flush_sets=1):
+        self.sdm = sdm
+        self.location_id = location_id
+        self.session_date = session_date
+        self.start_time = start_time
+        self.recorded_seconds = recorded_seconds
+        self.flush_sets = flush_sets
+        self.session_id = None
+        self.stored_end = None  # (end_time, description) the session was last stored with
+        self.set_index = 0
+        self.pending = list()
+        self.tune_ids = dict()  # store key : TheSession tune id or None
+
+    def the_session_tune_id(self, key):
+        """The TheSession tune id a fingerprint store key stands for, None when it is no TheSession tune"""
+        key = str(key)
+        if key not in self.tune_ids:
+            match = re_leading_tune_id.match(key)
+            if match and self.sdm.the_session_tunes.name(match.group(1)):
+                tune_id = match.group(1)
+            else:
+                tune_id = self.sdm.the_session_tunes.tune_id_by_name(re.sub(r'[-_]+', ' ', key).strip())
+            if tune_id is None:
+                print(f"{key} is not a TheSession tune, left out of the stored set")
+            self.tune_ids[key] = tune_id
+        return self.tune_ids[key]
+
+    def add(self, tune_keys, seconds=0.0):
+        """A set that ended seconds into the recording"""
+        self.recorded_seconds = max(self.recorded_seconds, seconds)
+        self.pending.append(tune_keys)
+        if len(self.pending) >= self.flush_sets:
+            self.flush()
+
+    def close(self, recorded_seconds=0.0):
+        """Stores the sets still pending and ends the session recorded_seconds into the recording"""
+        self.recorded_seconds = max(self.recorded_seconds, recorded_seconds)
+        self.flush()
+
+    def _store_end(self):
+        _, end_time, description = session_times(self.session_date, self.start_time, self.recorded_seconds)
+        if self.session_id is None:
+            self.session_id = self.sdm.create_session(
+                self.location_id, self.session_date, self.start_time, end_time, description)
+        elif (end_time, description) != self.stored_end:
+            self.sdm.update_session_end(self.session_id, end_time, description)
+        self.stored_end = (end_time, description)
+
+    def flush(self):
+        if self.session_id is not None:
+            self._store_end()
+        if not self.pending:
+            return
+        sets = [[tune_id for tune_id in map(self.the_session_tune_id, tune_keys) if tune_id is not None]
+                for tune_keys in self.pending]
+        sets = [the_session_tune_ids for the_session_tune_ids in sets if the_session_tune_ids]
+        self.pending = list()
+        if not sets:
+            return
+        if self.session_id is None:
+            self._store_end()
+        self.sdm.prefetch_tunes_from_TheSession(tune_id for the_session_tune_ids in sets for tune_id in the_session_tune_ids)
+        plays = list()
+        for the_session_tune_ids in sets:
+            self.set_index += 1
+            names = [self.sdm.the_session_tunes.name(tune_id) for tune_id in the_session_tune_ids]
+            set_id = self.sdm.read_or_create_set(', '.join(names), set_fingerprint(the_session_tune_ids))
+            self.sdm.create_set_to_session(self.session_id, set_id, self.set_index)
+            set_tune_ids = list()
+            for tune_number_in_set, (the_session_tune_id, name) in enumerate(zip(the_session_tune_ids, names), start=1):
+                abc, tune_type, tune_meter, tune_mode = self.sdm.get_tune_from_TheSession(the_session_tune_id)
+                tune_id = self.sdm.get_id_or_create_tune(
+                    the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode,
+                    f"https://thesession.org/tunes/{the_session_tune_id}")
+                self.sdm.create_tune_to_set(tune_id, set_id, tune_number_in_set)
+                set_tune_ids.append(tune_id)
+            plays.append((self.session_date, set_id, set_tune_ids))
+        self.sdm.increment_play_counts(plays)
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    code_root = repo_root.parent
+    now = datetime.datetime.now()
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--wav_file",
+        type=str,
+        default="-",
+        help="16 bit PCM WAV recording, - reads it from stdin")
+    parser.add_argument(
+        "--store_dir",
+        type=pathlib.Path,
+        default=repo_root / "fingerprints",
+        help="Directory of the recognition.py fingerprint matrix")
+    parser.add_argument(
+        "--chunk_seconds",
+        type=float,
+        default=0.5,
+        help="Seconds of audio read at a time")
+    parser.add_argument(
+        "--window",
+        type=float,
+        default=8.0,
+        help="Seconds of audio each match looks at")
+    parser.add_argument(
+        "--step",
+        type=float,
+        default=2.0,
+        help="Seconds between matches")
+    parser.add_argument(
+        "--min_score",
+        type=float,
+        default=0.6,
+        help="Matches scoring below this count as no tune")
+    parser.add_argument(
+        "--confirm",
+        type=int,
+        default=3,
+        help="Matches in a row that must agree before a new tune is logged")
+    parser.add_argument(
+        "--set_gap",
+        type=float,
+        default=20.0,
+        help="Seconds without a match that end a set")
+    parser.add_argument(
+        '--write',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Store the sets found, otherwise they are only printed")
+    parser.add_argument(
+        "--flush_sets",
+        type=int,
+        default=1,
+        help="Sets stored per write")
+    SessionDataManager.add_backend_arguments(parser, repo_root)
+    parser.add_argument(
+        "--session_db",
+        type=pathlib.Path,
+        default=code_root / "TheSession-data" / "thesession.db",
+        help="Filepath of the TheSession-data sqlite file")
+    parser.add_argument(
+        "--location_id",
+        type=int,
+        default=1,
+        help="Location of the session")
+    parser.add_argument(
+        "--session_date",
+        type=str,
+        default=now.strftime('%Y-%m-%d'),
+        help="Date of the session")
+    parser.add_argument(
+        "--start_time",
+        type=str,
+        default=now.strftime('%H:%M:%S'),
+        help="Time the recording started")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    store = FingerprintStore(args.store_dir, max_clip_seconds=args.window)
+    tracker = TuneTracker(args.min_score, args.confirm, args.set_gap)
+    sdm = None
+    if args.write:
+        sdm = SessionDataManager.SessionDataManager(
+            args.session_db, False, backend=args.backend, db_file=args.db_file, schema_file=args.schema_file)
+
+    stats = dict()
+    start = time.perf_counter()
+    with wave.open(sys.stdin.buffer if args.wav_file == "-" else args.wav_file, 'rb') as wav_reader:
+        sample_rate = wav_reader.getframerate()
+        writer = None
+        if sdm is not None:
+            # The end of a stream is not known up front, a file's is, the writer moves it on as the stream goes
+            recorded_seconds = wav_reader.getnframes() / sample_rate if args.wav_file != "-" else 0.0
+            writer = SetWriter(sdm, args.location_id, args.session_date, args.start_time, recorded_seconds, args.flush_sets)
+        chunks = pcm_chunks(wav_reader, int(args.chunk_seconds * sample_rate))
+        for event in stream_events(chunks, sample_rate, store, args.window, args.step, tracker, stats):
+            if event[0] == 'tune_start':
+                print(f"{event[1]:8.1f}s  start {event[2]} score {event[3]:.2f}")
+            elif event[0] == 'tune_end':
+                print(f"{event[1]:8.1f}s  end   {event[2]}")
+            else:
+                print(f"{event[1]:8.1f}s  set   {', '.join(event[2])}")
+                if writer is not None:
+                    writer.add(event[2], event[1])
+        if writer is not None:
+            writer.close(stats.get("audio_seconds", 0.0))
+    if sdm is not None:
+        sdm.close()
+
+    elapsed = time.perf_counter() - start
+    audio_seconds = stats.get("audio_seconds", 0.0)
+    print(f"{audio_seconds:.0f}s of audio in {elapsed:.1f}s ({audio_seconds / max(elapsed, 1e-9):.1f}x real time), "
+          f"{stats['chunks']} chunks, slowest chunk {stats['max_chunk_seconds'] * 1000:.0f}ms, "
+          f"matching {stats['match_seconds']:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
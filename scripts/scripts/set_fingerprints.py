@@ -0,0 +1,69 @@
+#!python3
+r""" set_fingerprints.py - give stored sets their fingerprint and merge the duplicates
+
+Sets are identified by session_backend.set_fingerprint, a hash of their TheSession tune ids in order,
+instead of their comma joined tune names. Sets stored before that have no fingerprint, and the same
+tunes stored under differently spelt names are separate sets.
+--migrate fingerprints every set from its tunes, moves the sessions of duplicate sets to one of them,
+deletes the others and rebuilds the play counts,
+--check fails if any set still has no fingerprint.
+
+"""
+import argparse
+import pathlib
+import sys
+import SessionDataManager
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    code_root = repo_root.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--session_db",
+        type=pathlib.Path,
+        default=code_root / "TheSession-data" / "thesession.db",
+        help="Filepath of the TheSession-data sqlite file")
+    SessionDataManager.add_backend_arguments(parser, repo_root)
+    parser.add_argument(
+        '--migrate',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Backfill the fingerprints and merge duplicate sets")
+    parser.add_argument(
+        '--check',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Fail if any set has no fingerprint")
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=500,
+        help="Rows per transaction")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    with SessionDataManager.SessionDataManager(
+            args.session_db, initialize_db=False, backend=args.backend, db_file=args.db_file, schema_file=args.schema_file) as sdm:
+        if args.migrate:
+            fingerprinted, merged = sdm.migrate_set_fingerprints(args.batch_size)
+            print(f"Fingerprinted {fingerprinted} sets, merged {merged} duplicate sets")
+
+        if args.check:
+            missing = sdm.count_sets_without_fingerprint()
+            print(f"{missing} sets have no fingerprint")
+            if missing:
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,285 @@
+#!python3
+r""" similarity.py - find tunes with a similar melody to an ABC fragment
+
+Each tune's melody is reduced to diatonic steps between consecutive notes, which do not change
+when a tune is transposed or played in another key. Overlapping n-grams of those intervals and of the
+up/down/same contour are the features, stored in an inverted index of NumPy arrays
+(sorted feature ids, posting offsets, postings) that is memory mapped at query time,
+so a query only touches the postings of its own features instead of scanning every tune.
+
+New tunes are added as extra segments, --compact merges them back into one.
+
+    py similarity.py --build                           index every setting in TheSession-data
+    py similarity.py --update                          index only tunes added since
+    py similarity.py --query "|:d2e f2g|gfe dBA|"
+
+Dependencies
+    py -m pip install numpy
+
+"""
+import argparse
+import collections
+import json
+import pathlib
+import re
+import shutil
+import sqlite3
+import sys
+import time
+import numpy
+
+
+re_abc_header = re.compile(r'^[A-Za-z]:.*$', re.MULTILINE)
+re_abc_noise = re.compile(r'"[^"]*"|![^!]*!|\+[^+\s]*\+|%.*$|\[[A-Za-z]:[^\]]*\]', re.MULTILINE)
+re_abc_note = re.compile(r"[_^=]*([A-Ga-g])([',]*)")
+letter_steps = {letter: step for step, letter in enumerate("CDEFGAB")}
+
+interval_gram_length = 4
+contour_gram_length = 6
+max_interval = 9
+contour_namespace = 1 << 40
+
+
+def abc_steps(abc):
+    """Diatonic step number of every note in the ABC body, middle C (ABC `C`) is 0 and `c` above it 7"""
+    body = re_abc_noise.sub(' ', re_abc_header.sub(' ', abc))
+    steps = list()
+    for letter, octave_marks in re_abc_note.findall(body):
+        step = letter_steps[letter.upper()] + (7 if letter.islower() else 0)
+        step += 7 * (octave_marks.count("'") - octave_marks.count(","))
+        steps.append(step)
+    return numpy.asarray(steps, dtype=numpy.int64)
+
+
+def melody_features(abc):
+    """Sorted unique feature ids of a melody, interval n-grams and contour n-grams"""
+    steps = abc_steps(abc)
+    if len(steps) < 2:
+        return numpy.empty(0, dtype=numpy.int64)
+    intervals = numpy.clip(numpy.diff(steps), -max_interval, max_interval) + max_interval
+    contour = numpy.sign(numpy.diff(steps)) + 1
+    features = list()
+    if len(intervals) >= interval_gram_length:
+        windows = numpy.lib.stride_tricks.sliding_window_view(intervals, interval_gram_length)
+        features.append(windows @ (32 ** numpy.arange(interval_gram_length, dtype=numpy.int64)))
+    if len(contour) >= contour_gram_length:
+        windows = numpy.lib.stride_tricks.sliding_window_view(contour, contour_gram_length)
+        features.append(contour_namespace + windows @ (3 ** numpy.arange(contour_gram_length, dtype=numpy.int64)))
+    if not features:
+        return numpy.empty(0, dtype=numpy.int64)
+    return numpy.unique(numpy.concatenate(features))
+
+
+class Segment:
+    """One immutable piece of the index, a CSR style inverted index over its own tunes"""
+    def __init__(self, segment_dir):
+        self.segment_dir = pathlib.Path(segment_dir)
+        self.features = numpy.load(self.segment_dir / "features.npy", mmap_mode='r')
+        self.offsets = numpy.load(self.segment_dir / "offsets.npy", mmap_mode='r')
+        self.postings = numpy.load(self.segment_dir / "postings.npy", mmap_mode='r')
+        self.sizes = numpy.load(self.segment_dir / "sizes.npy", mmap_mode='r')
+        with (self.segment_dir / "keys.json").open('r', encoding='utf-8') as f:
+            self.keys = json.load(f)
+
+    @classmethod
+    def write(cls, segment_dir, tunes):
+        """tunes is an iterable of (key, abc), returns the number of tunes written"""
+        keys = list()
+        feature_arrays = list()
+        for key, abc in tunes:
+            keys.append(str(key))
+            feature_arrays.append(melody_features(abc or ""))
+        sizes = numpy.asarray([len(features) for features in feature_arrays], dtype=numpy.int32)
+        features = numpy.concatenate(feature_arrays) if feature_arrays else numpy.empty(0, dtype=numpy.int64)
+        tunes = numpy.repeat(numpy.arange(len(keys), dtype=numpy.int32), sizes)
+        cls.write_arrays(segment_dir, keys, features, tunes, sizes)
+        return len(keys)
+
+    @staticmethod
+    def write_arrays(segment_dir, keys, features, tunes, sizes):
+        """features[i] is a feature of tune number tunes[i], sizes is the feature count of each tune"""
+        order = numpy.lexsort((tunes, features))
+        features = features[order]
+        unique_features, starts = numpy.unique(features, return_index=True)
+        offsets = numpy.append(starts, len(features)).astype(numpy.int64)
+
+        segment_dir = pathlib.Path(segment_dir)
+        segment_dir.mkdir(parents=True)
+        numpy.save(segment_dir / "features.npy", unique_features.astype(numpy.int64))
+        numpy.save(segment_dir / "offsets.npy", offsets)
+        numpy.save(segment_dir / "postings.npy", tunes[order].astype(numpy.int32))
+        numpy.save(segment_dir / "sizes.npy", numpy.asarray(sizes, dtype=numpy.int32))
+        with (segment_dir / "keys.json").open('w', encoding='utf-8') as f:
+            json.dump(keys, f)
+
+    def posting_lists(self, query_features):
+        """(positions, postings) for the query features present in this segment"""
+        positions = numpy.searchsorted(self.features, query_features)
+        present = positions < len(self.features)
+        positions = positions[present]
+        positions = positions[self.features[positions] == query_features[present]]
+        return positions, [self.postings[self.offsets[position]:self.offsets[position + 1]] for position in positions]
+
+
+class TuneSimilarityIndex:
+    def __init__(self, index_dir):
+        self.index_dir = pathlib.Path(index_dir)
+        self.segments = [Segment(segment_dir) for segment_dir in sorted(self.index_dir.glob("segment-*"))]
+
+    def __len__(self):
+        return sum(len(segment.keys) for segment in self.segments)
+
+    def keys(self):
+        return {key for segment in self.segments for key in segment.keys}
+
+    def _next_segment_dir(self):
+        number = max((int(segment.segment_dir.name.split("-")[1]) for segment in self.segments), default=-1) + 1
+        return self.index_dir / f"segment-{number:05d}"
+
+    def add(self, tunes):
+        """Index tunes, an iterable of (key, abc), as a new segment. Returns the number added."""
+        segment_dir = self._next_segment_dir()
+        added = Segment.write(segment_dir, tunes)
+        if added:
+            self.segments.append(Segment(segment_dir))
+        else:
+            shutil.rmtree(segment_dir)
+        return added
+
+    def compact(self):
+        """Merge every segment into one, straight from the postings since the ABC is not kept"""
+        if len(self.segments) < 2:
+            return
+        keys = list()
+        features = list()
+        tunes = list()
+        sizes = list()
+        for segment in self.segments:
+            features.append(numpy.repeat(numpy.asarray(segment.features), numpy.diff(segment.offsets)))
+            tunes.append(numpy.asarray(segment.postings) + len(keys))
+            sizes.append(numpy.asarray(segment.sizes))
+            keys.extend(segment.keys)
+        segment_dir = self._next_segment_dir()
+        Segment.write_arrays(segment_dir, keys, numpy.concatenate(features), numpy.concatenate(tunes), numpy.concatenate(sizes))
+        for segment in self.segments:
+            shutil.rmtree(segment.segment_dir)
+        self.segments = [Segment(segment_dir)]
+
+    def query(self, abc_fragment, k=10):
+        """
+        The k tunes most similar to the fragment as [(key, score), ...], best first.
+        A tune scores the idf weighted sum of the features it shares with the fragment,
+        divided by the square root of its feature count so long tunes do not win by size alone.
+        """
+        query_features = melody_features(abc_fragment)
+        if not len(query_features) or not self.segments:
+            return []
+        found = [segment.posting_lists(query_features) for segment in self.segments]
+        document_frequency = collections.Counter()
+        for segment, (positions, posting_lists) in zip(self.segments, found):
+            for position, postings in zip(positions, posting_lists):
+                document_frequency[int(segment.features[position])] += len(postings)
+
+        total = len(self)
+        best = list()
+        for segment, (positions, posting_lists) in zip(self.segments, found):
+            if not posting_lists:
+                continue
+            idf = numpy.log1p(total / numpy.asarray([document_frequency[int(segment.features[position])] for position in positions]))
+            lengths = numpy.asarray([len(postings) for postings in posting_lists])
+            scores = numpy.bincount(
+                numpy.concatenate(posting_lists),
+                weights=numpy.repeat(idf, lengths),
+                minlength=len(segment.keys))
+            scores /= numpy.sqrt(numpy.maximum(segment.sizes, 1))
+            # Several settings can share a key, so keep a few extra before merging them
+            candidates = min(k * 4, len(scores))
+            top = numpy.argpartition(-scores, candidates - 1)[:candidates]
+            best.extend((segment.keys[tune], float(scores[tune])) for tune in top if scores[tune] > 0)
+        by_key = dict()
+        for key, score in best:
+            by_key[key] = max(score, by_key.get(key, 0.0))
+        return sorted(by_key.items(), key=lambda item: -item[1])[:k]
+
+
+def the_session_tunes(session_db, skip_keys=frozenset()):
+    """(tune_id, abc) of every setting in the TheSession-data file, tune ids in skip_keys left out"""
+    conn = sqlite3.connect(f"{pathlib.Path(session_db).resolve().as_uri()}?mode=ro", uri=True)
+    try:
+        for tune_id, abc in conn.execute("SELECT tune_id, abc FROM tunes ORDER BY rowid"):
+            if str(tune_id) not in skip_keys:
+                yield tune_id, abc
+    finally:
+        conn.close()
+
+
+def parse():
+    current_script_path = pathlib.Path(__file__).resolve()
+    repo_root = current_script_path.parent.parent.parent
+    code_root = repo_root.parent
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--session_db",
+        type=pathlib.Path,
+        default=code_root / "TheSession-data" / "thesession.db",
+        help="Filepath of the TheSession-data sqlite file")
+    parser.add_argument(
+        "--index_dir",
+        type=pathlib.Path,
+        default=repo_root / "similarity_index",
+        help="Directory of the similarity index")
+    parser.add_argument(
+        '--build',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Rebuild the index from every setting in TheSession-data")
+    parser.add_argument(
+        '--update',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Add the TheSession-data tunes that are not indexed yet as a new segment")
+    parser.add_argument(
+        '--compact',
+        default=False,
+        action=argparse.BooleanOptionalAction,
+        help="Merge the index segments into one")
+    parser.add_argument(
+        "--query",
+        type=str,
+        help="ABC fragment to find similar tunes for")
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help="Number of similar tunes to list")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    if args.build and args.index_dir.exists():
+        shutil.rmtree(args.index_dir)
+    index = TuneSimilarityIndex(args.index_dir)
+    if args.build or args.update:
+        start = time.perf_counter()
+        added = index.add(the_session_tunes(args.session_db, index.keys()))
+        print(f"Indexed {added} settings in {time.perf_counter() - start:.1f}s, {len(index)} in the index")
+    if args.compact:
+        index.compact()
+
+    if args.query:
+        start = time.perf_counter()
+        results = index.query(args.query, args.top)
+        print(f"{len(results)} similar tunes in {(time.perf_counter() - start) * 1000:.1f}ms")
+        for key, score in results:
+            print(f"{score:8.3f} https://thesession.org/tunes/{key}")
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
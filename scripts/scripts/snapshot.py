@@ -0,0 +1,192 @@
+#!python3
+r""" snapshot.py - save crawled pages to one compressed file and read them back without the network
+
+A snapshot is an append-only file of page records followed by an index:
+
+    header      b"CEOLSNAP" version
+    record      b"PAGE" url length, body length, url, zlib compressed body     (repeated)
+    index       b"INDX" 0, index length, zlib compressed JSON {url: [offset, length]}
+    trailer     index offset, b"CEOLEND1"
+
+Every page is compressed on its own so SnapshotReader can mmap the file and decompress just the page
+asked for. A writer reopening a snapshot drops the old index and trailer, appends its pages after the
+last record and writes a new index holding the old and new pages, a url fetched again points at its
+newest record. A snapshot whose writer never closed has no trailer, its index is rebuilt by walking the records.
+
+"""
+import argparse
+import json
+import mmap
+import os
+import pathlib
+import struct
+import sys
+import threading
+import zlib
+
+
+magic = b"CEOLSNAP"
+version = 1
+end_magic = b"CEOLEND1"
+header_format = struct.Struct("<8sI")
+record_format = struct.Struct("<4sII")  # kind, url length, body length
+trailer_format = struct.Struct("<Q8s")  # index offset, end_magic
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def read_index(data):
+    """{url: (offset, length)} of the pages in the snapshot bytes data, and the offset where the next record goes"""
+    if len(data) < header_format.size or header_format.unpack_from(data)[0] != magic:
+        raise SnapshotError("Not a snapshot file")
+    if len(data) >= header_format.size + trailer_format.size:
+        index_offset, trailer_magic = trailer_format.unpack_from(data, len(data) - trailer_format.size)
+        if trailer_magic == end_magic:
+            kind, _, length = record_format.unpack_from(data, index_offset)
+            if kind != b"INDX":
+                raise SnapshotError(f"No index at offset {index_offset}")
+            start = index_offset + record_format.size
+            pages = json.loads(zlib.decompress(data[start:start + length]))
+            return {url: tuple(location) for url, location in pages.items()}, index_offset
+
+    # Interrupted writer, keep every complete record
+    pages = dict()
+    offset = header_format.size
+    while offset + record_format.size <= len(data):
+        kind, url_length, length = record_format.unpack_from(data, offset)
+        start = offset + record_format.size + url_length
+        if kind != b"PAGE" or start + length > len(data):
+            break
+        url = bytes(data[offset + record_format.size:start]).decode('utf-8')
+        pages[url] = (start, length)
+        offset = start + length
+    return pages, offset
+
+
+class SnapshotWriter:
+    """Appends pages to snapshot_file, creating it if needed. add is safe to call from the crawl's fetcher threads."""
+    def __init__(self, snapshot_file, level=6):
+        self.snapshot_file = pathlib.Path(snapshot_file)
+        self.level = level
+        self.lock = threading.Lock()
+        self.pages = dict()  # url : (offset, length)
+        if self.snapshot_file.exists() and self.snapshot_file.stat().st_size:
+            with self.snapshot_file.open('rb') as f:
+                self.pages, end = read_index(f.read())
+            self.file = self.snapshot_file.open('r+b')
+            self.file.truncate(end)
+            self.file.seek(end)
+        else:
+            self.file = self.snapshot_file.open('wb')
+            self.file.write(header_format.pack(magic, version))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, url, content):
+        body = zlib.compress(content, self.level)
+        encoded_url = url.encode('utf-8')
+        with self.lock:
+            offset = self.file.tell() + record_format.size + len(encoded_url)
+            self.file.write(record_format.pack(b"PAGE", len(encoded_url), len(body)) + encoded_url + body)
+            self.pages[url] = (offset, len(body))
+
+    def close(self):
+        if self.file.closed:
+            return
+        with self.lock:
+            index = zlib.compress(json.dumps(self.pages, separators=(',', ':')).encode('utf-8'), self.level)
+            index_offset = self.file.tell()
+            self.file.write(record_format.pack(b"INDX", 0, len(index)) + index)
+            self.file.write(trailer_format.pack(index_offset, end_magic))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+
+
+class SnapshotReader:
+    """Pages of a snapshot by url, read straight out of a shared read only mmap of the file"""
+    def __init__(self, snapshot_file):
+        self.snapshot_file = pathlib.Path(snapshot_file)
+        with self.snapshot_file.open('rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.pages, _ = read_index(self.map)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.map.close()
+
+    def __contains__(self, url):
+        return url in self.pages
+
+    def __len__(self):
+        return len(self.pages)
+
+    def urls(self):
+        return list(self.pages)
+
+    def read(self, url):
+        """The page content, None if url is not in the snapshot"""
+        location = self.pages.get(url)
+        if location is None:
+            return None
+        offset, length = location
+        return zlib.decompress(self.map[offset:offset + length])
+
+
+class RecordingHttp:
+    """
+    Wraps a requests style http, e.g. a fetcher.Fetcher, adding the body of every 200 response to writer.
+    Everything else, such as workers and map_ordered, is passed through.
+    """
+    def __init__(self, http, writer):
+        self.http = http
+        self.writer = writer
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+    def get(self, url, **kwargs):
+        response = self.http.get(url, **kwargs)
+        if response.status_code == 200:
+            self.writer.add(url, response.content)
+        return response
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--snapshot_file",
+        type=pathlib.Path,
+        required=True,
+        help="Snapshot to list the pages of")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    with SnapshotReader(args.snapshot_file) as reader:
+        stored = sum(length for offset, length in reader.pages.values())
+        for url, (offset, length) in reader.pages.items():
+            print(f"{offset:>12} {length:>9} {url}")
+        print(f"{len(reader)} pages, {stored} compressed bytes")
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,382 @@
+#!python3
+r""" sqlite_backend.py - session data in a local SQLite file with the init.sql schema
+
+Runs ingest and tests fully offline. The file is opened in WAL mode, batches are written with
+executemany inside one transaction, and the join columns init.sql leaves unindexed get indexes.
+
+"""
+import collections
+import json
+import sqlite3
+from session_backend import SessionBackend
+
+
+class SQLiteBackend(SessionBackend):
+    # Created on every open, on top of init.sql, so existing databases pick them up
+    support_schema = """
+        CREATE INDEX IF NOT EXISTS Session_session_date ON Session(session_date);
+        CREATE INDEX IF NOT EXISTS SetToSession_set_id ON SetToSession(set_id);
+        CREATE INDEX IF NOT EXISTS SetTable_description ON SetTable(description);
+        CREATE INDEX IF NOT EXISTS Tune_the_session_tune_id ON Tune(the_session_tune_id);
+        -- From index_advisor.py, the ingest NOT EXISTS probes seek on every column of the link row.
+        -- Each replaces a narrower index, dropped here so existing databases do not keep both
+        DROP INDEX IF EXISTS SetToSession_session_id;
+        CREATE INDEX IF NOT EXISTS SetToSession_session_id_set_index_set_id ON SetToSession(session_id, set_index, set_id);
+        DROP INDEX IF EXISTS TuneToSet_set_id;
+        CREATE INDEX IF NOT EXISTS TuneToSet_set_id_tune_index_tune_id ON TuneToSet(set_id, tune_index, tune_id);
+        DROP INDEX IF EXISTS TuneToSet_tune_id;
+        CREATE INDEX IF NOT EXISTS TuneToSet_tune_id_tune_index ON TuneToSet(tune_id, tune_index);
+        CREATE INDEX IF NOT EXISTS Tune_tune_mode ON Tune(tune_mode);
+        CREATE TABLE IF NOT EXISTS TunePlayCount (
+          tune_id INTEGER,
+          bucket TEXT,
+          period TEXT,
+          count INTEGER,
+          PRIMARY KEY (tune_id, bucket, period)
+        );
+        CREATE INDEX IF NOT EXISTS TunePlayCount_period ON TunePlayCount(bucket, period);
+        CREATE TABLE IF NOT EXISTS SetPlayCount (
+          set_id INTEGER,
+          bucket TEXT,
+          period TEXT,
+          count INTEGER,
+          PRIMARY KEY (set_id, bucket, period)
+        );
+        CREATE INDEX IF NOT EXISTS SetPlayCount_period ON SetPlayCount(bucket, period);
+    """
+    # Stay under SQLITE_MAX_VARIABLE_NUMBER on older sqlite builds
+    chunk_size = 900
+
+    def __init__(self, db_file, schema_file, initialize_db=True):
+        self.schema_file = schema_file
+        self.conn = sqlite3.connect(db_file)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        has_schema = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Session'").fetchone()
+        if initialize_db or not has_schema:
+            self.initialize_database()
+        set_columns = [row[1] for row in self.conn.execute("PRAGMA table_info(SetTable)")]
+        if "fingerprint" not in set_columns:
+            # Files created before sets had fingerprints, set_fingerprints.py --migrate fills them in.
+            # A column added later can not be UNIQUE, init.sql's constraint becomes an index
+            self.conn.execute("ALTER TABLE SetTable ADD COLUMN fingerprint VARCHAR(40)")
+            self.conn.execute("CREATE UNIQUE INDEX SetTable_fingerprint ON SetTable(fingerprint)")
+        self.conn.executescript(self.support_schema)
+
+    def close(self):
+        self.conn.close()
+
+    def initialize_database(self):
+        has_schema = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Session'").fetchone()
+        if not has_schema:
+            with open(self.schema_file, 'r') as f:
+                self.conn.executescript(f.read())
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO Location (location_id, description, address, url) VALUES (1, ?, ?, ?)",
+                ("B.D.Riley Thursday Session at Mueller in Austin, Texas.",
+                 "1905 Aldrich St #130, Austin, TX 78723",
+                 "https://bdrileys.com/"))
+
+    def create_session(self, location_id, session_date, start_time, end_time, description):
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO Session (location_id, session_date, start_time, end_time, description) VALUES (?, ?, ?, ?, ?)",
+                (location_id, session_date, start_time, end_time, description))
+            return cursor.lastrowid
+
+    def update_session_end(self, session_id, end_time, description):
+        with self.conn:
+            self.conn.execute(
+                "UPDATE Session SET end_time = ?, description = ? WHERE session_id = ?",
+                (end_time, description, session_id))
+
+    def create_location(self, description, address, url):
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO Location (description, address, url) VALUES (?, ?, ?)",
+                (description, address, url))
+            return cursor.lastrowid
+
+    def read_or_create_set(self, description, fingerprint):
+        with self.conn:
+            row = self.conn.execute("SELECT set_id FROM SetTable WHERE fingerprint = ?", (fingerprint,)).fetchone()
+            if row:
+                return row[0]
+            return self.conn.execute(
+                "INSERT INTO SetTable (description, fingerprint) VALUES (?, ?)", (description, fingerprint)).lastrowid
+
+    def create_tune(self, the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url):
+        with self.conn:
+            cursor = self.conn.execute(
+                "INSERT INTO Tune (the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url))
+            return cursor.lastrowid
+
+    def get_id_or_create_tune(self, the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url):
+        row = self.conn.execute("SELECT tune_id FROM Tune WHERE the_session_tune_id = ?", (the_session_tune_id,)).fetchone()
+        if row:
+            return row[0]
+        return self.create_tune(the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url)
+
+    _insert_set_to_session_query = (
+        "INSERT INTO SetToSession (session_id, set_id, set_index) "
+        "SELECT :session_id, :set_id, :set_index "
+        "WHERE NOT EXISTS (SELECT 1 FROM SetToSession "
+        "WHERE session_id = :session_id AND set_id = :set_id AND set_index = :set_index)"
+    )
+    _insert_tune_to_set_query = (
+        "INSERT INTO TuneToSet (tune_id, set_id, tune_index) "
+        "SELECT :tune_id, :set_id, :tune_index "
+        "WHERE NOT EXISTS (SELECT 1 FROM TuneToSet "
+        "WHERE tune_id = :tune_id AND set_id = :set_id AND tune_index = :tune_index)"
+    )
+
+    def create_set_to_session(self, session_id, set_id, set_index):
+        with self.conn:
+            self.conn.execute(
+                self._insert_set_to_session_query,
+                {"session_id": session_id, "set_id": set_id, "set_index": set_index})
+        return set_index
+
+    def create_tune_to_set(self, tune_id, set_id, tune_index):
+        with self.conn:
+            self.conn.execute(
+                self._insert_tune_to_set_query,
+                {"tune_id": tune_id, "set_id": set_id, "tune_index": tune_index})
+        return tune_index
+
+    def read_tune(self, tune_id):
+        row = self.conn.execute(
+            "SELECT tune_id, the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url "
+            "FROM Tune WHERE tune_id = ?", (tune_id,)).fetchone()
+        return tuple(row) if row else None
+
+    def read_tunes(self, tune_ids=None):
+        query = "SELECT tune_id, the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url FROM Tune"
+        if tune_ids is None:
+            return [tuple(row) for row in self.conn.execute(query + " ORDER BY tune_id")]
+        tune_ids = list(dict.fromkeys(tune_ids))
+        rows = list()
+        for start in range(0, len(tune_ids), self.chunk_size):
+            chunk = tune_ids[start:start + self.chunk_size]
+            placeholders = ", ".join("?" * len(chunk))
+            rows.extend(tuple(row) for row in self.conn.execute(f"{query} WHERE tune_id IN ({placeholders})", chunk))
+        return rows
+
+    def read_session_dates(self):
+        return {row[0] for row in self.conn.execute("SELECT DISTINCT substr(session_date, 1, 10) FROM Session")}
+
+    def read_set_tunes(self, set_id):
+        return [tuple(row) for row in self.conn.execute(
+            "SELECT t.tune_id, t.name, t.abc, t.tune_type, t.tune_meter, t.tune_mode "
+            "FROM TuneToSet tts JOIN Tune t ON t.tune_id = tts.tune_id "
+            "WHERE tts.set_id = ? ORDER BY tts.tune_index", (set_id,))]
+
+    def read_session_ids(self):
+        return {row[0] for row in self.conn.execute("SELECT session_id FROM Session")}
+
+    def read_tune_plays(self, since=None, session_ids=None):
+        # session_ids go in as one JSON array, there can be more than SQLite allows parameters
+        query = (
+            "SELECT substr(ses.session_date, 1, 10), ses.session_id, st.set_id, st.set_index, tts.tune_index, "
+            "t.tune_id, t.the_session_tune_id, t.name, t.tune_type, t.tune_meter, t.tune_mode "
+            "FROM Session ses "
+            "JOIN SetToSession st ON st.session_id = ses.session_id "
+            "JOIN TuneToSet tts ON tts.set_id = st.set_id "
+            "JOIN Tune t ON t.tune_id = tts.tune_id "
+            "WHERE (? IS NULL OR substr(ses.session_date, 1, 10) > ?) "
+            "AND (? IS NULL OR ses.session_id IN (SELECT value FROM json_each(?))) "
+            "ORDER BY ses.session_date, st.set_index, tts.tune_index"
+        )
+        session_ids = None if session_ids is None else json.dumps(list(session_ids))
+        for row in self.conn.execute(query, (since, since, session_ids, session_ids)):
+            yield tuple(row)
+
+    def _ids_by(self, table, id_column, key_column, keys):
+        """dict of str(key) : id for the rows of table whose key_column is in keys"""
+        ids = dict()
+        keys = list(keys)
+        for start in range(0, len(keys), self.chunk_size):
+            chunk = keys[start:start + self.chunk_size]
+            placeholders = ", ".join("?" * len(chunk))
+            for key, row_id in self.conn.execute(
+                    f"SELECT {key_column}, min({id_column}) FROM {table} WHERE {key_column} IN ({placeholders}) GROUP BY {key_column}",
+                    chunk):
+                ids[str(key)] = row_id
+        return ids
+
+    def _write_nodes(self, tune_rows, set_rows, session_rows, batch_size):
+        with self.conn:
+            tune_ids = self._ids_by("Tune", "tune_id", "the_session_tune_id", [row["the_session_tune_id"] for row in tune_rows])
+            new_tunes = [row for row in tune_rows if row["key"] not in tune_ids]
+            for start in range(0, len(new_tunes), batch_size):
+                self.conn.executemany(
+                    "INSERT INTO Tune (the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode, tune_url) "
+                    "VALUES (:the_session_tune_id, :name, :abc, :tune_type, :tune_meter, :tune_mode, :tune_url)",
+                    new_tunes[start:start + batch_size])
+            tune_ids.update(self._ids_by("Tune", "tune_id", "the_session_tune_id", [row["the_session_tune_id"] for row in new_tunes]))
+
+            set_ids = self._ids_by("SetTable", "set_id", "fingerprint", [row["fingerprint"] for row in set_rows])
+            new_sets = [row for row in set_rows if row["key"] not in set_ids]
+            for start in range(0, len(new_sets), batch_size):
+                self.conn.executemany(
+                    "INSERT INTO SetTable (description, fingerprint) VALUES (:description, :fingerprint)",
+                    new_sets[start:start + batch_size])
+            set_ids.update(self._ids_by("SetTable", "set_id", "fingerprint", [row["fingerprint"] for row in new_sets]))
+
+            # Sessions are always new and need their own ids back, which executemany can not return
+            session_ids = dict()
+            for row in session_rows:
+                session_ids[row["key"]] = self.conn.execute(
+                    "INSERT INTO Session (location_id, session_date, start_time, end_time, description) "
+                    "VALUES (:location_id, :session_date, :start_time, :end_time, :description)", row).lastrowid
+        return tune_ids, set_ids, session_ids
+
+    def _write_links(self, set_to_session_rows, tune_to_set_rows, batch_size):
+        with self.conn:
+            for start in range(0, len(set_to_session_rows), batch_size):
+                self.conn.executemany(self._insert_set_to_session_query, set_to_session_rows[start:start + batch_size])
+            for start in range(0, len(tune_to_set_rows), batch_size):
+                self.conn.executemany(self._insert_tune_to_set_query, tune_to_set_rows[start:start + batch_size])
+
+    def _add_play_counts(self, tune_rows, set_rows, batch_size):
+        with self.conn:
+            for table, id_column, rows in (("TunePlayCount", "tune_id", tune_rows), ("SetPlayCount", "set_id", set_rows)):
+                for start in range(0, len(rows), batch_size):
+                    self.conn.executemany(
+                        f"INSERT INTO {table} ({id_column}, bucket, period, count) VALUES (:id, :bucket, :period, :count) "
+                        f"ON CONFLICT ({id_column}, bucket, period) DO UPDATE SET count = count + excluded.count",
+                        rows[start:start + batch_size])
+
+    def _replace_play_counts(self, tune_rows, set_rows, batch_size):
+        with self.conn:
+            self.conn.execute("DELETE FROM TunePlayCount")
+            self.conn.execute("DELETE FROM SetPlayCount")
+        self._add_play_counts(tune_rows, set_rows, batch_size)
+
+    def _bucket_values(self, start_date, end_date):
+        buckets = self.range_buckets(start_date, end_date)
+        values = ", ".join("(?, ?)" for _ in buckets)
+        return values, [value for bucket in buckets for value in bucket]
+
+    def read_tune_play_counts(self, start_date, end_date, limit=None):
+        values, parameters = self._bucket_values(start_date, end_date)
+        if not parameters:
+            return []
+        query = (
+            f"WITH b(bucket, period) AS (VALUES {values}) "
+            "SELECT c.tune_id, t.name, t.tune_url, SUM(c.count) AS tune_count "
+            "FROM b JOIN TunePlayCount c ON c.bucket = b.bucket AND c.period = b.period "
+            "JOIN Tune t ON t.tune_id = c.tune_id "
+            "GROUP BY c.tune_id ORDER BY tune_count DESC"
+        )
+        if limit:
+            query += " LIMIT ?"
+            parameters.append(limit)
+        return [tuple(row) for row in self.conn.execute(query, parameters)]
+
+    def read_set_play_counts(self, start_date, end_date):
+        values, parameters = self._bucket_values(start_date, end_date)
+        if not parameters:
+            return []
+        query = (
+            f"WITH b(bucket, period) AS (VALUES {values}) "
+            "SELECT c.set_id, s.description, SUM(c.count) AS set_count "
+            "FROM b JOIN SetPlayCount c ON c.bucket = b.bucket AND c.period = b.period "
+            "JOIN SetTable s ON s.set_id = c.set_id "
+            "GROUP BY c.set_id ORDER BY set_count DESC"
+        )
+        return [tuple(row) for row in self.conn.execute(query, parameters)]
+
+    def _chunked_rows(self, query, ids, order_by):
+        """Rows of query, which ends in a WHERE on the id column, for ids in chunks, or every row when ids is None"""
+        if ids is None:
+            yield from self.conn.execute(f"{query} IS NOT NULL ORDER BY {order_by}")
+            return
+        ids = list(dict.fromkeys(ids))
+        for start in range(0, len(ids), self.chunk_size):
+            chunk = ids[start:start + self.chunk_size]
+            placeholders = ", ".join("?" * len(chunk))
+            yield from self.conn.execute(f"{query} IN ({placeholders}) ORDER BY {order_by}", chunk)
+
+    def read_set_lists(self, set_ids=None):
+        sets = dict()
+        for set_id, description, tune_id, name, tune_url, tune_mode, abc in self._chunked_rows(
+                "SELECT s.set_id, s.description, t.tune_id, t.name, t.tune_url, t.tune_mode, t.abc "
+                "FROM SetTable s "
+                "LEFT JOIN TuneToSet tts ON tts.set_id = s.set_id "
+                "LEFT JOIN Tune t ON t.tune_id = tts.tune_id "
+                "WHERE s.set_id", set_ids, "s.set_id, tts.tune_index"):
+            _, tunes = sets.setdefault(set_id, (description, list()))
+            if tune_id is not None:
+                tunes.append((tune_id, name, tune_url, tune_mode, abc))
+        return sets
+
+    def read_tune_sets(self, tune_ids=None):
+        tunes = dict()
+        for tune_id, set_id, description in self._chunked_rows(
+                "SELECT DISTINCT tts.tune_id, s.set_id, s.description "
+                "FROM TuneToSet tts JOIN SetTable s ON s.set_id = tts.set_id "
+                "WHERE tts.tune_id", tune_ids, "tts.tune_id, s.set_id"):
+            tunes.setdefault(tune_id, list()).append((set_id, description))
+        return tunes
+
+    def count_sets_without_fingerprint(self):
+        return self.conn.execute("SELECT COUNT(*) FROM SetTable WHERE fingerprint IS NULL").fetchone()[0]
+
+    def _read_set_tune_ids(self):
+        sets = dict()
+        for set_id, fingerprint, the_session_tune_id in self.conn.execute(
+                "SELECT s.set_id, s.fingerprint, t.the_session_tune_id "
+                "FROM SetTable s "
+                "LEFT JOIN TuneToSet tts ON tts.set_id = s.set_id "
+                "LEFT JOIN Tune t ON t.tune_id = tts.tune_id "
+                "ORDER BY s.set_id, tts.tune_index, t.the_session_tune_id"):
+            _, the_session_tune_ids = sets.setdefault(set_id, (fingerprint, list()))
+            if the_session_tune_id is not None:
+                the_session_tune_ids.append(the_session_tune_id)
+        return sets
+
+    def _merge_sets(self, merge_rows, batch_size):
+        with self.conn:
+            for start in range(0, len(merge_rows), batch_size):
+                batch = merge_rows[start:start + batch_size]
+                self.conn.executemany("UPDATE SetToSession SET set_id = :keep WHERE set_id = :set_id", batch)
+                self.conn.executemany("DELETE FROM TuneToSet WHERE set_id = :set_id", batch)
+                self.conn.executemany("DELETE FROM SetTable WHERE set_id = :set_id", batch)
+
+    def _write_set_fingerprints(self, fingerprint_rows, batch_size):
+        with self.conn:
+            for start in range(0, len(fingerprint_rows), batch_size):
+                self.conn.executemany(
+                    "UPDATE SetTable SET fingerprint = :fingerprint WHERE set_id = :set_id",
+                    fingerprint_rows[start:start + batch_size])
+
+    _live_play_queries = {
+        "TunePlayCount": (
+            "SELECT tts.tune_id, substr(ses.session_date, 1, 10), COUNT(*) "
+            "FROM Session ses "
+            "JOIN SetToSession st ON st.session_id = ses.session_id "
+            "JOIN TuneToSet tts ON tts.set_id = st.set_id "
+            "GROUP BY 1, 2"),
+        "SetPlayCount": (
+            "SELECT st.set_id, substr(ses.session_date, 1, 10), COUNT(*) "
+            "FROM Session ses "
+            "JOIN SetToSession st ON st.session_id = ses.session_id "
+            "GROUP BY 1, 2"),
+    }
+
+    def _read_live_play_counts(self, label):
+        return collections.Counter({
+            (item_id, session_date): count
+            for item_id, session_date, count in self.conn.execute(self._live_play_queries[label])})
+
+    def _read_stored_play_counts(self, label):
+        id_column = "tune_id" if label == "TunePlayCount" else "set_id"
+        return {
+            (item_id, bucket, period): count
+            for item_id, bucket, period, count in self.conn.execute(f"SELECT {id_column}, bucket, period, count FROM {label}")}
@@ -0,0 +1,73 @@
+#!python3
+r""" standin.py - local stand-in for the hosted neo4j graph
+
+Lets benchmarks drive SessionDataManager without a network connection.
+Every run() sleeps for a fixed round trip latency and counts the round trip and the query it sent,
+and every record hands back a fresh id for whatever column is asked for.
+
+"""
+import collections
+import time
+import uuid
+
+
+class StandInRecord(dict):
+    def __missing__(self, key):
+        value = str(uuid.uuid4())
+        self[key] = value
+        return value
+
+
+class StandInResult(list):
+    def single(self):
+        return self[0] if self else None
+
+
+class StandInTransaction:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, query, parameters=None, **kwargs):
+        self.driver.round_trips += 1
+        self.driver.queries[query] += 1
+        if self.driver.latency:
+            time.sleep(self.driver.latency)
+        parameters = dict(parameters or {}, **kwargs)
+        rows = parameters.get("rows")
+        if rows is None:
+            return StandInResult([StandInRecord()])
+        return StandInResult([StandInRecord(key=row["key"]) for row in rows if "key" in row])
+
+
+class StandInSession(StandInTransaction):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        pass
+
+    def execute_write(self, transaction_function, *args, **kwargs):
+        return transaction_function(StandInTransaction(self.driver), *args, **kwargs)
+
+    execute_read = execute_write
+    write_transaction = execute_write
+    read_transaction = execute_write
+
+
+class StandInDriver:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.round_trips = 0
+        self.queries = collections.Counter()  # query text : times run
+
+    def session(self, **kwargs):
+        return StandInSession(self)
+
+    def verify_connectivity(self):
+        pass
+
+    def close(self):
+        pass
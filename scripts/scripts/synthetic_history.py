@@ -0,0 +1,275 @@
+#!python3
+r""" synthetic_history.py - generate a realistic session history of any size, with its ceol.io pages
+
+The real data is one Austin session series, too small to show how ingest and the reports scale.
+SyntheticHistory makes --sessions weekly sessions spread over --locations venues, each on its own weekday:
+  - tunes of a --tune_pool repertoire are picked with Zipf popularity, so a few tunes are played
+    almost every week and most only now and then,
+  - a set is two or three tunes of one type more often than one or four, reels and jigs most often,
+    and regulars play some of the sets they played before again,
+  - tune names, types, meters and modes come from small word lists, and every tune has a short ABC body.
+
+It writes the sessions three ways:
+  sessions()          the payloads SessionDataManager.ingest_sessions takes
+  write_pages(dir)    a ceol.io shaped site, sessions/<city>/<venue>/index.html and one page per session,
+                      for fixture_server.py and scrape.py --url, or ceol_html directly
+  write_session_db()  a TheSession-data shaped tunes table so scrape.py finds every generated tune
+
+    py synthetic_history.py --sessions 5000 --locations 4 --pages_dir synthetic --session_db synthetic/thesession.db
+    py fixture_server.py --directory synthetic
+    py scrape.py --backend sqlite --url http://localhost:8000/sessions/austin/mueller/ --session_db synthetic/thesession.db
+
+"""
+import argparse
+import datetime
+import html
+import itertools
+import pathlib
+import random
+import sqlite3
+import sys
+
+# tune_type : (meter, weight of a set being of that type)
+tune_types = {
+    "reel": ("4/4", 45),
+    "jig": ("6/8", 25),
+    "hornpipe": ("4/4", 7),
+    "polka": ("2/4", 7),
+    "slide": ("12/8", 5),
+    "slip jig": ("9/8", 5),
+    "waltz": ("3/4", 4),
+    "barndance": ("4/4", 2),
+}
+tune_modes = ["Dmajor", "Gmajor", "Ador", "Edorian", "Eminor", "Amajor", "Bminor", "Cmajor"]
+# tunes in a set : weight
+set_lengths = {1: 12, 2: 38, 3: 42, 4: 8}
+
+name_adjectives = [
+    "Silver", "Green", "Humours of", "Lonely", "Merry", "Wild", "Old", "Wandering", "Flowing", "Rocky",
+    "Maid of", "Boys of", "Lark in", "Road to", "Banks of", "Star of", "Sally", "Castle", "Morning", "Ballydesmond"]
+name_nouns = [
+    "Spear", "Bridge", "Tavern", "Harbour", "Glen", "Meadow", "Piper", "Fiddler", "Kitchen", "Strand",
+    "Mountain", "Lough", "Cottage", "Mill", "Abbey", "Fair", "Lass", "Rambler", "Ferry", "Crossroads"]
+venues = [
+    ("austin", "mueller", "B.D.Riley Thursday Session at Mueller in Austin, Texas."),
+    ("galway", "tigh-coili", "Tigh Coili session in Galway."),
+    ("ennis", "brogans", "Brogan's session in Ennis."),
+    ("boston", "the-burren", "The Burren back room session in Somerville."),
+    ("chicago", "chief-oneills", "Chief O'Neill's session in Chicago."),
+    ("seattle", "conors", "Conor Byrne's session in Seattle."),
+    ("doolin", "mcganns", "McGann's session in Doolin."),
+    ("london", "the-auld-shillelagh", "The Auld Shillelagh session in Stoke Newington."),
+]
+
+
+class SyntheticHistory:
+    def __init__(self, sessions, locations=1, tune_pool=2000, seed=0, first_date=datetime.date(2010, 1, 7),
+                 sets_per_session=(8, 20), repeat_set_rate=0.3, zipf_exponent=1.1):
+        self.rng = random.Random(seed)
+        self.tune_pool = tune_pool
+        self.zipf_exponent = zipf_exponent
+        self.tunes = self._make_tunes()
+        self.locations = [self._make_location(location_index) for location_index in range(locations)]
+        self.session_list = self._make_sessions(sessions, first_date, sets_per_session, repeat_set_rate)
+
+    def _make_tunes(self):
+        """{the_session_tune_id: (name, tune_type, tune_meter, tune_mode, abc)}, the_session_tune_id 1 is the most popular"""
+        type_names = list(tune_types)
+        type_weights = [weight for meter, weight in tune_types.values()]
+        tunes = dict()
+        names = set()
+        for the_session_tune_id in range(1, self.tune_pool + 1):
+            name = f"The {self.rng.choice(name_adjectives)} {self.rng.choice(name_nouns)}"
+            if name in names:
+                name = f"{name} No. {the_session_tune_id}"
+            names.add(name)
+            tune_type = self.rng.choices(type_names, type_weights)[0]
+            tune_meter = tune_types[tune_type][0]
+            tune_mode = self.rng.choice(tune_modes)
+            tunes[str(the_session_tune_id)] = (name, tune_type, tune_meter, tune_mode, self._make_abc())
+        return tunes
+
+    def _make_abc(self):
+        notes = "DEFGABcde"
+        bars = ["".join(self.rng.choice(notes) for _ in range(4)) for _ in range(8)]
+        return "|:" + "|".join(bars[:4]) + ":|\n|:" + "|".join(bars[4:]) + ":|"
+
+    def _make_location(self, location_index):
+        city, venue, description = venues[location_index % len(venues)]
+        if location_index >= len(venues):
+            venue = f"{venue}-{location_index // len(venues) + 1}"
+        start_hour = self.rng.choice([19, 20, 21])
+        return {
+            "location_id": location_index + 1,
+            "path": f"sessions/{city}/{venue}/",
+            "description": description,
+            "address": f"{location_index + 1} Main Street, {city.title()}",
+            "url": f"https://ceol.io/sessions/{city}/{venue}/",
+            "weekday_offset": location_index % 7,
+            "start_time": f"{start_hour}:00:00",
+            "end_time": f"{start_hour + 3}:30:00",
+        }
+
+    def _make_sessions(self, session_count, first_date, sets_per_session, repeat_set_rate):
+        # Popularity by rank within each type, so a reel set draws from the reels
+        by_type = dict()
+        for the_session_tune_id, (name, tune_type, *_) in self.tunes.items():
+            by_type.setdefault(tune_type, []).append(the_session_tune_id)
+        # Cumulative, so a draw is a bisect instead of summing the weights every time
+        cum_weights = {tune_type: list(itertools.accumulate(1.0 / rank ** self.zipf_exponent for rank in range(1, len(ids) + 1)))
+                       for tune_type, ids in by_type.items()}
+        type_names = list(by_type)
+        type_weights = [tune_types[tune_type][1] for tune_type in type_names]
+        lengths, length_weights = list(set_lengths), list(set_lengths.values())
+
+        sessions = list()
+        played_sets = {location["location_id"]: list() for location in self.locations}
+        for session_number in range(session_count):
+            location = self.locations[session_number % len(self.locations)]
+            week = session_number // len(self.locations)
+            session_date = first_date + datetime.timedelta(days=7 * week + location["weekday_offset"])
+            sets = list()
+            for set_index in range(1, self.rng.randint(*sets_per_session) + 1):
+                history = played_sets[location["location_id"]]
+                if history and self.rng.random() < repeat_set_rate:
+                    tune_ids = self.rng.choice(history)
+                else:
+                    tune_type = self.rng.choices(type_names, type_weights)[0]
+                    length = min(self.rng.choices(lengths, length_weights)[0], len(by_type[tune_type]))
+                    tune_ids = list()
+                    while len(tune_ids) < length:
+                        tune_id = self.rng.choices(by_type[tune_type], cum_weights=cum_weights[tune_type])[0]
+                        if tune_id not in tune_ids:
+                            tune_ids.append(tune_id)
+                    history.append(tune_ids)
+                sets.append((set_index, tune_ids))
+            sessions.append((location, session_date.isoformat(), sets))
+        return sessions
+
+    def tune_row(self, the_session_tune_id):
+        """(the_session_tune_id, tune_name, abc, tune_type, tune_meter, tune_mode, tune_url) as ingest_sessions takes it"""
+        name, tune_type, tune_meter, tune_mode, abc = self.tunes[the_session_tune_id]
+        return (the_session_tune_id, name, abc, tune_type, tune_meter, tune_mode,
+                f"https://thesession.org/tunes/{the_session_tune_id}")
+
+    def sessions(self):
+        """Yields (location_id, session_date, start_time, end_time, description, sets) for ingest_sessions"""
+        for location, session_date, sets in self.session_list:
+            payload_sets = list()
+            for set_index, tune_ids in sets:
+                tunes = [self.tune_row(tune_id) for tune_id in tune_ids]
+                payload_sets.append((set_index, ', '.join(tune[1] for tune in tunes), tunes))
+            yield (location["location_id"], session_date, location["start_time"], location["end_time"], "", payload_sets)
+
+    def location_rows(self):
+        """(description, address, url) of each location, create_location them in order so the ids match"""
+        return [(location["description"], location["address"], location["url"]) for location in self.locations]
+
+    def session_page(self, session_date, sets):
+        """A ceol.io session page, one <li> per set with an <a> per tune, as bytes"""
+        items = list()
+        for set_index, tune_ids in sets:
+            links = list()
+            for tune_id in tune_ids:
+                name = html.escape(self.tunes[tune_id][0])
+                links.append(f'<a href="https://thesession.org/tunes/{tune_id}#setting{tune_id}">{name}</a>')
+            items.append(f'<li>{" / ".join(links)}</li>')
+        return (
+            '<!DOCTYPE html><html><head><meta charset="utf-8">'
+            f'<title>Session {session_date}</title></head>'
+            f'<body><h1>{session_date}</h1><ul>{"".join(items)}</ul></body></html>').encode('utf-8')
+
+    def index_page(self, session_dates):
+        """A ceol.io session series index page linking each 'YYYY-MM-DD.html', as bytes"""
+        links = "".join(f'<a href="{session_date}.html">{session_date}</a><br>' for session_date in session_dates)
+        return f'<html><body>{links}<a href="/about">About</a></body></html>'.encode('utf-8')
+
+    def pages(self):
+        """Yields (relative path, content) of every page of the site"""
+        dates = {location["location_id"]: list() for location in self.locations}
+        for location, session_date, sets in self.session_list:
+            dates[location["location_id"]].append(session_date)
+            yield f"{location['path']}{session_date}.html", self.session_page(session_date, sets)
+        for location in self.locations:
+            yield f"{location['path']}index.html", self.index_page(dates[location["location_id"]])
+
+    def write_pages(self, pages_dir):
+        pages_dir = pathlib.Path(pages_dir)
+        count = 0
+        for path, content in self.pages():
+            filepath = pages_dir / path
+            filepath.parent.mkdir(parents=True, exist_ok=True)
+            filepath.write_bytes(content)
+            count += 1
+        return count
+
+    def write_session_db(self, session_db):
+        """A TheSession-data shaped tunes table of the repertoire, ids are text as in the real file"""
+        conn = sqlite3.connect(session_db)
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS tunes(tune_id, setting_id, name, type, meter, mode, abc, date, username)")
+            conn.execute("DELETE FROM tunes")
+            conn.executemany(
+                "INSERT INTO tunes VALUES (?, ?, ?, ?, ?, ?, ?, '2010-01-01 00:00:00', 'synthetic')",
+                [(tune_id, tune_id, name, tune_type, tune_meter, tune_mode, abc)
+                 for tune_id, (name, tune_type, tune_meter, tune_mode, abc) in self.tunes.items()])
+        conn.close()
+
+
+def parse():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--sessions",
+        type=int,
+        default=1000,
+        help="Number of sessions across all locations")
+    parser.add_argument(
+        "--locations",
+        type=int,
+        default=1,
+        help="Number of venues, each holds a weekly session")
+    parser.add_argument(
+        "--tune_pool",
+        type=int,
+        default=2000,
+        help="Number of tunes in the repertoire")
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0)
+    parser.add_argument(
+        "--pages_dir",
+        type=pathlib.Path,
+        help="Write the ceol.io shaped pages under this directory")
+    parser.add_argument(
+        "--session_db",
+        type=pathlib.Path,
+        help="Write a TheSession-data shaped sqlite file of the repertoire")
+    return parser.parse_args()
+
+
+def main():
+    args = parse()
+    print(args)
+
+    history = SyntheticHistory(args.sessions, args.locations, args.tune_pool, args.seed)
+    sets = sum(len(sets) for _, _, sets in history.session_list)
+    plays = sum(len(tune_ids) for _, _, sets in history.session_list for _, tune_ids in sets)
+    print(f"{args.sessions} sessions at {args.locations} locations, {sets} sets, {plays} tune plays")
+    if args.pages_dir:
+        count = history.write_pages(args.pages_dir)
+        print(f"Wrote {count} pages under {args.pages_dir}, index pages at")
+        for location in history.locations:
+            print(f"    {location['path']}")
+    if args.session_db:
+        args.session_db.parent.mkdir(parents=True, exist_ok=True)
+        history.write_session_db(args.session_db)
+        print(f"Wrote {len(history.tunes)} tunes to {args.session_db}")
+    return 0
+
+
+if __name__ == "__main__":
+    rc = main()
+    sys.exit(rc)
@@ -0,0 +1,103 @@
+#!python3
+r""" tune_lookup.py - cached tune metadata lookups against the TheSession-data sqlite file
+
+Dependencies
+    https://git-lfs.com/ - follow instructions to download and install
+    cd %YOUR_CODE_ROOT% && git clone https://github.com/adactio/TheSession-data
+
+"""
+import collections
+import pathlib
+import sqlite3
+import instrumentation
+
+
+class TheSessionTunes:
+    """
+    Look up (abc, tune_type, tune_meter, tune_mode) by TheSession tune id.
+    prefetch loads many ids with one IN query per chunk, results are kept in a bounded LRU cache.
+    misses counts every id read from the file, prefetched the ones of them prefetch read in bulk,
+    and hits the get calls the cache answered, so the gets of prefetched ids are hits on top of their misses.
+    """
+    # Stay under SQLITE_MAX_VARIABLE_NUMBER on older sqlite builds
+    chunk_size = 900
+    empty = ("", "", "", "")
+
+    def __init__(self, session_db, max_size=20000, cache_kib=65536, mmap_bytes=268435456):
+        self.max_size = max_size
+        self.cache = collections.OrderedDict()  # str(tune_id) : (abc, tune_type, tune_meter, tune_mode)
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+
+        uri = pathlib.Path(session_db).resolve().as_uri() if session_db != ":memory:" else "file::memory:"
+        self.conn = sqlite3.connect(f"{uri}?mode=ro", uri=True)
+        self.conn.execute("PRAGMA query_only = ON")
+        self.conn.execute(f"PRAGMA cache_size = {-int(cache_kib)}")
+        self.conn.execute(f"PRAGMA mmap_size = {int(mmap_bytes)}")
+
+    def close(self):
+        self.conn.close()
+
+    def has_tune_id_index(self):
+        """True if some index on tunes starts with tune_id, otherwise every IN chunk is a table scan."""
+        for index in self.conn.execute("PRAGMA index_list(tunes)").fetchall():
+            columns = self.conn.execute(f"PRAGMA index_info({index[1]!r})").fetchall()
+            if columns and columns[0][2] == "tune_id":
+                return True
+        return False
+
+    @instrumentation.timed("the_session.prefetch")
+    def prefetch(self, tune_ids):
+        """Load every id in tune_ids that is not already cached."""
+        missing = list(dict.fromkeys(str(tune_id) for tune_id in tune_ids if str(tune_id) not in self.cache))
+        self.misses += len(missing)
+        self.prefetched += len(missing)
+        for start in range(0, len(missing), self.chunk_size):
+            chunk = missing[start:start + self.chunk_size]
+            placeholders = ", ".join("?" * len(chunk))
+            # TheSession has a row per setting, the lowest rowid is the row the single tune query returns
+            rows = self.conn.execute(
+                f"SELECT tune_id, abc, type, meter, mode FROM tunes WHERE tune_id IN ({placeholders}) ORDER BY rowid",
+                chunk)
+            found = dict()
+            for tune_id, abc, tune_type, tune_meter, tune_mode in rows:
+                found.setdefault(str(tune_id), (abc, tune_type, tune_meter, tune_mode))
+            for tune_id in chunk:
+                self._store(tune_id, found.get(tune_id, self.empty))
+
+    def get(self, tune_id):
+        tune_id = str(tune_id)
+        if tune_id in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(tune_id)
+            return self.cache[tune_id]
+        self.misses += 1
+        row = self.conn.execute(
+            "SELECT abc, type, meter, mode FROM tunes WHERE tune_id = ? ORDER BY rowid LIMIT 1",
+            (tune_id,)).fetchone()
+        tune = tuple(row) if row else self.empty
+        self._store(tune_id, tune)
+        return tune
+
+    def name(self, tune_id):
+        """Name of the first setting of a tune, not cached as it is only wanted where a tune is not named already"""
+        row = self.conn.execute(
+            "SELECT name FROM tunes WHERE tune_id = ? ORDER BY rowid LIMIT 1", (str(tune_id),)).fetchone()
+        return row[0] if row else ""
+
+    def tune_id_by_name(self, name):
+        """tune_id of the first setting named name, ignoring case, None when there is none. A scan of the table"""
+        row = self.conn.execute(
+            "SELECT tune_id FROM tunes WHERE name = ? COLLATE NOCASE ORDER BY rowid LIMIT 1", (name,)).fetchone()
+        return str(row[0]) if row else None
+
+    def _store(self, tune_id, tune):
+        self.cache[tune_id] = tune
+        self.cache.move_to_end(tune_id)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "prefetched": self.prefetched,
+                "size": len(self.cache), "max_size": self.max_size}
@@ -0,0 +1,5 @@
+import pathlib
+import sys
+
+# The scripts import each other by module name, as they do when run from scripts/scripts
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "scripts"))
@@ -0,0 +1,67 @@
+import pathlib
+import pytest
+
+pyarrow = pytest.importorskip("pyarrow")
+pytest.importorskip("numpy")
+import analytics
+import SessionDataManager
+from synthetic_history import SyntheticHistory
+
+schema_file = pathlib.Path(__file__).resolve().parent.parent.parent / "init.sql"
+
+
+def test_sqlite_plays_to_table(tmp_path):
+    tunes = [(1, "The Kesh", "", "jig", "6/8", "Gmajor", "https://thesession.org/tunes/1"),
+             (2, "Out on the Ocean", "", "jig", "6/8", "Gmajor", "https://thesession.org/tunes/2")]
+    sessions = [(1, "2024-01-04", "19:00:00", "22:30:00", "", [(1, "The Kesh, Out on the Ocean", tunes)]),
+                (1, "2025-02-06", "19:00:00", "22:30:00", "", [(1, "The Kesh", tunes[:1])])]
+    with SessionDataManager.SessionDataManager(
+            ":memory:", initialize_db=True, backend="sqlite",
+            db_file=tmp_path / "sessions.db", schema_file=schema_file) as sdm:
+        sdm.ingest_sessions(sessions)
+        table = analytics.plays_to_table(sdm.read_tune_plays())
+
+    assert table.num_rows == 3
+    assert table.schema == analytics.schema
+    rows = table.to_pylist()
+    assert {row["session_id"] for row in rows} == {"1", "2"}
+    assert all(isinstance(row["set_id"], str) for row in rows)
+    assert [row["year"] for row in rows] == [2024, 2024, 2025]
+
+
+def test_uuid_ids_kept():
+    play = ("2024-01-04", "9b2c", "5d1e", 1, 1, "77aa", 1, "The Kesh", "jig", "6/8", "Gmajor")
+    row = analytics.plays_to_table([play]).to_pylist()[0]
+    assert (row["session_id"], row["set_id"], row["tune_id"]) == ("9b2c", "5d1e", "77aa")
+
+
+def test_append_adds_sessions_not_exported(tmp_path, monkeypatch):
+    tunes = [(1, "The Kesh", "", "jig", "6/8", "Gmajor", "https://thesession.org/tunes/1"),
+             (2, "Out on the Ocean", "", "jig", "6/8", "Gmajor", "https://thesession.org/tunes/2")]
+    db_file = tmp_path / "sessions.db"
+    dataset_dir = tmp_path / "history"
+    SyntheticHistory(1, tune_pool=2).write_session_db(tmp_path / "thesession.db")
+    argv = ["analytics.py", "--session_db", str(tmp_path / "thesession.db"), "--backend", "sqlite", "--db_file", str(db_file),
+            "--schema_file", str(schema_file), "--dataset_dir", str(dataset_dir)]
+
+    def ingest(sessions):
+        with SessionDataManager.SessionDataManager(
+                ":memory:", initialize_db=True, backend="sqlite", db_file=db_file, schema_file=schema_file) as sdm:
+            sdm.ingest_sessions(sessions)
+
+    ingest([(1, "2024-01-11", "19:00:00", "22:30:00", "", [(1, "The Kesh, Out on the Ocean", tunes)])])
+    monkeypatch.setattr("sys.argv", argv)
+    assert analytics.main() == 0
+    # Another session the same day and a backfilled earlier one, both after the first export
+    ingest([(1, "2024-01-11", "12:00:00", "14:00:00", "", [(1, "The Kesh", tunes[:1])]),
+            (1, "2024-01-04", "19:00:00", "22:30:00", "", [(1, "Out on the Ocean", tunes[1:])])])
+    monkeypatch.setattr("sys.argv", argv + ["--append"])
+    assert analytics.main() == 0
+    assert analytics.main() == 0
+
+    table = analytics.load_plays(dataset_dir, "2024-01-01", "2024-12-31")
+    assert sorted((str(row["session_date"]), row["session_id"], row["name"]) for row in table.to_pylist()) == [
+        ("2024-01-04", "3", "Out on the Ocean"),
+        ("2024-01-11", "1", "Out on the Ocean"),
+        ("2024-01-11", "1", "The Kesh"),
+        ("2024-01-11", "2", "The Kesh")]
@@ -0,0 +1,62 @@
+import pathlib
+import random
+import pytest
+
+pytest.importorskip("bs4")
+from ceol_html import anchors, anchors_bs4, set_info_tuplets, set_info_tuplets_bs4
+from check_ceol_html import differences, random_page, snippets
+from synthetic_history import SyntheticHistory
+
+pages_dir = pathlib.Path(__file__).resolve().parent / "pages"
+
+# What BeautifulSoup gives for the golden pages, unclosed <li>s nest and take the later tunes along
+golden_sets = [
+    (1, [('ceol.io', '', '/')]),
+    (2, [('Sessions', '', '/sessions/')]),
+    (3, [('The Kesh', '1', 'https://thesession.org/tunes/1#setting1'),
+         ('Out on the Ocean', '2', 'https://thesession.org/tunes/2#setting13')]),
+    (4, [("Tom Billy's", '27', 'https://thesession.org/tunes/27'),
+         ('The Banshee', '55', 'https://thesession.org/tunes/55#setting55'),
+         ('Sally Gardens', '72', 'https://thesession.org/tunes/72'),
+         ("P&J's Favourite", '182', 'https://thesession.org/tunes/182#setting182'),
+         ('Café du Nord', '1102', 'https://thesession.org/tunes/1102#setting1102')]),
+    (5, [("P&J's Favourite", '182', 'https://thesession.org/tunes/182#setting182')]),
+    (6, []),
+    (7, [('Café du Nord', '1102', 'https://thesession.org/tunes/1102#setting1102')]),
+]
+golden_anchors = [
+    ('2024-01-04.html', 'Thursday 4 January 2024'),
+    ('2024-01-11.html', 'Thursday 11 January 2024'),
+    ('2024-01-18.html', 'Thursday 18 January 2024'),
+    (None, 'Archive'),
+    ('/about', 'About'),
+]
+
+
+@pytest.mark.parametrize("name", sorted(snippets))
+def test_snippet_matches_bs4(name):
+    assert differences(snippets[name]) == []
+
+
+def test_golden_session_page():
+    content = (pages_dir / "session.html").read_bytes()
+    assert list(set_info_tuplets(content)) == golden_sets
+    assert list(set_info_tuplets_bs4(content)) == golden_sets
+    assert anchors(content) == anchors_bs4(content)
+
+
+def test_golden_index_page():
+    content = (pages_dir / "index.html").read_bytes()
+    assert anchors(content) == golden_anchors
+    assert anchors_bs4(content) == golden_anchors
+
+
+def test_synthetic_pages_match_bs4():
+    pages = dict(SyntheticHistory(30, locations=2, tune_pool=200).pages())
+    assert [path for path, content in pages.items() if differences(content)] == []
+
+
+def test_fuzz_matches_bs4():
+    rng = random.Random(0)
+    pages = [random_page(rng) for _ in range(3000)]
+    assert [page for page in pages if differences(page)] == []
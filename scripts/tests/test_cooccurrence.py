@@ -0,0 +1,49 @@
+import pathlib
+import sys
+import pytest
+
+pytest.importorskip("scipy")
+import SessionDataManager
+from cooccurrence import CooccurrenceModel, main
+from synthetic_history import SyntheticHistory
+
+schema_file = pathlib.Path(__file__).resolve().parent.parent.parent / "init.sql"
+
+
+def test_update_adds_same_day_and_backfilled_sessions(tmp_path, monkeypatch):
+    history = SyntheticHistory(12, locations=2, tune_pool=40)
+    history.write_session_db(tmp_path / "thesession.db")
+    sessions = list(history.sessions())
+    by_date = sorted(sessions, key=lambda session: session[1])
+    last_date = by_date[-1][1]
+    # The first crawl missed the oldest session, and the newest one is played again at the other venue
+    later = [by_date[0], (3 - by_date[-1][0],) + by_date[-1][1:]]
+    assert later[1][1] == last_date
+    first = [session for session in sessions if session is not by_date[0]]
+    argv = ["cooccurrence.py", "--session_db", str(tmp_path / "thesession.db"), "--backend", "sqlite",
+            "--db_file", str(tmp_path / "sessions.db"), "--schema_file", str(schema_file)]
+
+    def ingest(sessions):
+        with SessionDataManager.SessionDataManager(
+                ":memory:", initialize_db=True, backend="sqlite",
+                db_file=tmp_path / "sessions.db", schema_file=schema_file) as sdm:
+            for description, address, url in history.location_rows()[1:]:
+                sdm.create_location(description, address, url)
+            sdm.ingest_sessions(sessions)
+
+    ingest(first)
+    monkeypatch.setattr(sys, "argv", argv + ["--model_dir", str(tmp_path / "incremental"), "--build"])
+    assert main() == 0
+    ingest(later)
+    monkeypatch.setattr(sys, "argv", argv + ["--model_dir", str(tmp_path / "incremental"), "--update"])
+    assert main() == 0
+    assert main() == 0
+    monkeypatch.setattr(sys, "argv", argv + ["--model_dir", str(tmp_path / "full"), "--build"])
+    assert main() == 0
+
+    incremental = CooccurrenceModel(tmp_path / "incremental")
+    full = CooccurrenceModel(tmp_path / "full")
+    assert sorted(map(str, incremental.session_ids)) == sorted(map(str, full.session_ids))
+    assert len(incremental.session_ids) == len(sessions) + 1
+    rows = [incremental.rows[str(tune_id)] for tune_id in full.tune_ids]
+    assert (incremental.cooccurrence[rows][:, rows] != full.cooccurrence).nnz == 0
@@ -0,0 +1,47 @@
+import pytest
+
+pytest.importorskip("requests")
+from fetcher import Fetcher
+from fixture_server import FixtureServer
+from scrape import fetch_page
+
+
+@pytest.fixture
+def pages(tmp_path):
+    for index in range(8):
+        (tmp_path / f"{index}.html").write_text(f"<p>page {index}</p>")
+    return tmp_path
+
+
+def test_retry_then_give_up(pages):
+    with FixtureServer(pages, failing={"/bad.html": 503}, quiet=True).start() as server, \
+            Fetcher(rate=0, retries=2, backoff=0) as fetcher:
+        assert fetch_page(server.url + "bad.html", fetcher) is None
+        # The crawl goes on with the next page
+        assert fetch_page(server.url + "0.html", fetcher) == b"<p>page 0</p>"
+    assert [path for path, _ in server.requests].count("/bad.html") == 3
+
+
+def test_serial_crawl_not_rate_limited_by_default():
+    from scrape import crawl_rate, parallel_rate_limit
+    assert crawl_rate(None, 1) == 0
+    assert crawl_rate(None, 8) == parallel_rate_limit
+    assert crawl_rate(2.0, 1) == 2.0
+
+
+def test_concurrent_fetch_keeps_order(pages):
+    urls = [f"{index}.html" for index in range(8)]
+    with FixtureServer(pages, delay=0.2, quiet=True).start() as server, Fetcher(workers=8, rate=0) as fetcher:
+        contents = list(fetcher.map_ordered(lambda url: fetch_page(server.url + url, fetcher), urls))
+    assert contents == [f"<p>page {index}</p>".encode() for index in range(8)]
+    # All eight were in flight together, serially they take 1.6s
+    times = sorted(received for _, received in server.requests)
+    assert times[-1] - times[0] < 0.15
+
+
+def test_rate_limit_spaces_requests(pages):
+    with FixtureServer(pages, quiet=True).start() as server, Fetcher(workers=4, rate=10) as fetcher:
+        list(fetcher.map_ordered(lambda index: fetch_page(f"{server.url}{index}.html", fetcher), range(6)))
+    times = sorted(received for _, received in server.requests)
+    assert len(times) == 6
+    assert min(later - earlier for earlier, later in zip(times, times[1:])) > 0.08
@@ -0,0 +1,18 @@
+import pytest
+from check_importtime import case_imports, default_cases, default_forbidden, importtime
+
+budget_ms = 150
+
+
+@pytest.fixture(scope="module")
+def baseline():
+    return set(importtime(["-c", "pass"])[0])
+
+
+@pytest.mark.parametrize("case", default_cases)
+def test_startup_within_budget(case, baseline):
+    extra, packages = case_imports(case, baseline, repeats=3)
+    assert sorted(packages & set(default_forbidden)) == []
+    total_ms = sum(extra.values()) / 1000
+    heaviest = sorted(extra.items(), key=lambda item: -item[1])[:5]
+    assert total_ms < budget_ms, f"scripts {case}: {total_ms:.1f}ms of imports, heaviest {heaviest}"
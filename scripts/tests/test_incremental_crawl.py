@@ -0,0 +1,59 @@
+import pytest
+
+pytest.importorskip("requests")
+from fetcher import Fetcher
+from fixture_server import FixtureServer
+from manifest import PageManifest
+from scrape import ceol_session_pages
+from synthetic_history import SyntheticHistory
+
+
+@pytest.fixture
+def site(tmp_path):
+    history = SyntheticHistory(3, tune_pool=50)
+    history.write_pages(tmp_path / "site")
+    location_path = history.locations[0]["path"]
+    dates = sorted(session_date for _, session_date, _ in history.session_list)
+    return tmp_path / "site", location_path, dates
+
+
+def crawl(server, location_path, manifest_file, commit=True):
+    """Session dates of the pages the crawl would ingest, committed to the manifest as scrape.main does"""
+    manifest = PageManifest(manifest_file)
+    with Fetcher(rate=0, retries=0) as fetcher:
+        pages = list(ceol_session_pages(server.url + location_path, fetcher, manifest=manifest))
+    if commit:
+        manifest.commit(session_info[0] for session_info, _ in pages)
+    manifest.save()
+    return [session_info[2].strftime('%Y-%m-%d') for session_info, _ in pages]
+
+
+def test_failed_session_page_retried_with_unchanged_index(site, tmp_path):
+    site_dir, location_path, dates = site
+    manifest_file = tmp_path / "crawl_manifest.json"
+    failing = {f"/{location_path}{dates[1]}.html": 503}
+    with FixtureServer(site_dir, failing=failing, quiet=True).start() as server:
+        assert crawl(server, location_path, manifest_file) == [dates[0], dates[2]]
+        server.failing.clear()
+        # The index has not changed, the page that failed is still fetched and the others are not
+        assert crawl(server, location_path, manifest_file) == [dates[1]]
+        assert crawl(server, location_path, manifest_file) == []
+
+
+def test_page_not_committed_is_fetched_again(site, tmp_path):
+    site_dir, location_path, dates = site
+    manifest_file = tmp_path / "crawl_manifest.json"
+    with FixtureServer(site_dir, quiet=True).start() as server:
+        # As if ingest failed, nothing is committed
+        assert crawl(server, location_path, manifest_file, commit=False) == dates
+        assert crawl(server, location_path, manifest_file) == dates
+        assert crawl(server, location_path, manifest_file) == []
+
+
+def test_session_page_without_sets_is_committed(site, tmp_path):
+    site_dir, location_path, dates = site
+    (site_dir / location_path / f"{dates[1]}.html").write_bytes(b"<html><body><h1>No tunes logged</h1></body></html>")
+    manifest_file = tmp_path / "crawl_manifest.json"
+    with FixtureServer(site_dir, quiet=True).start() as server:
+        assert crawl(server, location_path, manifest_file) == dates
+        assert crawl(server, location_path, manifest_file) == []
@@ -0,0 +1,34 @@
+import pytest
+from neo4j_backend import Neo4jBackend
+from standin import StandInDriver
+
+
+def sessions():
+    tunes = [(1, "The Kesh", "", "jig", "6/8", "Gmajor", "https://thesession.org/tunes/1"),
+             (2, "Out on the Ocean", "", "jig", "6/8", "Gmajor", "https://thesession.org/tunes/2")]
+    return [(1, "2024-01-04", "19:00:00", "22:30:00", "", [(1, "The Kesh, Out on the Ocean", tunes)])]
+
+
+def test_ingest_merges_sets_on_fingerprint():
+    driver = StandInDriver()
+    backend = Neo4jBackend(driver, initialize_db=False)
+    backend.ingest_sessions(sessions())
+    assert driver.queries[Neo4jBackend._merge_sets_query] == 1
+    assert driver.queries[Neo4jBackend._merge_duplicate_sets_query] == 0
+    assert "MERGE (s:SetTable {fingerprint: row.fingerprint})" in Neo4jBackend._merge_sets_query
+
+
+def test_migration_merges_duplicate_sets():
+    driver = StandInDriver()
+    backend = Neo4jBackend(driver, initialize_db=False)
+    backend._merge_sets([{"set_id": "a", "keep": "b"}], batch_size=500)
+    assert driver.queries[Neo4jBackend._merge_duplicate_sets_query] == 1
+    assert driver.queries[Neo4jBackend._merge_sets_query] == 0
+    assert "DETACH DELETE old" in Neo4jBackend._merge_duplicate_sets_query
+
+
+def test_missing_credentials_fail_clearly(monkeypatch):
+    monkeypatch.delenv("NEO4J_URI", raising=False)
+    monkeypatch.setenv("NEO4J_PASSWORD", "secret")
+    with pytest.raises(RuntimeError, match="NEO4J_URI"):
+        Neo4jBackend(initialize_db=False)
@@ -0,0 +1,51 @@
+import pathlib
+import sys
+import pytest
+import parse_audio
+import SessionDataManager
+from synthetic_history import SyntheticHistory
+
+schema_file = pathlib.Path(__file__).resolve().parent.parent.parent / "init.sql"
+
+
+def test_missing_test_tune_fails_clearly(tmp_path, monkeypatch, capsys):
+    db_file = tmp_path / "sessions.db"
+    with SessionDataManager.SessionDataManager(
+            ":memory:", initialize_db=True, backend="sqlite", db_file=db_file, schema_file=schema_file):
+        pass
+    SyntheticHistory(1, tune_pool=10).write_session_db(tmp_path / "thesession.db")
+    monkeypatch.setattr(sys, "argv", [
+        "parse_audio.py", "--backend", "sqlite", "--db_file", str(db_file), "--schema_file", str(schema_file),
+        "--session_db", str(tmp_path / "thesession.db"), "--tune_id", "113"])
+    assert parse_audio.main() == 1
+    assert "No tune 113 in the sqlite session data" in capsys.readouterr().out
+
+
+def test_single_tune_uses_the_parse_cache(tmp_path, monkeypatch):
+    audio = pytest.importorskip("audio")
+    from parse_cache import ParsedScoreCache
+    history = SyntheticHistory(1, tune_pool=10)
+    history.write_session_db(tmp_path / "thesession.db")
+    db_file = tmp_path / "sessions.db"
+    with SessionDataManager.SessionDataManager(
+            ":memory:", initialize_db=True, backend="sqlite", db_file=db_file, schema_file=schema_file) as sdm:
+        sdm.ingest_sessions(list(history.sessions()))
+        tune_id = sdm.read_tunes()[0][0]
+
+    managers = list()
+
+    class RecordingAudioManager(audio.AudioManager):
+        def __init__(self, parse_cache=None):
+            super().__init__(parse_cache)
+            managers.append(self)
+
+        def write_wav(self, output_file, font_file):
+            pass
+
+    monkeypatch.setattr(audio, "AudioManager", RecordingAudioManager)
+    monkeypatch.setattr(sys, "argv", [
+        "parse_audio.py", "--backend", "sqlite", "--db_file", str(db_file), "--schema_file", str(schema_file),
+        "--session_db", str(tmp_path / "thesession.db"), "--tune_id", str(tune_id),
+        "--parse_cache_dir", str(tmp_path / "parse_cache")])
+    assert parse_audio.main() == 0
+    assert isinstance(managers[0].parse_cache, ParsedScoreCache)
@@ -0,0 +1,21 @@
+import pytest
+
+pytest.importorskip("music21")
+from parse_cache import abc_key, normalise_abc
+
+tune = "X:1\nT:The Kesh\nM:6/8\nK:G\nGAG GAB|ABA ABd|\n"
+second_tune = "X:2\nT:Out on the Ocean\nM:6/8\nK:G\nGED DEG|\n"
+
+
+def test_layout_that_parses_the_same_shares_a_key():
+    assert abc_key(tune) == abc_key(tune.replace("\n", "  \r\n"))
+    assert abc_key(tune) == abc_key("\n\n" + tune + "\n\n")
+    assert abc_key(tune + "\n" + second_tune) == abc_key(tune + "\n\n\n" + second_tune)
+
+
+def test_blank_line_ending_a_tune_kept():
+    # One tune with both bodies against two tunes
+    assert abc_key(tune + second_tune) != abc_key(tune + "\n" + second_tune)
+    # Text after the blank line is not part of the tune
+    assert abc_key(tune + "\nW:words") != abc_key(tune + "W:words")
+    assert normalise_abc(tune + "\n \n" + second_tune) == tune + "\n" + second_tune.rstrip("\n")
@@ -0,0 +1,21 @@
+import pytest
+
+pytest.importorskip("librosa")
+pytest.importorskip("scipy")
+from recognition import fingerprint_settings
+
+
+def test_fingerprint_settings_reads_ahead_a_bounded_window():
+    read = list()
+
+    def settings():
+        for tune_id in range(20):
+            read.append(tune_id)
+            # Not ABC, every setting fails quickly in the worker and is yielded with its error
+            yield tune_id, f"Tune {tune_id}", "4/4", "Dmajor", None
+
+    fingerprints = fingerprint_settings(settings(), workers=2)
+    tune_id, chroma, timings = next(fingerprints)
+    assert (tune_id, chroma) == (0, None) and "error" in timings
+    assert len(read) <= 4
+    assert [tune_id for tune_id, _, _ in fingerprints] == list(range(1, 20))
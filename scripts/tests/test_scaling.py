@@ -0,0 +1,83 @@
+import datetime
+import pathlib
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+import SessionDataManager
+from scrape import session_info_tuples_from_html, set_info_tuplets_from_html
+from standin import StandInDriver
+from synthetic_history import SyntheticHistory
+
+schema_file = pathlib.Path(__file__).resolve().parent.parent.parent / "init.sql"
+base_sessions = 50
+scales = [1, 10]
+
+
+@pytest.fixture(scope="module", params=scales, ids=lambda scale: f"{scale}x")
+def history(request):
+    return SyntheticHistory(base_sessions * request.param, locations=3, tune_pool=2000)
+
+
+@pytest.fixture(scope="module")
+def pages(history):
+    return dict(history.pages())
+
+
+@pytest.fixture(scope="module")
+def report_sdm(history, tmp_path_factory):
+    db_file = tmp_path_factory.mktemp("report") / "sqlite.db"
+    with SessionDataManager.SessionDataManager(
+            ":memory:", initialize_db=True, backend="sqlite", db_file=db_file, schema_file=schema_file) as sdm:
+        for description, address, url in history.location_rows()[1:]:
+            sdm.create_location(description, address, url)
+        sdm.ingest_sessions(list(history.sessions()))
+        yield sdm
+
+
+def test_parse_index(benchmark, history, pages):
+    index_pages = [(f"https://ceol.io/{location['path']}", pages[f"{location['path']}index.html"])
+                   for location in history.locations]
+    links = benchmark(lambda: [list(session_info_tuples_from_html(content, url)) for url, content in index_pages])
+    assert sum(len(location_links) for location_links in links) == len(history.session_list)
+
+
+def test_parse_sessions(benchmark, history, pages):
+    session_pages = [content for path, content in pages.items() if not path.endswith("index.html")]
+    sets = benchmark(lambda: [list(set_info_tuplets_from_html(content)) for content in session_pages])
+    assert len(sets) == len(history.session_list)
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "neo4j"], ids=["sqlite", "standin"])
+def test_ingest(benchmark, history, backend, tmp_path):
+    sessions = list(history.sessions())
+    managers = list()
+
+    def fresh_database():
+        # each round ingests into a new database, only ingest_sessions is timed
+        sdm = SessionDataManager.SessionDataManager(
+            ":memory:", initialize_db=True, driver=StandInDriver() if backend == "neo4j" else None, backend=backend,
+            db_file=tmp_path / f"{backend}{len(managers)}.db", schema_file=schema_file)
+        managers.append(sdm)
+        for description, address, url in history.location_rows()[1:]:
+            sdm.create_location(description, address, url)
+        return (sdm, sessions), {}
+
+    try:
+        benchmark.pedantic(lambda sdm, sessions: sdm.ingest_sessions(sessions), setup=fresh_database, rounds=3)
+    finally:
+        for sdm in managers:
+            sdm.close()
+
+
+def test_report_range(benchmark, history, report_sdm):
+    dates = sorted(session_date for _, session_date, _ in history.session_list)
+    middle = datetime.date.fromisoformat(dates[len(dates) // 2])
+    counts = benchmark(report_sdm.read_tune_play_counts,
+                       middle.replace(month=1, day=1).isoformat(), middle.replace(month=12, day=31).isoformat(), 50)
+    assert 0 < len(counts) <= 50
+
+
+def test_report_top(benchmark, history, report_sdm):
+    dates = sorted(session_date for _, session_date, _ in history.session_list)
+    counts = benchmark(report_sdm.read_tune_play_counts, dates[0], dates[-1], 50)
+    assert len(counts) == 50
@@ -0,0 +1,34 @@
+import pathlib
+import sys
+import pytest
+
+pytest.importorskip("requests")
+import scrape
+from fixture_server import FixtureServer
+from sqlite_backend import SQLiteBackend
+from synthetic_history import SyntheticHistory
+
+schema_file = pathlib.Path(__file__).resolve().parent.parent.parent / "init.sql"
+
+
+def test_sessions_written_every_ingest_every(tmp_path, monkeypatch):
+    history = SyntheticHistory(7, tune_pool=50)
+    history.write_pages(tmp_path / "site")
+    history.write_session_db(tmp_path / "thesession.db")
+
+    batches = list()
+    ingest_sessions = SQLiteBackend.ingest_sessions
+
+    def recording_ingest(self, sessions, batch_size=500):
+        batches.append(len(sessions))
+        return ingest_sessions(self, sessions, batch_size)
+
+    monkeypatch.setattr(SQLiteBackend, "ingest_sessions", recording_ingest)
+    with FixtureServer(tmp_path / "site", quiet=True).start() as server:
+        monkeypatch.setattr(sys, "argv", [
+            "scrape.py", "--url", server.url + history.locations[0]["path"],
+            "--session_db", str(tmp_path / "thesession.db"), "--backend", "sqlite",
+            "--db_file", str(tmp_path / "sessions.db"), "--schema_file", str(schema_file),
+            "--initialize_db", "--batch_size", "500", "--ingest_every", "3"])
+        scrape.main()
+    assert batches == [3, 3, 1]
@@ -0,0 +1,65 @@
+import pathlib
+import pytest
+
+pytest.importorskip("librosa")
+import SessionDataManager
+from session_logger import SetWriter, TuneTracker, session_times
+from synthetic_history import SyntheticHistory
+
+schema_file = pathlib.Path(__file__).resolve().parent.parent.parent / "init.sql"
+
+
+def test_session_times_within_the_day():
+    assert session_times("2024-01-04", "19:00:00", 3.5 * 3600) == ("19:00:00", "22:30:00", "")
+
+
+def test_session_times_past_midnight():
+    start_time, end_time, description = session_times("2024-01-04", "22:00:00", 3 * 3600)
+    assert (start_time, end_time) == ("22:00:00", "23:59:59")
+    assert description == "Recorded until 2024-01-05 01:00:00"
+
+
+def test_tune_tracker_confirms_matches_in_a_row():
+    tracker = TuneTracker(min_score=0.6, confirm=2)
+    assert tracker.update(1, [('a', .9)]) == []
+    assert tracker.update(2, []) == []
+    assert tracker.update(3, [('a', .9)]) == []
+    assert tracker.update(4, [('a', .3)]) == []
+    assert tracker.update(5, [('a', .9)]) == []
+    assert tracker.update(6, [('a', .9)]) == [('tune_start', 5, 'a', .9)]
+
+
+def test_set_writer_stores_the_session_tunes(tmp_path):
+    history = SyntheticHistory(1, tune_pool=5)
+    history.write_session_db(tmp_path / "thesession.db")
+    name_of_4 = history.tunes["4"][0]
+    with SessionDataManager.SessionDataManager(
+            tmp_path / "thesession.db", initialize_db=True, backend="sqlite",
+            db_file=tmp_path / "sessions.db", schema_file=schema_file) as sdm:
+        writer = SetWriter(sdm, 1, "2024-01-04", "22:00:00", 3 * 3600)
+        # A TheSession id, MIDI file names starting with one or naming a tune, and a file that is no tune
+        writer.add(["3", "2-the-humours", name_of_4.lower().replace(" ", "-"), "warm-up"])
+        writer.flush()
+        tunes = {row[0]: row[1] for row in sdm.read_tunes()}
+        stored = [str(tunes[tune_id]) for set_id, (_, set_tunes) in sdm.read_set_lists().items() for tune_id, *_ in set_tunes]
+        session = sdm.backend.conn.execute("SELECT session_date, start_time, end_time, description FROM Session").fetchone()
+    assert stored == ["3", "2", "4"]
+    assert session == ("2024-01-04", "22:00:00", "23:59:59", "Recorded until 2024-01-05 01:00:00")
+
+
+def test_set_writer_moves_a_stream_session_end_on(tmp_path):
+    history = SyntheticHistory(1, tune_pool=5)
+    history.write_session_db(tmp_path / "thesession.db")
+    with SessionDataManager.SessionDataManager(
+            tmp_path / "thesession.db", initialize_db=True, backend="sqlite",
+            db_file=tmp_path / "sessions.db", schema_file=schema_file) as sdm:
+        # A stream's length is not known when the writer is made
+        writer = SetWriter(sdm, 1, "2024-01-04", "21:00:00")
+        read_times = "SELECT start_time, end_time, description FROM Session"
+        writer.add(["1", "2"], 600.0)
+        assert sdm.backend.conn.execute(read_times).fetchall() == [("21:00:00", "21:10:00", "")]
+        writer.add(["3"], 1800.0)
+        assert sdm.backend.conn.execute(read_times).fetchall() == [("21:00:00", "21:30:00", "")]
+        writer.close(4 * 3600)
+        assert sdm.backend.conn.execute(read_times).fetchall() == [
+            ("21:00:00", "23:59:59", "Recorded until 2024-01-05 01:00:00")]
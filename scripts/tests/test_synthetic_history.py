@@ -0,0 +1,16 @@
+from synthetic_history import SyntheticHistory
+
+
+def test_same_seed_same_history():
+    history = SyntheticHistory(40, locations=2, tune_pool=200, seed=3)
+    again = SyntheticHistory(40, locations=2, tune_pool=200, seed=3)
+    assert history.tunes == again.tunes
+    assert history.session_list == again.session_list
+    assert list(history.sessions()) == list(again.sessions())
+    assert list(history.pages()) == list(again.pages())
+
+
+def test_other_seed_other_history():
+    history = SyntheticHistory(40, locations=2, tune_pool=200, seed=3)
+    other = SyntheticHistory(40, locations=2, tune_pool=200, seed=4)
+    assert history.session_list != other.session_list
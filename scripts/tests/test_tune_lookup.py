@@ -0,0 +1,16 @@
+from synthetic_history import SyntheticHistory
+from tune_lookup import TheSessionTunes
+
+
+def test_prefetched_ids_count_as_misses(tmp_path):
+    SyntheticHistory(1, tune_pool=10).write_session_db(tmp_path / "thesession.db")
+    tunes = TheSessionTunes(tmp_path / "thesession.db")
+    try:
+        tunes.prefetch(["1", "2", "3", 2])
+        for tune_id in ("1", "2", "3", "4"):
+            tunes.get(tune_id)
+        tunes.prefetch(["1", "5"])
+        stats = tunes.stats()
+    finally:
+        tunes.close()
+    assert (stats["misses"], stats["prefetched"], stats["hits"]) == (5, 4, 3)
@@ -10,7 +10,6 @@ import argparse
 import pathlib
 import sys
 import sqlglot
-import requests
 import zlib
 import base64
 import string
@@ -20,6 +19,7 @@ puml_template = """@startuml
 !define table(x) class x << (T,#FFAAAA) >>
 !define primary_key(x) <color:red>◆</color> x
 !define foreign_key(x) <color:blue>◇</color> x
+!define index(x) <color:green>▸</color> x
 !function VARCHAR($x) !return "VARCHAR_" + $x
 
 left to right direction
@@ -48,6 +48,7 @@ class SqlTable:
         self.primary_key = None  # primary key column name
         self.fields = dict()  # column_name : type
         self.foreign_keys = dict()  # field : Table::field
+        self.indexes = dict()  # index name : [column_name, ...]
 
         self._extract_table_info()
 
@@ -80,7 +81,7 @@ class SqlTable:
         return f"SqlTable(statement={repr(self.statement)})"
 
     def __str__(self):
-        return f"SqlTable(name={self.name}, primary_key={self.primary_key}, fields={self.fields}, foreign_keys={self.foreign_keys})"
+        return f"SqlTable(name={self.name}, primary_key={self.primary_key}, fields={self.fields}, foreign_keys={self.foreign_keys}, indexes={self.indexes})"
 
     @classmethod
     def parse_sql_file(cls, sql_file_path):
@@ -88,10 +89,20 @@ class SqlTable:
             sql_content = f.read()
 
         statements = sqlglot.parse(sql_content)
+        sql_tables = dict()  # table name : SqlTable
         for statement in statements:
-            # Filter out anything that is not CREATE TABLE
-            if isinstance(statement, sqlglot.expressions.Create):
-                yield cls(statement)
+            # Filter out anything that is not CREATE TABLE or CREATE INDEX
+            if not isinstance(statement, sqlglot.expressions.Create):
+                continue
+            if statement.kind == "TABLE":
+                sql_table = cls(statement)
+                sql_tables[sql_table.name] = sql_table
+            elif statement.kind == "INDEX":
+                # Create(this=Index(this=Identifier(name), table=Table(...), params=IndexParameters(columns=[Ordered(Column)])))
+                index = statement.this
+                columns = [ordered.this.name for ordered in index.args['params'].args['columns']]
+                sql_tables[index.args['table'].name].indexes[index.this.name] = columns
+        yield from sql_tables.values()
 
     template = "table({name}) {{\n{fields}\n}}"
     def to_puml(self):
@@ -106,6 +117,8 @@ class SqlTable:
             if field in self.foreign_keys:
                 continue
             fields.append(f"    {field}: {self.fields[field]}")
+        for index, columns in self.indexes.items():
+            fields.append(f"    index({index}): ({', '.join(columns)})")
         return self.template.format(
             name=self.name,
             fields="\n".join(fields))
@@ -145,13 +158,8 @@ def parse():
     return parser.parse_args()
 
 
-def main():
-    args = parse()
-    print(args)
-
-    sql_tables = list()
-    for sql_table in SqlTable.parse_sql_file(args.sql_file):
-        sql_tables.append(sql_table)
+def schema_puml(sql_tables):
+    """The PlantUml diagram of the tables, their indexes and the foreign key connections"""
     connections = list()
     left_reference = set()
     for sql_table in sql_tables:
@@ -162,15 +170,23 @@ def main():
                 connections.append(f"{sql_table.name}::{fk} --o {reference}")
         if sql_table.primary_key:
             left_reference.add(f"{sql_table.name}::{sql_table.primary_key}")
+    return puml_template.format(
+        tables="\n".join([sql_table.to_puml() for sql_table in sql_tables]),
+        connections="\n".join(connections))
+
+
+def main():
+    args = parse()
+    print(args)
+
+    sql_tables = list(SqlTable.parse_sql_file(args.sql_file))
 
     # Write the puml
     with args.puml_file.open('w', encoding='utf-8') as f:
-        f.write(
-            puml_template.format(
-                tables="\n".join([sql_table.to_puml() for sql_table in sql_tables]),
-                connections="\n".join(connections)))
+        f.write(schema_puml(sql_tables))
 
-    # Create the svg
+    # Create the svg, requests is only loaded for the download
+    import requests
     with args.puml_file.open('r', encoding='utf-8') as f:
         puml = f.read()
     #url = f"http://www.plantuml.com/plantuml/png/{encode_puml(puml)}"